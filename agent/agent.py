@@ -1,8 +1,10 @@
 import argparse
 import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from typing import Any, Optional
 
-import tiktoken
 from beartype import beartype
 from PIL import Image
 
@@ -18,12 +20,47 @@ from browser_env.actions import (
 from browser_env.utils import Observation, StateInfo
 from llms import (
     call_llm,
-    generate_from_huggingface_completion,
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
+    call_llm_streaming,
     lm_config,
 )
-from llms.tokenizers import Tokenizer
+from llms.tokenizers import get_tokenizer
+
+
+@dataclass
+class SamplingStats:
+    steps: int = 0
+    calls: int = 0
+    parse_failures: int = 0
+    # rounds of concurrent retries after a parsing failure
+    speculative_rounds: int = 0
+    # responses that were generated but not used, and their tokens
+    wasted_responses: int = 0
+    wasted_tokens: int = 0
+    # streamed responses cut after the action
+    early_stops: int = 0
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def add_wasted(self, tokens: int) -> None:
+        with self._lock:
+            self.wasted_responses += 1
+            self.wasted_tokens += tokens
+
+    def add_early_stop(self) -> None:
+        with self._lock:
+            self.early_stops += 1
+
+    def summary(self) -> str:
+        failure_rate = self.parse_failures / max(1, self.calls)
+        return (
+            f"steps={self.steps}, calls={self.calls}, "
+            f"parse_failures={self.parse_failures} ({failure_rate:.1%}), "
+            f"speculative_rounds={self.speculative_rounds}, "
+            f"wasted_responses={self.wasted_responses}, "
+            f"wasted_tokens={self.wasted_tokens}, "
+            f"early_stops={self.early_stops}"
+        )
 
 
 class Agent:
@@ -125,6 +162,7 @@ class PromptAgent(Agent):
             self.multimodal_inputs = True
         else:
             self.multimodal_inputs = False
+        self.sampling_stats = SamplingStats()
 
     def set_action_set_tag(self, tag: str) -> None:
         self.action_set_tag = tag
@@ -168,40 +206,125 @@ class PromptAgent(Agent):
                 trajectory, intent, meta_data
             )
         lm_config = self.lm_config
+        max_retry = lm_config.gen_config["max_retry"]
+        samples = lm_config.gen_config.get("speculative_samples", 1)
+        self.sampling_stats.steps += 1
         n = 0
         while True:
-            response = call_llm(lm_config, prompt)
-            force_prefix = self.prompt_constructor.instruction[
-                "meta_data"
-            ].get("force_prefix", "")
-            response = f"{force_prefix}{response}"
-            if output_response:
-                print(f'Agent: {response}', flush=True)
-            n += 1
-            try:
-                parsed_response = self.prompt_constructor.extract_action(
-                    response
-                )
-                if self.action_set_tag == "id_accessibility_tree":
-                    action = create_id_based_action(parsed_response)
-                elif self.action_set_tag == "playwright":
-                    action = create_playwright_action(parsed_response)
-                elif self.action_set_tag == "som":
-                    action = create_id_based_action(parsed_response)
-                else:
-                    raise ValueError(
-                        f"Unknown action type {self.action_set_tag}"
-                    )
+            # the first generation is alone, the retries after a parsing
+            # failure are sampled `samples` at a time
+            batch = 1 if n == 0 else max(1, min(samples, max_retry - n))
+            action, response, n_generated = self._sample(
+                prompt, batch, output_response, first_sample=n
+            )
+            n += n_generated
+            if action is not None:
+                break
+            if n >= max_retry:
+                action = create_none_action()
                 action["raw_prediction"] = response
                 break
-            except ActionParsingError as e:
-                if n >= lm_config.gen_config["max_retry"]:
-                    action = create_none_action()
-                    action["raw_prediction"] = response
-                    break
 
         return action
 
+    def _parse_response(self, response: str) -> Action:
+        parsed_response = self.prompt_constructor.extract_action(response)
+        if self.action_set_tag == "id_accessibility_tree":
+            action = create_id_based_action(parsed_response)
+        elif self.action_set_tag == "playwright":
+            action = create_playwright_action(parsed_response)
+        elif self.action_set_tag == "som":
+            action = create_id_based_action(parsed_response)
+        else:
+            raise ValueError(f"Unknown action type {self.action_set_tag}")
+        action["raw_prediction"] = response
+        return action
+
+    def _generate(self, prompt: Any, sample: int = 0) -> str:
+        force_prefix = self.prompt_constructor.instruction["meta_data"].get(
+            "force_prefix", ""
+        )
+        detector = None
+        if self.lm_config.gen_config.get("stream_actions"):
+            detector = self.prompt_constructor.action_detector()
+        if detector is None:
+            response = call_llm(self.lm_config, prompt, sample)
+        else:
+            # stop generating once the action is complete
+            detector.feed(force_prefix)
+            response = call_llm_streaming(
+                self.lm_config, prompt, detector.feed, sample
+            )
+            if detector.complete:
+                self.sampling_stats.add_early_stop()
+        return f"{force_prefix}{response}"
+
+    def _sample(
+        self,
+        prompt: Any,
+        batch: int,
+        output_response: bool,
+        first_sample: int = 0,
+    ) -> tuple[Action | None, str, int]:
+        """Generate `batch` responses concurrently, as the samples numbered
+        from `first_sample` (each with its own seed), and return the action
+        of the first one that parses, the last response and the number of
+        generations used. The generations still running are left to finish
+        in the background and counted as wasted."""
+        stats = self.sampling_stats
+        if batch == 1:
+            stats.calls += 1
+            response = self._generate(prompt, first_sample)
+            if output_response:
+                print(f"Agent: {response}", flush=True)
+            try:
+                return self._parse_response(response), response, 1
+            except ActionParsingError:
+                stats.parse_failures += 1
+                stats.add_wasted(self._count_tokens(response))
+                return None, response, 1
+
+        stats.speculative_rounds += 1
+        executor = ThreadPoolExecutor(max_workers=batch)
+        pending: set[Future[str]] = {
+            executor.submit(self._generate, prompt, first_sample + i)
+            for i in range(batch)
+        }
+        stats.calls += batch
+        action: Action | None = None
+        response = ""
+        n_done = 0
+        try:
+            while pending and action is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    response = future.result()
+                    n_done += 1
+                    if output_response:
+                        print(f"Agent: {response}", flush=True)
+                    if action is not None:
+                        # finished together with the one that was used
+                        stats.add_wasted(self._count_tokens(response))
+                        continue
+                    try:
+                        action = self._parse_response(response)
+                    except ActionParsingError:
+                        stats.parse_failures += 1
+                        stats.add_wasted(self._count_tokens(response))
+        finally:
+            for future in pending:
+                future.add_done_callback(self._count_abandoned)
+            executor.shutdown(wait=False, cancel_futures=True)
+        return action, response, n_done
+
+    def _count_tokens(self, response: str) -> int:
+        return self.prompt_constructor.truncator.count_tokens(response)
+
+    def _count_abandoned(self, future: Future[str]) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.sampling_stats.add_wasted(self._count_tokens(future.result()))
+
     def reset(self, test_config_file: str) -> None:
         pass
 
@@ -215,7 +338,7 @@ def construct_agent(args: argparse.Namespace, captioning_fn=None) -> Agent:
     elif args.agent_type == "prompt":
         with open(args.instruction_path) as f:
             constructor_type = json.load(f)["meta_data"]["prompt_constructor"]
-        tokenizer = Tokenizer(args.provider, args.model)
+        tokenizer = get_tokenizer(args.provider, args.model)
         prompt_constructor = eval(constructor_type)(
             args.instruction_path, lm_config=llm_config, tokenizer=tokenizer
         )
@@ -0,0 +1,264 @@
+"""Fit an over-long accessibility tree into the observation budget by keeping
+the nodes most likely to matter for the task, instead of only its head.
+
+Each node is scored by the word overlap of its line (and of the lines around
+it) with the intent, by whether it can be interacted with, and by how close
+it is to the viewport. The best nodes are kept together with their
+ancestors, lines are copied verbatim so element IDs do not change, and every
+run of dropped lines is replaced by a one-line summary, which counts against
+the budget too.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable
+
+NODE_PATTERN = re.compile(r"^(\t*)\[(\d+)\] (\S+)")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+INTERACTIVE_ROLES = {
+    "link",
+    "button",
+    "textbox",
+    "searchbox",
+    "combobox",
+    "checkbox",
+    "radio",
+    "menuitem",
+    "tab",
+    "option",
+    "spinbutton",
+    "slider",
+    "switch",
+}
+
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "what", "which",
+    "are", "was", "were", "has", "have", "how", "many", "much", "into",
+    "onto", "all", "any", "its", "their", "them", "then", "than", "who",
+    "whom", "whose", "when", "where", "there", "here", "about", "please",
+    "find", "show", "tell", "give", "get", "list", "can", "you", "your",
+}
+
+LEXICAL_WEIGHT = 4.0
+CONTEXT_WEIGHT = 3.0
+INTERACTIVE_WEIGHT = 1.0
+VIEWPORT_WEIGHT = 1.0
+
+
+def words(text: str) -> set[str]:
+    return {
+        w
+        for w in WORD_PATTERN.findall(text.lower())
+        if len(w) > 2 and w not in STOPWORDS
+    }
+
+
+@dataclass
+class _Node:
+    line_idx: int
+    depth: int
+    element_id: str
+    role: str
+    parent: int | None
+    score: float = 0.0
+
+
+class AccessibilityTreeCompressor(object):
+    """Compress a text observation to `max_length` tokens, as counted by
+    `count_tokens`. Observations that already fit are returned unchanged."""
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        viewport_height: float = 2048,
+    ) -> None:
+        self.count_tokens = count_tokens
+        self.viewport_height = viewport_height
+        # tokens kept and dropped by the last call
+        self.last_kept_tokens = 0
+        self.last_dropped_tokens = 0
+
+    def __call__(
+        self,
+        obs: str,
+        intent: str,
+        max_length: int,
+        obs_nodes_info: dict[str, Any] | None = None,
+    ) -> str:
+        self.last_dropped_tokens = 0
+        # fewer bytes than tokens in the budget, see ObservationTruncator
+        if not max_length or len(obs.encode("utf-8")) < max_length:
+            return obs
+
+        lines = obs.split("\n")
+        costs = [self.count_tokens(line) + 1 for line in lines]
+        if sum(costs) <= max_length:
+            return obs
+        nodes = self._parse(lines)
+        if not nodes:
+            return obs
+        self._score(nodes, lines, intent, obs_nodes_info or {})
+
+        # a node costs its line and the lines continuing it
+        bounds = [node.line_idx for node in nodes] + [len(lines)]
+        node_costs = [
+            sum(costs[bounds[i] : bounds[i + 1]]) for i in range(len(nodes))
+        ]
+        # every run of dropped nodes is replaced by a summary line, which is
+        # charged at the cost of the longest one possible
+        summary_cost = self._summary_cost(nodes)
+
+        # the tab list before the tree is always kept. All the nodes are
+        # dropped at first, which is one run to summarize.
+        first_node_line = nodes[0].line_idx
+        head_cost = sum(costs[:first_node_line])
+        budget = max_length - head_cost - summary_cost
+        kept = [False] * len(nodes)
+        order = sorted(range(len(nodes)), key=lambda i: (-nodes[i].score, i))
+        for i in order:
+            if budget <= 0:
+                break
+            # the node and the ancestors that are not kept yet
+            path = []
+            cursor: int | None = i
+            while cursor is not None and not kept[cursor]:
+                path.append(cursor)
+                cursor = nodes[cursor].parent
+            if not path:
+                continue
+            cost = sum(node_costs[j] for j in path) + summary_cost * (
+                self._new_runs(kept, path)
+            )
+            if cost <= budget:
+                for j in path:
+                    kept[j] = True
+                budget -= cost
+
+        # copy the kept lines in order, summarizing the dropped runs
+        by_line = {node.line_idx: node for node in nodes}
+        out: list[str] = lines[:first_node_line]
+        dropped: list[int] = []
+        for i, node in enumerate(nodes):
+            if not kept[i]:
+                dropped.append(node.line_idx)
+                continue
+            if dropped:
+                out.append(self._summarize(dropped, by_line))
+                dropped = []
+            out.extend(lines[bounds[i] : bounds[i + 1]])
+        if dropped:
+            out.append(self._summarize(dropped, by_line))
+
+        self.last_kept_tokens = head_cost + sum(
+            cost for cost, k in zip(node_costs, kept) if k
+        )
+        self.last_dropped_tokens = sum(costs) - self.last_kept_tokens
+        return "\n".join(out)
+
+    @staticmethod
+    def _new_runs(kept: list[bool], path: list[int]) -> int:
+        """How many more runs of dropped nodes there are once `path` is
+        kept"""
+        now_kept = set()
+
+        def dropped(j: int) -> bool:
+            return 0 <= j < len(kept) and not kept[j] and j not in now_kept
+
+        runs = 0
+        # keep the nodes one by one
+        for j in sorted(path):
+            left, right = dropped(j - 1), dropped(j + 1)
+            now_kept.add(j)
+            if left and right:
+                # splits a run in two
+                runs += 1
+            elif not left and not right:
+                # was a run on its own
+                runs -= 1
+        return runs
+
+    def _summary_cost(self, nodes: list[_Node]) -> int:
+        roles = sorted({node.role for node in nodes}, key=len, reverse=True)
+        count = len(nodes)
+        role_str = ", ".join(f"{count} {role}" for role in roles[:3])
+        indent = "\t" * max(node.depth for node in nodes)
+        return (
+            self.count_tokens(f"{indent}[...] {count} nodes omitted ({role_str})")
+            + 1
+        )
+
+    @staticmethod
+    def _parse(lines: list[str]) -> list[_Node]:
+        nodes: list[_Node] = []
+        # index in `nodes` of the last node seen at each depth
+        stack: list[int] = []
+        for line_idx, line in enumerate(lines):
+            match = NODE_PATTERN.match(line)
+            if not match:
+                continue
+            depth = len(match.group(1))
+            del stack[depth:]
+            parent = stack[-1] if stack else None
+            nodes.append(
+                _Node(
+                    line_idx=line_idx,
+                    depth=depth,
+                    element_id=match.group(2),
+                    role=match.group(3),
+                    parent=parent,
+                )
+            )
+            stack.append(len(nodes) - 1)
+        return nodes
+
+    def _score(
+        self,
+        nodes: list[_Node],
+        lines: list[str],
+        intent: str,
+        obs_nodes_info: dict[str, Any],
+    ) -> None:
+        intent_words = words(intent)
+        lexical = [
+            len(words(lines[node.line_idx]) & intent_words)
+            / max(1, len(intent_words))
+            for node in nodes
+        ]
+        # best lexical score within each subtree, children come after parents
+        subtree = list(lexical)
+        for i in range(len(nodes) - 1, -1, -1):
+            parent = nodes[i].parent
+            if parent is not None:
+                subtree[parent] = max(subtree[parent], subtree[i])
+
+        for i, node in enumerate(nodes):
+            # siblings of a matching node, e.g. the link of a matching product
+            context = subtree[node.parent] if node.parent is not None else 0.0
+            node.score = (
+                LEXICAL_WEIGHT * lexical[i]
+                + CONTEXT_WEIGHT * context
+                + INTERACTIVE_WEIGHT * (node.role in INTERACTIVE_ROLES)
+                + VIEWPORT_WEIGHT
+                * self._viewport_score(obs_nodes_info.get(node.element_id))
+            )
+
+    def _viewport_score(self, node_info: dict[str, Any] | None) -> float:
+        """1 inside the viewport, decaying to 0 four screens below it"""
+        if not node_info or not node_info.get("union_bound"):
+            return 0.0
+        y = node_info["union_bound"][1]
+        if y < 0:
+            return 0.5
+        if y < self.viewport_height:
+            return 1.0
+        return max(0.0, 1.0 - (y - self.viewport_height) / (4 * self.viewport_height))
+
+    @staticmethod
+    def _summarize(line_indices: list[int], by_line: dict[int, _Node]) -> str:
+        dropped = [by_line[line_idx] for line_idx in line_indices]
+        depth = min(node.depth for node in dropped)
+        roles = Counter(node.role for node in dropped).most_common(3)
+        role_str = ", ".join(f"{count} {role}" for role, count in roles)
+        indent = "\t" * depth
+        return f"{indent}[...] {len(dropped)} nodes omitted ({role_str})"
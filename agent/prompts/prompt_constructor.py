@@ -1,16 +1,27 @@
+import base64
 import json
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, TypedDict
+from typing import Any, NotRequired, TypedDict
 from PIL import Image
 
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
-from browser_env.utils import StateInfo, pil_to_b64, pil_to_vertex
+from browser_env.utils import (
+    StateInfo,
+    pil_to_b64,
+    pil_to_png_bytes,
+    pil_to_vertex,
+    png_bytes_to_b64,
+    png_bytes_to_vertex,
+)
 from llms import lm_config
-from llms.tokenizers import Tokenizer
+from llms.tokenizers import ObservationTruncator, Tokenizer
 from llms.utils import APIInput
 
+from .obs_compression import AccessibilityTreeCompressor
+
 
 class Instruction(TypedDict):
     """Instruction for constructing prompt"""
@@ -19,6 +30,58 @@ class Instruction(TypedDict):
     examples: list[tuple[str, str]]
     template: str
     meta_data: dict[str, Any]
+    # example screenshot path -> PNG data URL, written by `to_json`
+    example_images: NotRequired[dict[str, str]]
+
+
+# Compiled few-shot prefixes, keyed by constructor class, model and
+# instruction content. See `PromptConstructor._get_prefix`.
+_PREFIX_CACHE: dict[tuple[Any, ...], Any] = {}
+
+
+@lru_cache(maxsize=None)
+def encode_example_image(path: str) -> bytes:
+    """PNG bytes of an example screenshot, as `pil_to_b64` would encode it"""
+    return pil_to_png_bytes(Image.open(path))
+
+
+class ActionStreamDetector(object):
+    """Follow a streamed response and tell when it contains a complete
+    action, i.e. an opening and a closing `action_splitter`.
+
+    The action is the first one in the response, so once it is complete the
+    rest of the generation cannot change what `extract_action` returns. Each
+    chunk is only scanned from where the previous search stopped.
+    """
+
+    def __init__(self, action_splitter: str) -> None:
+        self.action_splitter = action_splitter
+        self.text = ""
+        self.complete = False
+        self._open = -1
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> bool:
+        """Add `chunk` to the response, True once the action is complete"""
+        self.text += chunk
+        if self.complete:
+            return True
+        splitter = self.action_splitter
+        if self._open < 0:
+            self._open = self.text.find(splitter, self._scan_from)
+            if self._open < 0:
+                # a splitter may be cut between two chunks
+                self._scan_from = max(0, len(self.text) - len(splitter) + 1)
+                return False
+            self._scan_from = self._open + len(splitter)
+        close = self.text.find(splitter, self._scan_from)
+        if close < 0:
+            self._scan_from = max(
+                self._scan_from, len(self.text) - len(splitter) + 1
+            )
+            return False
+        self.complete = True
+        return True
 
 
 class PromptConstructor(object):
@@ -35,13 +98,34 @@ class PromptConstructor(object):
         instruction["examples"] = [tuple(e) for e in instruction["examples"]]
         self.instruction: Instruction = instruction
         self.tokenizer = tokenizer
+        self.truncator = ObservationTruncator(
+            tokenizer,
+            lm_config.provider,
+            mode=lm_config.gen_config.get("obs_truncation", "tokens"),
+        )
+        self.compressor = AccessibilityTreeCompressor(self.truncator.count_tokens)
+
+    def _get_prefix(self, intro: str, examples: list[tuple[str, ...]]) -> Any:
+        """The static part of the prompt (intro and few-shot examples),
+        compiled once per process for each instruction and model.
+
+        The compiled prefix is shared: callers must copy it, not modify it.
+        """
+        key = (
+            type(self),
+            self.lm_config.provider,
+            self.lm_config.mode,
+            self.lm_config.model,
+            intro,
+            tuple(examples),
+        )
+        if key not in _PREFIX_CACHE:
+            _PREFIX_CACHE[key] = self._compile_prefix(intro, examples)
+        return _PREFIX_CACHE[key]
 
-    def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
-    ) -> APIInput:
-
-        """Return the require format for an API"""
-        message: list[dict[str, str]] | str
+    def _compile_prefix(
+        self, intro: str, examples: list[tuple[str, str]]
+    ) -> tuple[dict[str, Any], ...] | str:
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
                 message = [{"role": "system", "content": intro}]
@@ -60,18 +144,15 @@ class PromptConstructor(object):
                             "content": y,
                         }
                     )
-                message.append({"role": "user", "content": current})
-                return message
+                return tuple(message)
             elif self.lm_config.mode == "completion":
-                message = f"{intro}\n\n"
-                message += "Here are a few examples:\n"
+                prefix = f"{intro}\n\n"
+                prefix += "Here are a few examples:\n"
                 for example in examples:
-                    message += f"Observation\n:{example[0]}\n\n"
-                    message += f"Action: {example[1]}\n\n"
-                message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
-                return message
+                    prefix += f"Observation\n:{example[0]}\n\n"
+                    prefix += f"Action: {example[1]}\n\n"
+                prefix += "Now make prediction given the observation\n\n"
+                return prefix
             else:
                 raise ValueError(
                     f"OpenAI models do not support mode {self.lm_config.mode}"
@@ -91,16 +172,12 @@ class PromptConstructor(object):
                             examples[0][1],
                         )
                     ] + examples[1:]
-                    message = "".join(
+                    return "".join(
                         [
                             f"{BOS}{B_INST} {x.strip()} {E_INST} {y.strip()} {EOS}"
                             for (x, y) in examples
                         ]
                     )
-                    # add the current observation
-                    message += f"{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
-
-                    return message
                 else:
                     raise ValueError("Only chat mode is supported for Llama-2")
             else:
@@ -112,6 +189,24 @@ class PromptConstructor(object):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
+    def get_lm_api_input(
+        self, intro: str, examples: list[tuple[str, str]], current: str
+    ) -> APIInput:
+
+        """Return the require format for an API"""
+        prefix = self._get_prefix(intro, examples)
+        if "openai" in self.lm_config.provider:
+            if self.lm_config.mode == "chat":
+                return [*prefix, {"role": "user", "content": current}]
+            else:
+                return f"{prefix}Observation\n:{current}\n\nAction:"
+        else:
+            # Llama-2 chat, the only huggingface format `_compile_prefix` accepts
+            B_INST, E_INST = "[INST]", "[/INST]"
+            BOS = "<s>"
+            # add the current observation
+            return f"{prefix}{BOS}{B_INST} {current.strip()} {E_INST} {self.instruction['meta_data'].get('force_prefix', '')}"
+
     def construct(
         self,
         trajectory: Trajectory,
@@ -120,6 +215,21 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
+    def compress_observation(
+        self, obs: str, intent: str, state_info: StateInfo
+    ) -> str:
+        """Keep the nodes most relevant to `intent` when the observation is
+        over budget, if enabled with `obs_compression`"""
+        max_obs_length = self.lm_config.gen_config["max_obs_length"]
+        if not (
+            max_obs_length
+            and self.lm_config.gen_config.get("obs_compression", False)
+        ):
+            return obs
+        obs_metadata = state_info["info"].get("observation_metadata", {})
+        obs_nodes_info = obs_metadata.get("text", {}).get("obs_nodes_info", {})
+        return self.compressor(obs, intent, max_obs_length, obs_nodes_info)
+
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
         for i, j in URL_MAPPINGS.items():
@@ -140,6 +250,14 @@ class PromptConstructor(object):
     def _extract_action(self, response: str) -> str:
         raise NotImplementedError
 
+    def action_detector(self) -> ActionStreamDetector | None:
+        """A detector for streamed responses, None if the instruction does
+        not delimit the action"""
+        action_splitter = self.instruction["meta_data"].get("action_splitter")
+        if not action_splitter:
+            return None
+        return ActionStreamDetector(action_splitter)
+
     def extract_action(self, response: str) -> str:
         response = self._extract_action(response)
         response = self.map_url_to_local(response)
@@ -171,13 +289,8 @@ class DirectPromptConstructor(PromptConstructor):
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            if self.lm_config.provider == "google":
-                print("NOTE: This is a Gemini model, so we use characters instead of tokens for max_obs_length.")
-                obs = obs[:max_obs_length]
-            else:
-                obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.compress_observation(obs, intent, state_info)
+        obs = self.truncator(obs, self.lm_config.gen_config["max_obs_length"])
 
         page = state_info["info"]["page"]
         url = page.url
@@ -233,13 +346,8 @@ class CoTPromptConstructor(PromptConstructor):
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            if self.lm_config.provider == "google":
-                print("NOTE: This is a Gemini model, so we use characters instead of tokens for max_obs_length.")
-                obs = obs[:max_obs_length]
-            else:
-                obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.compress_observation(obs, intent, state_info)
+        obs = self.truncator(obs, self.lm_config.gen_config["max_obs_length"])
 
         page = state_info["info"]["page"]
         url = page.url
@@ -296,13 +404,8 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            if self.lm_config.provider == "google":
-                print("NOTE: This is a Gemini model, so we use characters instead of tokens for max_obs_length.")
-                obs = obs[:max_obs_length]
-            else:
-                obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.compress_observation(obs, intent, state_info)
+        obs = self.truncator(obs, self.lm_config.gen_config["max_obs_length"])
 
         page = state_info["info"]["page"]
         url = page.url
@@ -321,26 +424,26 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
         )
         return prompt
 
-    def get_lm_api_input(
-        self,
-        intro: str,
-        examples: list[tuple[str, str, str]],
-        current: str,
-        page_screenshot_img: Image.Image,
-        images: list[Image.Image],
-    ) -> APIInput:
-        """Return the require format for an API"""
-        message: list[dict[str, str]] | str | list[str | Image.Image]
+    def _example_image_bytes(self, path: str) -> bytes:
+        """PNG bytes of an example screenshot, pre-encoded by `to_json` if
+        the instruction file has them"""
+        encoded = self.instruction.get("example_images", {}).get(path)
+        if encoded:
+            return base64.b64decode(encoded.split(",", 1)[1])
+        return encode_example_image(path)
+
+    def _compile_prefix(  # type: ignore[override]
+        self, intro: str, examples: list[tuple[str, str, str]]
+    ) -> tuple[Any, ...]:
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
-                message = [
+                message: list[Any] = [
                     {
                         "role": "system",
                         "content": [{"type": "text", "text": intro}],
                     }
                 ]
                 for (x, y, z) in examples:
-                    example_img = Image.open(z)
                     message.append(
                         {
                             "role": "system",
@@ -354,7 +457,9 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
                                 {
                                     "type": "image_url",
                                     "image_url": {
-                                        "url": pil_to_b64(example_img)
+                                        "url": png_bytes_to_b64(
+                                            self._example_image_bytes(z)
+                                        )
                                     },
                                 },
                             ],
@@ -367,36 +472,7 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
                             "content": [{"type": "text", "text": y}],
                         }
                     )
-
-                # Encode images and page_screenshot_img as base64 strings.
-                current_prompt = current
-                content = [
-                    {
-                        "type": "text",
-                        "text": "IMAGES: (1) current page screenshot",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": pil_to_b64(page_screenshot_img)},
-                    },
-                ]
-                for image_i, image in enumerate(images):
-                    content.extend(
-                        [
-                            {
-                                "type": "text",
-                                "text": f"({image_i+2}) input image {image_i+1}",
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": pil_to_b64(image)},
-                            },
-                        ]
-                    )
-                content = [{"type": "text", "text": current_prompt}] + content
-
-                message.append({"role": "user", "content": content})
-                return message
+                return tuple(message)
             else:
                 raise ValueError(
                     f"GPT-4V models do not support mode {self.lm_config.mode}"
@@ -408,34 +484,17 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
                     "Here are a few examples:",
                 ]
                 for (x, y, z) in examples:
-                    example_img = Image.open(z)
                     message.append(f"Observation\n:{x}\n")
                     message.extend(
                         [
                             "IMAGES:",
                             "(1) current page screenshot:",
-                            pil_to_vertex(example_img),
+                            png_bytes_to_vertex(self._example_image_bytes(z)),
                         ]
                     )
                     message.append(f"Action: {y}")
                 message.append("Now make prediction given the observation")
-                message.append(f"Observation\n:{current}\n")
-                message.extend(
-                    [
-                        "IMAGES:",
-                        "(1) current page screenshot:",
-                        pil_to_vertex(page_screenshot_img),
-                    ]
-                )
-                for image_i, image in enumerate(images):
-                    message.extend(
-                        [
-                            f"({image_i+2}) input image {image_i+1}",
-                            pil_to_vertex(image),
-                        ]
-                    )
-                message.append("Action:")
-                return message
+                return tuple(message)
             else:
                 raise ValueError(
                     f"Gemini models do not support mode {self.lm_config.mode}"
@@ -444,3 +503,65 @@ class MultimodalCoTPromptConstructor(CoTPromptConstructor):
             raise NotImplementedError(
                 f"Provider {self.lm_config.provider} not implemented"
             )
+
+    def get_lm_api_input(
+        self,
+        intro: str,
+        examples: list[tuple[str, str, str]],
+        current: str,
+        page_screenshot_img: Image.Image,
+        images: list[Image.Image],
+    ) -> APIInput:
+        """Return the require format for an API"""
+        prefix = self._get_prefix(intro, examples)
+        message: list[dict[str, str]] | str | list[str | Image.Image]
+        if "openai" in self.lm_config.provider:
+            # Encode images and page_screenshot_img as base64 strings.
+            current_prompt = current
+            content = [
+                {
+                    "type": "text",
+                    "text": "IMAGES: (1) current page screenshot",
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": pil_to_b64(page_screenshot_img)},
+                },
+            ]
+            for image_i, image in enumerate(images):
+                content.extend(
+                    [
+                        {
+                            "type": "text",
+                            "text": f"({image_i+2}) input image {image_i+1}",
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": pil_to_b64(image)},
+                        },
+                    ]
+                )
+            content = [{"type": "text", "text": current_prompt}] + content
+
+            message = [*prefix, {"role": "user", "content": content}]
+            return message
+        else:
+            # Gemini completion, the only other format `_compile_prefix` accepts
+            message = list(prefix)
+            message.append(f"Observation\n:{current}\n")
+            message.extend(
+                [
+                    "IMAGES:",
+                    "(1) current page screenshot:",
+                    pil_to_vertex(page_screenshot_img),
+                ]
+            )
+            for image_i, image in enumerate(images):
+                message.extend(
+                    [
+                        f"({image_i+2}) input image {image_i+1}",
+                        pil_to_vertex(image),
+                    ]
+                )
+            message.append("Action:")
+            return message
@@ -1,11 +1,25 @@
+import argparse
 import glob
 import importlib
 import json
 import os
 
 
+def encode_example_images(prompt: dict) -> dict[str, str]:
+    """PNG data URLs of the example screenshots, so the prompt constructor
+    does not have to encode them when it compiles the few-shot prefix"""
+    from agent.prompts.prompt_constructor import encode_example_image
+    from browser_env.utils import png_bytes_to_b64
+
+    return {
+        example[2]: png_bytes_to_b64(encode_example_image(example[2]))
+        for example in prompt["examples"]
+        if len(example) > 2
+    }
+
+
 # use the current directory as the root
-def run() -> None:
+def run(encode_images: bool = False) -> None:
     """Convert all python files in agent/prompts to json files in agent/prompts/jsons
 
     Python files are easiser to edit
@@ -15,6 +29,10 @@ def run() -> None:
         base_name = os.path.basename(p_file).replace(".py", "")
         module = importlib.import_module(f"agent.prompts.raw.{base_name}")
         prompt = module.prompt
+        if encode_images:
+            example_images = encode_example_images(prompt)
+            if example_images:
+                prompt = {**prompt, "example_images": example_images}
         # save the prompt as a json file
         os.makedirs("agent/prompts/jsons", exist_ok=True)
         with open(f"agent/prompts/jsons/{base_name}.json", "w+") as f:
@@ -23,4 +41,11 @@ def run() -> None:
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--encode_images",
+        action="store_true",
+        help="Store the example screenshots as PNG data URLs in the json files",
+    )
+    args = parser.parse_args()
+    run(encode_images=args.encode_images)
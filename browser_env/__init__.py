@@ -34,6 +34,7 @@ from .actions import (
 from .async_envs import AsyncScriptBrowserEnv
 from .envs import ScriptBrowserEnv
 from .processors import ObservationMetadata
+from .tracing import TracePolicy
 from .trajectory import Trajectory
 from .utils import DetachedPage, StateInfo
 
@@ -73,4 +74,5 @@ __all__ = [
     "create_stop_action",
     "ActionParsingError",
     "Trajectory",
+    "TracePolicy",
 ]
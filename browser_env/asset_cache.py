@@ -0,0 +1,296 @@
+"""Route interception that blocks unused resources and serves static assets
+from a disk cache shared by every context and worker process.
+
+Enabling `context.route` turns off Chromium's HTTP cache, and every task runs
+in a fresh context anyway, so without this layer each task re-downloads the
+same CSS, JS, fonts and product images from the local sites.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from playwright.sync_api import BrowserContext, Error, Route
+
+CACHEABLE_RESOURCE_TYPES = ["stylesheet", "script", "font", "image"]
+
+# Headers that describe the transfer rather than the content. The stored body
+# is already decoded, so replaying them would corrupt the response.
+DROPPED_HEADERS = ["content-encoding", "content-length", "transfer-encoding"]
+
+# Hop-by-hop headers, and headers that belong to the session of the request
+# that was cached. They are never stored or replayed to another context,
+# where a replayed Set-Cookie would overwrite the login cookies.
+UNCACHED_HEADERS = [
+    "set-cookie",
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "upgrade",
+    "www-authenticate",
+]
+
+# Rules under "*" apply to every request; rules under a site name only to
+# requests whose URL starts with that site's base URL.
+DEFAULT_RESOURCE_RULES: dict[str, dict[str, list[str]]] = {
+    "*": {
+        "block_url_patterns": [
+            "google-analytics.com",
+            "googletagmanager.com",
+            "doubleclick.net",
+            "facebook.net",
+            "hotjar.com",
+        ],
+        "block_resource_types": [],
+    },
+}
+
+SITE_URL_VARIABLES = {
+    "shopping_admin": "SHOPPING_ADMIN",
+    "shopping": "SHOPPING",
+    "reddit": "REDDIT",
+    "classifieds": "CLASSIFIEDS",
+    "gitlab": "GITLAB",
+    "wikipedia": "WIKIPEDIA",
+    "map": "MAP",
+    "homepage": "HOMEPAGE",
+}
+
+
+def default_site_urls() -> dict[str, str]:
+    """Base URL of each site configured in env_config"""
+    from browser_env import env_config
+
+    site_urls = {}
+    for site, variable in SITE_URL_VARIABLES.items():
+        url = getattr(env_config, variable, "")
+        if url:
+            site_urls[site] = url
+    return site_urls
+
+
+def load_resource_rules(path: str | Path | None) -> dict[str, Any]:
+    """Load blocking rules from a json file, on top of the default rules"""
+    rules = {k: dict(v) for k, v in DEFAULT_RESOURCE_RULES.items()}
+    if path:
+        with open(path, "r") as f:
+            for site, site_rules in json.load(f).items():
+                rules.setdefault(site, {}).update(site_rules)
+    return rules
+
+
+def is_shareable(headers: dict[str, str]) -> bool:
+    """Whether a response may be served to other contexts: it sets no
+    cookies and is not private to the user"""
+    headers = {k.lower(): v for k, v in headers.items()}
+    cache_control = headers.get("cache-control", "")
+    return (
+        "set-cookie" not in headers
+        and "no-store" not in cache_control
+        and "private" not in cache_control
+    )
+
+
+@dataclass
+class AssetCacheStats:
+    requests: int = 0
+    hits: int = 0
+    misses: int = 0
+    revalidated: int = 0
+    blocked: int = 0
+    # fetches that failed and were left to the browser
+    fetch_errors: int = 0
+    bytes_saved: int = 0
+    bytes_fetched: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.requests}, hit_rate={self.hit_rate:.1%}, "
+            f"blocked={self.blocked}, revalidated={self.revalidated}, "
+            f"fetch_errors={self.fetch_errors}, "
+            f"saved={self.bytes_saved / 1e6:.1f}MB, "
+            f"fetched={self.bytes_fetched / 1e6:.1f}MB"
+        )
+
+
+class AssetCache:
+    """Content of static responses on disk, keyed by URL.
+
+    Each entry is a body file plus a json file with the status, headers and
+    ETag. Writes go through a temporary file and `os.replace`, so several
+    processes can share the same directory without locking.
+    """
+
+    def __init__(
+        self, cache_dir: str | Path, max_entry_bytes: int = 5_000_000
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entry_bytes = max_entry_bytes
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        folder = self.cache_dir / key[:2]
+        return folder / f"{key}.json", folder / f"{key}.body"
+
+    def get(self, url: str) -> tuple[dict[str, Any], bytes] | None:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        # the body and the metadata are replaced separately
+        if meta.get("url") != url or meta.get("size") != len(body):
+            return None
+        return meta, body
+
+    def put(
+        self, url: str, status: int, headers: dict[str, str], body: bytes
+    ) -> bool:
+        if len(body) > self.max_entry_bytes or not is_shareable(headers):
+            return False
+        headers = {
+            k: v
+            for k, v in headers.items()
+            if k.lower() not in DROPPED_HEADERS + UNCACHED_HEADERS
+        }
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": headers,
+            "etag": headers.get("etag", ""),
+            "size": len(body),
+        }
+        meta_path, body_path = self._paths(url)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        self._atomic_write(body_path, body)
+        self._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        return True
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+@dataclass
+class ResourceRouter:
+    """Installs the blocking rules and the asset cache on a context.
+
+    Only GET requests for static resource types that belong to one of the
+    configured sites are cached. With `revalidate`, cached entries that have
+    an ETag are checked with `If-None-Match` before being served; otherwise
+    they are served directly, which is safe for the static benchmark sites.
+    """
+
+    cache: AssetCache | None = None
+    rules: dict[str, Any] = field(
+        default_factory=lambda: load_resource_rules(None)
+    )
+    site_urls: dict[str, str] = field(default_factory=dict)
+    revalidate: bool = False
+    stats: AssetCacheStats = field(default_factory=AssetCacheStats)
+
+    def attach(self, context: BrowserContext) -> None:
+        context.route("**/*", self.handle)
+
+    def site_of(self, url: str) -> str | None:
+        # longest base URL first, e.g. shopping_admin before shopping
+        for site, base_url in sorted(
+            self.site_urls.items(), key=lambda x: -len(x[1])
+        ):
+            if url.startswith(base_url):
+                return site
+        return None
+
+    def is_blocked(self, url: str, resource_type: str) -> bool:
+        site = self.site_of(url)
+        for key in ["*", site]:
+            site_rules = self.rules.get(key) if key else None
+            if not site_rules:
+                continue
+            if resource_type in site_rules.get("block_resource_types", []):
+                return True
+            if any(p in url for p in site_rules.get("block_url_patterns", [])):
+                return True
+        return False
+
+    def handle(self, route: Route) -> None:
+        request = route.request
+        url = request.url
+        self.stats.requests += 1
+
+        if self.is_blocked(url, request.resource_type):
+            self.stats.blocked += 1
+            route.abort("blockedbyclient")
+            return
+
+        if (
+            self.cache is None
+            or request.method != "GET"
+            or request.resource_type not in CACHEABLE_RESOURCE_TYPES
+            or self.site_of(url) is None
+        ):
+            route.continue_()
+            return
+
+        cached = self.cache.get(url)
+        if cached is not None and not (self.revalidate and cached[0]["etag"]):
+            self._fulfill_from_cache(route, *cached)
+            return
+
+        headers = dict(request.headers)
+        if cached is not None:
+            headers["if-none-match"] = cached[0]["etag"]
+        try:
+            response = route.fetch(headers=headers)
+        except Error:
+            # let the browser load it, and report the failure, itself
+            self.stats.fetch_errors += 1
+            route.continue_()
+            return
+        if response.status == 304 and cached is not None:
+            self.stats.revalidated += 1
+            self._fulfill_from_cache(route, *cached)
+            return
+
+        self.stats.misses += 1
+        body = response.body()
+        self.stats.bytes_fetched += len(body)
+        if response.status == 200:
+            self.cache.put(url, response.status, response.headers, body)
+        route.fulfill(
+            status=response.status,
+            headers={
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in DROPPED_HEADERS
+            },
+            body=body,
+        )
+
+    def _fulfill_from_cache(
+        self, route: Route, meta: dict[str, Any], body: bytes
+    ) -> None:
+        self.stats.hits += 1
+        self.stats.bytes_saved += len(body)
+        route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
@@ -0,0 +1,150 @@
+"""Logged-in storage states shared by every task and worker.
+
+Logging in through the UI for every task costs a Chromium launch and several
+seconds. The cache keeps one storage state per site combination, checks it
+with plain HTTP requests, and only logs in again when the cookies no longer
+work. A file lock per combination keeps parallel workers from renewing the
+same state at the same time.
+"""
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+import requests
+
+from browser_env.auto_login import (
+    EXACT_MATCH,
+    KEYWORDS,
+    SITES,
+    URLS,
+    renew_comb,
+)
+from browser_env.http_login import is_logged_in, session_from_storage_state
+
+# cookies that expire within this many seconds are treated as expired
+EXPIRY_MARGIN = 60
+
+
+@dataclass
+class AuthCacheStats:
+    hits: int = 0
+    renewals: int = 0
+    probe_seconds: float = 0.0
+    renew_seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"hits={self.hits}, renewals={self.renewals}, "
+            f"probe={self.probe_seconds:.1f}s, renew={self.renew_seconds:.1f}s"
+        )
+
+
+def cookies_expired(state: dict[str, Any], now: float | None = None) -> bool:
+    """Whether any persistent cookie of the storage state has expired.
+    Session cookies have `expires == -1`."""
+    now = time.time() if now is None else now
+    return any(
+        0 < cookie.get("expires", -1) < now + EXPIRY_MARGIN
+        for cookie in state.get("cookies", [])
+    )
+
+
+class AuthCache:
+    """Storage states in `auth_folder`, one per site combination, named like
+    the files written by `auto_login.renew_comb`."""
+
+    def __init__(
+        self,
+        auth_folder: str | Path = "./.auth",
+        verify_interval: float = 300,
+        probe_timeout: float = 10,
+    ) -> None:
+        self.auth_folder = Path(auth_folder)
+        self.auth_folder.mkdir(parents=True, exist_ok=True)
+        self.verify_interval = verify_interval
+        self.probe_timeout = probe_timeout
+        self.stats = AuthCacheStats()
+        # comb -> (time of the last successful check, mtime of the file)
+        self._verified: dict[str, tuple[float, float]] = {}
+
+    def path(self, comb: list[str]) -> Path:
+        return self.auth_folder / f"{'.'.join(comb)}_state.json"
+
+    def get(self, comb: list[str]) -> str:
+        """Path of a valid storage state for `comb`, renewed if needed"""
+        path = self.path(comb)
+        with self._lock(comb):
+            if self._is_valid(comb, path):
+                self.stats.hits += 1
+            else:
+                self._renew(comb, path)
+            self._verified[".".join(comb)] = (
+                time.time(),
+                path.stat().st_mtime,
+            )
+        return str(path)
+
+    @contextmanager
+    def _lock(self, comb: list[str]) -> Iterator[None]:
+        lock_path = self.auth_folder / f"{'.'.join(comb)}.lock"
+        with open(lock_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _is_valid(self, comb: list[str], path: Path) -> bool:
+        if not path.exists():
+            return False
+        verified_at, mtime = self._verified.get(".".join(comb), (0.0, 0.0))
+        if (
+            mtime == path.stat().st_mtime
+            and time.time() - verified_at < self.verify_interval
+        ):
+            return True
+
+        start = time.perf_counter()
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            if cookies_expired(state):
+                return False
+            session = session_from_storage_state(state)
+            return all(
+                is_logged_in(
+                    session,
+                    URLS[SITES.index(site)],
+                    KEYWORDS[SITES.index(site)],
+                    EXACT_MATCH[SITES.index(site)],
+                    timeout=self.probe_timeout,
+                )
+                for site in comb
+            )
+        except (OSError, ValueError, requests.RequestException):
+            return False
+        finally:
+            self.stats.probe_seconds += time.perf_counter() - start
+
+    def _renew(self, comb: list[str], path: Path) -> None:
+        start = time.perf_counter()
+        tmp_dir = tempfile.mkdtemp(dir=self.auth_folder)
+        try:
+            # the env's sync Playwright instance owns the event loop of this
+            # thread, so the login runs its own loop in another thread
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(renew_comb, comb, auth_folder=tmp_dir).result()
+            # other workers may be reading the old state
+            os.replace(Path(tmp_dir) / path.name, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.stats.renewals += 1
+        self.stats.renew_seconds += time.perf_counter() - start
@@ -1,14 +1,22 @@
 """Script to automatically login each website"""
 import argparse
+import asyncio
 import glob
+import json
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor
 from itertools import combinations
 from pathlib import Path
+from typing import Any, Awaitable, TypeVar
 
-from playwright.sync_api import sync_playwright
+import requests
+from playwright.async_api import Browser, Locator, Page, async_playwright
 from browser_env.env_config import ACCOUNTS
+from browser_env.http_login import (
+    http_login,
+    is_logged_in,
+    storage_state_from_session,
+)
 
 DATASET = os.environ["DATASET"]
 if DATASET == "webarena":
@@ -27,6 +35,12 @@ if DATASET == "webarena":
     ]
     EXACT_MATCH = [True, True, True, True]
     KEYWORDS = ["", "", "Dashboard", "Delete"]
+    LOGIN_URLS = {
+        "gitlab": f"{GITLAB}/users/sign_in",
+        "shopping": f"{SHOPPING}/customer/account/login/",
+        "shopping_admin": f"{SHOPPING_ADMIN}",
+        "reddit": f"{REDDIT}/login",
+    }
 
 elif DATASET == "visualwebarena":
     from browser_env.env_config import (
@@ -42,31 +56,130 @@ elif DATASET == "visualwebarena":
     ]
     EXACT_MATCH = [True, True, True]
     KEYWORDS = ["", "Delete", "My listings"]
+    LOGIN_URLS = {
+        "shopping": f"{SHOPPING}/customer/account/login/",
+        "reddit": f"{REDDIT}/login",
+        "classifieds": f"{CLASSIFIEDS}/index.php?page=login",
+    }
 else:
     raise ValueError(f"Dataset not implemented: {DATASET}")
 
+T = TypeVar("T")
+
 HEADLESS = True
 SLOW_MO = 0
+# logins and checks that run at the same time, each in its own context
+MAX_CONCURRENCY = 8
 
 assert len(SITES) == len(URLS) == len(EXACT_MATCH) == len(KEYWORDS)
+assert sorted(SITES) == sorted(LOGIN_URLS)
 
-def is_expired(
-    storage_state: Path, url: str, keyword: str, url_exact: bool = True
-) -> bool:
-    """Test whether the cookie is expired"""
-    if not storage_state.exists():
-        return True
 
-    context_manager = sync_playwright()
-    playwright = context_manager.__enter__()
-    browser = playwright.chromium.launch(headless=True, slow_mo=SLOW_MO)
-    context = browser.new_context(storage_state=storage_state)
-    page = context.new_page()
-    page.goto(url)
-    time.sleep(1)
+async def _submit(page: Page, button: Locator) -> None:
+    """Click a login button and wait for the page the form leads to"""
+    async with page.expect_navigation():
+        await button.click()
+
+
+async def _login(page: Page, site: str) -> None:
+    username = ACCOUNTS[site]["username"]
+    password = ACCOUNTS[site]["password"]
+    match site:
+        case "shopping":
+            await page.goto(LOGIN_URLS[site])
+            await page.get_by_label("Email", exact=True).fill(username)
+            await page.get_by_label("Password", exact=True).fill(password)
+            await _submit(page, page.get_by_role("button", name="Sign In"))
+        case "reddit":
+            await page.goto(LOGIN_URLS[site])
+            await page.get_by_label("Username").fill(username)
+            await page.get_by_label("Password").fill(password)
+            await _submit(page, page.get_by_role("button", name="Log in"))
+        case "classifieds":
+            await page.goto(LOGIN_URLS[site])
+            await page.locator("#email").fill(username)
+            await page.locator("#password").fill(password)
+            await _submit(page, page.get_by_role("button", name="Log in"))
+        case "shopping_admin":
+            await page.goto(LOGIN_URLS[site])
+            await page.get_by_placeholder("user name").fill(username)
+            await page.get_by_placeholder("password").fill(password)
+            await _submit(page, page.get_by_role("button", name="Sign in"))
+        case "gitlab":
+            await page.goto(LOGIN_URLS[site])
+            await page.get_by_test_id("username-field").fill(username)
+            await page.get_by_test_id("password-field").fill(password)
+            await _submit(page, page.get_by_test_id("sign-in-button"))
+        case _:
+            raise ValueError(f"Login is not supported for {site}")
+
+
+def http_login_comb(
+    comb: list[str], timings: dict[str, list[float]] | None = None
+) -> tuple[dict[str, Any], list[str]]:
+    """Log in to every site of `comb` with plain HTTP requests. Returns the
+    storage state and the sites where the login did not work."""
+    session = requests.Session()
+    failed = []
+    for site in comb:
+        start = time.perf_counter()
+        idx = SITES.index(site)
+        try:
+            logged_in = http_login(
+                session,
+                LOGIN_URLS[site],
+                ACCOUNTS[site]["username"],
+                ACCOUNTS[site]["password"],
+            ) and is_logged_in(session, URLS[idx], KEYWORDS[idx], EXACT_MATCH[idx])
+        except requests.RequestException:
+            logged_in = False
+        if not logged_in:
+            failed.append(site)
+        if timings is not None:
+            timings.setdefault(f"{site}/http", []).append(
+                time.perf_counter() - start
+            )
+    return storage_state_from_session(session), failed
+
+
+async def _renew_comb(
+    browser: Browser,
+    comb: list[str],
+    auth_folder: str,
+    timings: dict[str, list[float]],
+    storage_state: dict[str, Any] | None = None,
+    sites: list[str] | None = None,
+) -> None:
+    """Log in to `sites` (all of `comb` by default) in a new context that
+    starts from `storage_state`"""
+    context = await browser.new_context(storage_state=storage_state)
+    page = await context.new_page()
+    for site in comb if sites is None else sites:
+        start = time.perf_counter()
+        await _login(page, site)
+        timings.setdefault(f"{site}/browser", []).append(
+            time.perf_counter() - start
+        )
+    await context.storage_state(
+        path=f"{auth_folder}/{'.'.join(comb)}_state.json"
+    )
+    await context.close()
+
+
+async def _is_expired(
+    browser: Browser,
+    storage_state: Path,
+    url: str,
+    keyword: str,
+    url_exact: bool,
+) -> bool:
+    context = await browser.new_context(storage_state=storage_state)
+    page = await context.new_page()
+    # `goto` returns after the redirects to the login page, if any
+    await page.goto(url)
     d_url = page.url
-    content = page.content()
-    context_manager.__exit__()
+    content = await page.content()
+    await context.close()
     if keyword:
         return keyword not in content
     else:
@@ -76,58 +189,148 @@ def is_expired(
             return url not in d_url
 
 
-def renew_comb(comb: list[str], auth_folder: str = "./.auth") -> None:
-    context_manager = sync_playwright()
-    playwright = context_manager.__enter__()
-    browser = playwright.chromium.launch(headless=HEADLESS)
-    context = browser.new_context()
-    page = context.new_page()
-
-    if "shopping" in comb:
-        username = ACCOUNTS["shopping"]["username"]
-        password = ACCOUNTS["shopping"]["password"]
-        page.goto(f"{SHOPPING}/customer/account/login/")
-        page.get_by_label("Email", exact=True).fill(username)
-        page.get_by_label("Password", exact=True).fill(password)
-        page.get_by_role("button", name="Sign In").click()
-
-    if "reddit" in comb:
-        username = ACCOUNTS["reddit"]["username"]
-        password = ACCOUNTS["reddit"]["password"]
-        page.goto(f"{REDDIT}/login")
-        page.get_by_label("Username").fill(username)
-        page.get_by_label("Password").fill(password)
-        page.get_by_role("button", name="Log in").click()
-
-    if "classifieds" in comb:
-        username = ACCOUNTS["classifieds"]["username"]
-        password = ACCOUNTS["classifieds"]["password"]
-        page.goto(f"{CLASSIFIEDS}/index.php?page=login")
-        page.locator("#email").fill(username)
-        page.locator("#password").fill(password)
-        page.get_by_role("button", name="Log in").click()
-
-    if "shopping_admin" in comb:
-        username = ACCOUNTS["shopping_admin"]["username"]
-        password = ACCOUNTS["shopping_admin"]["password"]
-        page.goto(f"{SHOPPING_ADMIN}")
-        page.get_by_placeholder("user name").fill(username)
-        page.get_by_placeholder("password").fill(password)
-        page.get_by_role("button", name="Sign in").click()
-
-    if "gitlab" in comb:
-        username = ACCOUNTS["gitlab"]["username"]
-        password = ACCOUNTS["gitlab"]["password"]
-        page.goto(f"{GITLAB}/users/sign_in")
-        page.get_by_test_id("username-field").click()
-        page.get_by_test_id("username-field").fill(username)
-        page.get_by_test_id("username-field").press("Tab")
-        page.get_by_test_id("password-field").fill(password)
-        page.get_by_test_id("sign-in-button").click()
-
-    context.storage_state(path=f"{auth_folder}/{'.'.join(comb)}_state.json")
-
-    context_manager.__exit__()
+async def _bounded(semaphore: asyncio.Semaphore, coro: Awaitable[T]) -> T:
+    async with semaphore:
+        return await coro
+
+
+async def _timed(
+    coro: Awaitable[T], timings: dict[str, list[float]], key: str
+) -> T:
+    start = time.perf_counter()
+    result = await coro
+    timings.setdefault(key, []).append(time.perf_counter() - start)
+    return result
+
+
+async def renew_combs(
+    combs: list[list[str]],
+    auth_folder: str = "./.auth",
+    http_first: bool = True,
+) -> dict[str, list[float]]:
+    """Log in to every combination, over HTTP first if `http_first` is set.
+    The sites where that fails are logged in through one browser, with a
+    context per combination. Returns the login time of each site and method
+    in seconds."""
+    timings: dict[str, list[float]] = {}
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # (comb, storage state so far, sites still to log in to)
+    pending: list[tuple[list[str], dict[str, Any] | None, list[str]]] = []
+    if http_first:
+        results = await asyncio.gather(
+            *[
+                _bounded(
+                    semaphore, asyncio.to_thread(http_login_comb, comb, timings)
+                )
+                for comb in combs
+            ]
+        )
+        for comb, (storage_state, failed) in zip(combs, results):
+            if failed:
+                pending.append((comb, storage_state, failed))
+            else:
+                with open(
+                    f"{auth_folder}/{'.'.join(comb)}_state.json", "w"
+                ) as f:
+                    json.dump(storage_state, f)
+    else:
+        pending = [(comb, None, comb) for comb in combs]
+    if not pending:
+        return timings
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(
+            headless=HEADLESS, slow_mo=SLOW_MO
+        )
+        await asyncio.gather(
+            *[
+                _bounded(
+                    semaphore,
+                    _renew_comb(
+                        browser, comb, auth_folder, timings, storage_state, sites
+                    ),
+                )
+                for comb, storage_state, sites in pending
+            ]
+        )
+        await browser.close()
+    return timings
+
+
+async def check_cookies(
+    cookie_files: list[str],
+) -> tuple[list[tuple[str, str, bool]], dict[str, list[float]]]:
+    """Check every site of every storage state with one browser.
+    Returns (cookie file, site, expired) triples and the check time of each
+    site in seconds."""
+    timings: dict[str, list[float]] = {}
+    jobs = []
+    for c_file in cookie_files:
+        for cur_site in get_site_comb_from_filepath(c_file):
+            idx = SITES.index(cur_site)
+            jobs.append(
+                (c_file, cur_site, URLS[idx], KEYWORDS[idx], EXACT_MATCH[idx])
+            )
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(
+            headless=True, slow_mo=SLOW_MO
+        )
+        expired = await asyncio.gather(
+            *[
+                _bounded(
+                    semaphore,
+                    _timed(
+                        _is_expired(browser, Path(c_file), url, keyword, match),
+                        timings,
+                        site,
+                    ),
+                )
+                for c_file, site, url, keyword, match in jobs
+            ]
+        )
+        await browser.close()
+    results = [
+        (c_file, site, e) for (c_file, site, *_), e in zip(jobs, expired)
+    ]
+    return results, timings
+
+
+def is_expired(
+    storage_state: Path, url: str, keyword: str, url_exact: bool = True
+) -> bool:
+    """Test whether the cookie is expired"""
+    if not storage_state.exists():
+        return True
+
+    async def check() -> bool:
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(
+                headless=True, slow_mo=SLOW_MO
+            )
+            expired = await _is_expired(
+                browser, storage_state, url, keyword, url_exact
+            )
+            await browser.close()
+        return expired
+
+    return asyncio.run(check())
+
+
+def renew_comb(
+    comb: list[str], auth_folder: str = "./.auth", http_first: bool = True
+) -> None:
+    asyncio.run(
+        renew_combs([comb], auth_folder=auth_folder, http_first=http_first)
+    )
+
+
+def _format_timings(timings: dict[str, list[float]]) -> str:
+    return ", ".join(
+        f"{site}: {max(v):.1f}s max ({len(v)} runs)"
+        for site, v in sorted(timings.items())
+    )
 
 
 def get_site_comb_from_filepath(file_path: str) -> list[str]:
@@ -135,48 +338,53 @@ def get_site_comb_from_filepath(file_path: str) -> list[str]:
     return comb
 
 
-def main(auth_folder: str = "./.auth") -> None:
-    pairs = list(combinations(SITES, 2))
+def main(auth_folder: str = "./.auth", http_first: bool = True) -> None:
+    combs = []
+    for pair in combinations(SITES, 2):
+        # Auth doesn't work on this pair as they share the same cookie
+        if "reddit" in pair and (
+            "shopping" in pair or "shopping_admin" in pair
+        ):
+            continue
+        combs.append(list(sorted(pair)))
+    combs.extend([site] for site in SITES)
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for pair in pairs:
-            # Auth doesn't work on this pair as they share the same cookie
-            if "reddit" in pair and (
-                "shopping" in pair or "shopping_admin" in pair
-            ):
-                continue
-            executor.submit(
-                renew_comb, list(sorted(pair)), auth_folder=auth_folder
-            )
+    start = time.perf_counter()
+    login_timings = asyncio.run(
+        renew_combs(combs, auth_folder=auth_folder, http_first=http_first)
+    )
+    print(
+        f"Logged in to {len(combs)} combinations in "
+        f"{time.perf_counter() - start:.1f}s. {_format_timings(login_timings)}"
+    )
 
-        for site in SITES:
-            executor.submit(renew_comb, [site], auth_folder=auth_folder)
-    
-    # parallel checking if the cookies are expired  
-    futures = []
+    # check that none of the cookies are expired
+    start = time.perf_counter()
     cookie_files = list(glob.glob(f"{auth_folder}/*.json"))
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for c_file in cookie_files:
-            comb = get_site_comb_from_filepath(c_file)
-            for cur_site in comb:
-                url = URLS[SITES.index(cur_site)]
-                keyword = KEYWORDS[SITES.index(cur_site)]
-                match = EXACT_MATCH[SITES.index(cur_site)]
-                future = executor.submit(
-                    is_expired, Path(c_file), url, keyword, match
-                )
-                futures.append(future)
-
-    for i, future in enumerate(futures):
-        assert not future.result(), f"Cookie {cookie_files[i]} expired."
+    results, check_timings = asyncio.run(check_cookies(cookie_files))
+    print(
+        f"Checked {len(results)} logins in {time.perf_counter() - start:.1f}s. "
+        f"{_format_timings(check_timings)}"
+    )
+    for c_file, site, expired in results:
+        assert not expired, f"Cookie {c_file} expired for {site}."
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--site_list", nargs="+", default=[])
     parser.add_argument("--auth_folder", type=str, default="./.auth")
+    parser.add_argument(
+        "--browser_login",
+        action="store_true",
+        help="Log in through the browser only, without trying plain HTTP first",
+    )
     args = parser.parse_args()
     if not args.site_list:
-        main()
+        main(http_first=not args.browser_login)
     else:
-        renew_comb(args.site_list, auth_folder=args.auth_folder)
+        renew_comb(
+            args.site_list,
+            auth_folder=args.auth_folder,
+            http_first=not args.browser_login,
+        )
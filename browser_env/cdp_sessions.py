@@ -0,0 +1,99 @@
+"""Long-lived CDP sessions shared by the observation processors.
+
+Attaching a new session for every CDP call re-enables domains and drops the
+renderer-side state the session owned. Instead, each page keeps one session
+for its whole lifetime. A session is recreated when its target goes away,
+e.g. after a crash or a navigation that replaced the target.
+"""
+from typing import Any, Callable
+
+from playwright.sync_api import CDPSession, Error, Page
+
+# Remote objects resolved while computing element bounds are put in this group
+# so they can be released in one call at the end of an observation.
+BOUNDS_OBJECT_GROUP = "webarena_bounds"
+
+
+class _SessionEntry:
+    def __init__(self, session: CDPSession) -> None:
+        self.session = session
+        self.enabled_domains: set[str] = set()
+        self.listeners: list[tuple[str, Callable[[Any], None]]] = []
+
+
+class CDPSessionManager:
+    """Keep one CDP session per page and track the domains enabled on it"""
+
+    def __init__(self) -> None:
+        self._entries: dict[Page, _SessionEntry] = {}
+        self.num_attached = 0
+
+    def _attach(self, page: Page) -> _SessionEntry:
+        if page not in self._entries:
+            # forget the page once it is closed, it cannot come back
+            page.on("close", lambda p: self._entries.pop(p, None))
+        entry = _SessionEntry(page.context.new_cdp_session(page))
+        self._entries[page] = entry
+        self.num_attached += 1
+        return entry
+
+    def _entry(self, page: Page) -> _SessionEntry:
+        entry = self._entries.get(page)
+        if entry is None:
+            entry = self._attach(page)
+        return entry
+
+    def get(self, page: Page) -> CDPSession:
+        return self._entry(page).session
+
+    def enable(self, page: Page, domain: str) -> None:
+        """Send `<domain>.enable` unless it was already sent on this session"""
+        entry = self._entry(page)
+        if domain not in entry.enabled_domains:
+            self.send(page, f"{domain}.enable")
+            # `send` may have replaced the entry
+            self._entries[page].enabled_domains.add(domain)
+
+    def on(
+        self, page: Page, event: str, handler: Callable[[Any], None]
+    ) -> None:
+        """Subscribe to a CDP event, e.g. "DOM.documentUpdated".
+
+        The subscription survives the session being recreated.
+        """
+        entry = self._entry(page)
+        entry.session.on(event, handler)
+        entry.listeners.append((event, handler))
+
+    def send(
+        self, page: Page, method: str, params: dict[str, Any] | None = None
+    ) -> Any:
+        """Send a command, reattaching once if the session was detached"""
+        entry = self._entry(page)
+        try:
+            return entry.session.send(method, params)
+        except Error as e:
+            if page.is_closed() or "closed" not in str(e).lower():
+                raise
+        old_entry = entry
+        entry = self._attach(page)
+        for event, handler in old_entry.listeners:
+            entry.session.on(event, handler)
+            entry.listeners.append((event, handler))
+        for domain in old_entry.enabled_domains:
+            entry.session.send(f"{domain}.enable")
+            entry.enabled_domains.add(domain)
+        return entry.session.send(method, params)
+
+    def release(self, page: Page) -> None:
+        """Detach the session of `page`, if any"""
+        entry = self._entries.pop(page, None)
+        if entry is not None and not page.is_closed():
+            try:
+                entry.session.detach()
+            except Error:
+                pass
+
+    def clear(self) -> None:
+        """Forget all sessions, e.g. when the browser they belong to is closed"""
+        self._entries = {}
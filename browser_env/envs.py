@@ -1,5 +1,4 @@
 import json
-import os
 import re
 import subprocess
 import time
@@ -10,7 +9,6 @@ from typing import Any, Union
 
 import numpy as np
 import numpy.typing as npt
-import requests
 from beartype import beartype
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
@@ -23,15 +21,11 @@ from playwright.sync_api import (
     sync_playwright,
 )
 
-DATASET = os.environ["DATASET"]
-if DATASET == "visualwebarena":
-    from browser_env.env_config import (
-        CLASSIFIEDS,
-        CLASSIFIEDS_RESET_TOKEN,
-    )
-
 from .actions import Action, execute_action, get_action_space
 from .processors import ObservationHandler, ObservationMetadata
+from .asset_cache import ResourceRouter
+from .site_reset import SiteResetter, default_reset_backends
+from .tracing import TracePolicy, TraceRecorder
 from .utils import (
     AccessibilityTree,
     DetachedPage,
@@ -94,6 +88,10 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
         captioning_fn=None,
+        concurrent_observation: bool = True,
+        trace_policy: TracePolicy | None = None,
+        resource_router: ResourceRouter | None = None,
+        site_resetter: SiteResetter | None = None,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -102,8 +100,19 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.current_viewport_only = current_viewport_only
         self.reset_finished = False
         self.viewport_size = viewport_size
-        self.save_trace_enabled = save_trace_enabled
+        # `save_trace_enabled` is kept as a shorthand for tracing every task
+        if trace_policy is None:
+            trace_policy = TracePolicy(
+                mode="always" if save_trace_enabled else "off"
+            )
+        self.trace_policy = trace_policy
+        self.trace_recorder = TraceRecorder(trace_policy)
+        self.save_trace_enabled = trace_policy.mode != "off"
         self.sleep_after_execution = sleep_after_execution
+        self.resource_router = resource_router
+        if site_resetter is None:
+            site_resetter = SiteResetter(*default_reset_backends())
+        self.site_resetter = site_resetter
 
         match observation_type:
             case "html" | "accessibility_tree" | "accessibility_tree_with_captioner":
@@ -130,6 +139,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.current_viewport_only,
             self.viewport_size,
             captioning_fn,
+            concurrent_capture=concurrent_observation,
         )
 
         self.observation_space = (
@@ -138,6 +148,8 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
 
     @beartype
     def setup(self, config_file: Path | None = None) -> None:
+        # sessions of the previous browser are gone
+        self.observation_handler.cdp_sessions.clear()
         self.context_manager = sync_playwright()
         self.playwright = self.context_manager.__enter__()
         self.browser = self.playwright.chromium.launch(
@@ -150,28 +162,12 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         else:
             instance_config = {}
 
-        # Reset site if needed. Currently only supported for Classifieds.
-        # TODO(jykoh): Add reset functionality for Shopping/Reddit.
-        if instance_config.get("require_reset", False):
-            if "classifieds" in instance_config["sites"]:
-                # Send POST request to __CLASSIFIEDS__/index.php?page=reset with token=CLASSIFIEDS_TOKEN
-                response = requests.post(
-                    f"{CLASSIFIEDS}/index.php?page=reset",
-                    data={"token": CLASSIFIEDS_RESET_TOKEN},
-                )
-
-                # Check if the request was successful
-                if response.status_code == 200:
-                    print("Reset Classifieds site.")
-                else:
-                    print(
-                        "Failed to reset Classifieds site:",
-                        response.status_code,
-                    )
-            else:
-                print(
-                    "WARNING: Reset is not supported for this site. Please manually reset the site."
-                )
+        # Reset the sites the task modifies, and hold them until the next
+        # task so other workers cannot reset them under this one.
+        self.site_resetter.hold(
+            instance_config.get("sites", []),
+            reset=instance_config.get("require_reset", False),
+        )
 
         storage_state = instance_config.get("storage_state", None)
         start_url = instance_config.get("start_url", None)
@@ -188,8 +184,11 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
-        if self.save_trace_enabled:
-            self.context.tracing.start(screenshots=True, snapshots=True)
+        if self.resource_router is not None:
+            self.resource_router.attach(self.context)
+        self.trace_recorder.start(
+            self.context, config_file.stem if config_file else "default"
+        )
 
         if start_url:
             start_urls = start_url.split(" |AND| ")
@@ -199,9 +198,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
                     "accessibility_tree",
                     "accessibility_tree_with_captioner",
                 ]:
-                    client = page.context.new_cdp_session(page)
-                    client.send("Accessibility.enable")
-                    client.detach()
+                    self.observation_handler.cdp_sessions.enable(
+                        page, "Accessibility"
+                    )
                 page.goto(url)
             # set the first page as the current page
             self.page = self.context.pages[0]
@@ -212,9 +211,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
                 "accessibility_tree",
                 "accessibility_tree_with_captioner",
             ]:
-                client = self.page.context.new_cdp_session(self.page)
-                client.send("Accessibility.enable")
-                client.detach()
+                self.observation_handler.cdp_sessions.enable(
+                    self.page, "Accessibility"
+                )
 
     def _get_obs(self) -> dict[str, Observation]:
         obs = self.observation_handler.get_observation(self.page)
@@ -258,15 +257,21 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             "page": DetachedPage(self.page.url, ""),
             "fail_error": "",
             "observation_metadata": observation_metadata,
+            "observation_timings": dict(self.observation_handler.timings),
         }
 
         return (observation, info)
 
-    def save_trace(self, trace_path: str | Path) -> None:
-        if self.save_trace_enabled:
-            self.context.tracing.stop(path=trace_path)
+    def save_trace(
+        self, trace_path: str | Path, passed: bool | None = None
+    ) -> None:
+        """Stop tracing the current task. Whether the trace is written to
+        `trace_path` depends on the trace policy and on `passed`."""
+        self.trace_recorder.stop(trace_path, passed)
 
     def close(self) -> None:
+        self.site_resetter.release()
+        self.observation_handler.close()
         if self.reset_finished:
             self.context_manager.__exit__()
 
@@ -276,6 +281,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
 
+        start = time.perf_counter()
         success = False
         fail_error = ""
         try:
@@ -289,6 +295,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             success = True
         except Exception as e:
             fail_error = str(e)
+        self.trace_recorder.on_step()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -297,6 +304,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             "page": DetachedPage(self.page.url, self.page.content()),
             "fail_error": fail_error,
             "observation_metadata": observation_metadata,
+            "observation_timings": dict(self.observation_handler.timings),
+            # the action, the tracing and the observation
+            "step_seconds": time.perf_counter() - start,
         }
         msg = (
             observation,
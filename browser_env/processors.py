@@ -1,21 +1,21 @@
 import json
 import pkgutil
 import re
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from io import BytesIO, StringIO
-from typing import Any, Optional, TypedDict, Union
+from typing import Any, Callable, Optional, TypedDict, Union
 from urllib.parse import urljoin, urlparse
 
-import matplotlib.pyplot as plt
 import numpy as np
 import numpy.typing as npt
-import pandas as pd
 import playwright
 import requests
 from gymnasium import spaces
 from PIL import Image, ImageDraw, ImageFont
-from playwright.sync_api import CDPSession, Page, ViewportSize
+from playwright.sync_api import Page, ViewportSize
 
 from browser_env.constants import (
     ASCII_CHARSET,
@@ -28,6 +28,7 @@ from browser_env.constants import (
     IN_VIEWPORT_RATIO_THRESHOLD,
 )
 
+from .cdp_sessions import BOUNDS_OBJECT_GROUP, CDPSessionManager
 from .utils import (
     AccessibilityTree,
     AccessibilityTreeNode,
@@ -87,10 +88,12 @@ class TextObervationProcessor(ObservationProcessor):
         current_viewport_only: bool,
         viewport_size: ViewportSize,
         captioning_fn=None,
+        cdp_sessions: CDPSessionManager | None = None,
     ):
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
         self.viewport_size = viewport_size
+        self.cdp_sessions = cdp_sessions or CDPSessionManager()
         self.observation_tag = "text"
         self.meta_data = (
             create_empty_metadata()
@@ -109,8 +112,8 @@ class TextObervationProcessor(ObservationProcessor):
         page: Page,
     ) -> BrowserInfo:
         # extract domtree
-        client = page.context.new_cdp_session(page)
-        tree = client.send(
+        tree = self.cdp_sessions.send(
+            page,
             "DOMSnapshot.captureSnapshot",
             {
                 "computedStyles": [],
@@ -118,7 +121,6 @@ class TextObervationProcessor(ObservationProcessor):
                 "includePaintOrder": True,
             },
         )
-        client.detach()
 
         # calibrate the bounds, in some cases, the bounds are scaled somehow
         bounds = tree["documents"][0]["layout"]["bounds"]
@@ -154,16 +156,21 @@ class TextObervationProcessor(ObservationProcessor):
 
         return info
     
-    @staticmethod
     def get_bounding_client_rect(
-        client: CDPSession, backend_node_id: str
+        self, page: Page, backend_node_id: str
     ) -> dict[str, Any]:
         try:
-            remote_object = client.send(
-                "DOM.resolveNode", {"backendNodeId": int(backend_node_id)}
+            remote_object = self.cdp_sessions.send(
+                page,
+                "DOM.resolveNode",
+                {
+                    "backendNodeId": int(backend_node_id),
+                    "objectGroup": BOUNDS_OBJECT_GROUP,
+                },
             )
             remote_object_id = remote_object["object"]["objectId"]
-            response = client.send(
+            response = self.cdp_sessions.send(
+                page,
                 "Runtime.callFunctionOn",
                 {
                     "objectId": remote_object_id,
@@ -233,7 +240,6 @@ class TextObervationProcessor(ObservationProcessor):
         # make a dom tree that is easier to navigate
         dom_tree: DOMTree = []
         graph = defaultdict(list)
-        client = page.context.new_cdp_session(page)
         for node_idx in range(len(nodes["nodeName"])):
             cur_node: DOMNode = {
                 "nodeId": "",
@@ -285,7 +291,7 @@ class TextObervationProcessor(ObservationProcessor):
                 cur_node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
             else:
                 response = self.get_bounding_client_rect(
-                    client, cur_node["backendNodeId"]
+                    page, cur_node["backendNodeId"]
                 )
                 if response.get("result", {}).get("subtype", "") == "error":
                     cur_node["union_bound"] = None
@@ -298,7 +304,11 @@ class TextObervationProcessor(ObservationProcessor):
 
             dom_tree.append(cur_node)
 
-        client.detach()
+        self.cdp_sessions.send(
+            page,
+            "Runtime.releaseObjectGroup",
+            {"objectGroup": BOUNDS_OBJECT_GROUP},
+        )
         # add parent children index to the node
         for parent_id, child_ids in graph.items():
             dom_tree[int(parent_id)]["childIds"] = child_ids
@@ -406,9 +416,8 @@ class TextObervationProcessor(ObservationProcessor):
         info: BrowserInfo,
         current_viewport_only: bool,
     ) -> AccessibilityTree:
-        client = page.context.new_cdp_session(page)
-        accessibility_tree: AccessibilityTree = client.send(
-            "Accessibility.getFullAXTree", {}
+        accessibility_tree: AccessibilityTree = self.cdp_sessions.send(
+            page, "Accessibility.getFullAXTree", {}
         )["nodes"]
 
         # a few nodes are repeated in the accessibility tree
@@ -433,7 +442,7 @@ class TextObervationProcessor(ObservationProcessor):
                 node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
             else:
                 response = self.get_bounding_client_rect(
-                    client,
+                    page,
                     backend_node_id
                 )
                 if response.get("result", {}).get("subtype", "") == "error":
@@ -445,7 +454,11 @@ class TextObervationProcessor(ObservationProcessor):
                     height = response["result"]["value"]["height"]
                     node["union_bound"] = [x, y, width, height]
 
-        client.detach()
+        self.cdp_sessions.send(
+            page,
+            "Runtime.releaseObjectGroup",
+            {"objectGroup": BOUNDS_OBJECT_GROUP},
+        )
         # filter nodes that are not in the current viewport
         if current_viewport_only:
 
@@ -721,7 +734,13 @@ class TextObervationProcessor(ObservationProcessor):
 
         return content
 
-    def process(self, page: Page) -> str:
+    def capture(self, page: Page) -> dict[str, Any]:
+        """Run the browser-side half of `process`.
+
+        Everything that talks to the page happens here. The result is handed
+        to `render`, which only does CPU work and is safe to run off the
+        Playwright thread.
+        """
         # get the tab info
         open_tabs = page.context.pages
         try:
@@ -741,48 +760,65 @@ class TextObervationProcessor(ObservationProcessor):
         except Exception:
             page.wait_for_load_state("load", timeout=500)
             browser_info = self.fetch_browser_info(page)
+        self.browser_config = browser_info["config"]
 
+        captured: dict[str, Any] = {"tab_title_str": tab_title_str}
         if self.observation_type == "html":
-            dom_tree = self.fetch_page_html(
+            captured["dom_tree"] = self.fetch_page_html(
                 browser_info,
                 page,
                 self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_html(dom_tree)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
 
         elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
+            captured["accessibility_tree"] = self.fetch_page_accessibility_tree(
                 page,
                 browser_info,
                 self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_accessibility_tree(accessibility_tree)
-            content = self.clean_accesibility_tree(content)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
 
         elif self.observation_type in [
             "accessibility_tree_with_captioner",
             "image_som",
         ]:
-            content = self.fetch_image_related(
+            captured["content"] = self.fetch_image_related(
                 page,
                 browser_info,
             )
 
         elif self.observation_type == "":
-            content = ""
+            captured["content"] = ""
 
         else:
             raise ValueError(f"Invalid observation type: {self.observation_type}")
 
-        self.browser_config = browser_info["config"]
-        content = f"{tab_title_str}\n\n{content}"
+        return captured
+
+    def render(self, captured: dict[str, Any]) -> str:
+        """Serialize the output of `capture` into the text observation"""
+        if "dom_tree" in captured:
+            content, obs_nodes_info = self.parse_html(captured["dom_tree"])
+            self.obs_nodes_info = obs_nodes_info
+            self.meta_data["obs_nodes_info"] = obs_nodes_info
+
+        elif "accessibility_tree" in captured:
+            content, obs_nodes_info = self.parse_accessibility_tree(
+                captured["accessibility_tree"]
+            )
+            content = self.clean_accesibility_tree(content)
+            self.obs_nodes_info = obs_nodes_info
+            self.meta_data["obs_nodes_info"] = obs_nodes_info
+
+        else:
+            content = captured["content"]
+
+        content = f"{captured['tab_title_str']}\n\n{content}"
 
         return content
 
+    def process(self, page: Page) -> str:
+        return self.render(self.capture(page))
+
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
         node_bound = node_info["union_bound"]
@@ -800,10 +836,12 @@ class ImageObservationProcessor(ObservationProcessor):
         self,
         observation_type: str,
         viewport_size: Optional[ViewportSize] = None,
+        cdp_sessions: CDPSessionManager | None = None,
     ):
         self.observation_type = observation_type
         self.observation_tag = "image"
         self.viewport_size = viewport_size
+        self.cdp_sessions = cdp_sessions or CDPSessionManager()
         self.meta_data = create_empty_metadata()
 
     def get_page_bboxes(self, page: Page) -> list[list[float]]:
@@ -877,6 +915,10 @@ class ImageObservationProcessor(ObservationProcessor):
         """
         min_width and min_height: Minimum dimensions of the bounding box to be plotted.
         """
+        # only the set-of-marks observations need pandas and matplotlib
+        import matplotlib
+        import pandas as pd
+
         # Read CSV data
         df = pd.read_csv(StringIO(data_string), delimiter=",", quotechar='"')
         df["Area"] = df["Width"] * df["Height"]
@@ -906,7 +948,7 @@ class ImageObservationProcessor(ObservationProcessor):
         font = ImageFont.truetype(font_path, font_size)
 
         # Create a color cycle using one of the categorical color palettes in matplotlib
-        color_cycle = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        color_cycle = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
         bbox_id2visid = {}
         bbox_id2desc = {}
         index = 0
@@ -1109,7 +1151,8 @@ class ImageObservationProcessor(ObservationProcessor):
             or rect1[3] < rect2[1] + padding
         )
 
-    def process(self, page: Page) -> npt.NDArray[np.uint8]:
+    def capture(self, page: Page) -> dict[str, Any]:
+        """Run the browser-side half of `process` (screenshot and SoM boxes)"""
         try:
             browser_info = self.fetch_browser_info(page)
         except Exception:
@@ -1118,47 +1161,41 @@ class ImageObservationProcessor(ObservationProcessor):
 
         self.browser_config = browser_info["config"]
 
+        captured: dict[str, Any] = {"screenshot": page.screenshot()}
+        if self.observation_type == "image_som":
+            captured["som_bboxes"] = self.get_page_bboxes(page)
+        return captured
+
+    def render(
+        self, captured: dict[str, Any]
+    ) -> tuple[npt.NDArray[np.uint8], str]:
+        """Decode the screenshot and draw the SoM boxes. No page access."""
         if self.observation_type == "image_som":
             # Produce the SoM image, with bounding boxes
-            try:
-                screenshot_bytes = page.screenshot()
-                som_bboxes = self.get_page_bboxes(page)
-                screenshot_img = Image.open(BytesIO(screenshot_bytes))
-                bbox_img, id2center, content_str = self.draw_bounding_boxes(
-                    som_bboxes,
-                    screenshot_img,
-                    viewport_size=self.viewport_size,
-                )
-                self.som_id_info = id2center
-                self.meta_data["obs_nodes_info"] = id2center
-                screenshot_som = np.array(bbox_img)
-                return screenshot_som, content_str
-            except:
-                page.wait_for_event("load")
-                screenshot_bytes = page.screenshot()
-                som_bboxes = self.get_page_bboxes(page)
-                screenshot_img = Image.open(BytesIO(screenshot_bytes))
-                bbox_img, id2center, content_str = self.draw_bounding_boxes(
-                    som_bboxes,
-                    screenshot_img,
-                    viewport_size=self.viewport_size,
-                )
-                self.som_id_info = id2center
-                self.meta_data["obs_nodes_info"] = id2center
-                screenshot_som = np.array(bbox_img)
-                return screenshot_som, content_str
+            screenshot_img = Image.open(BytesIO(captured["screenshot"]))
+            bbox_img, id2center, content_str = self.draw_bounding_boxes(
+                captured["som_bboxes"],
+                screenshot_img,
+                viewport_size=self.viewport_size,
+            )
+            self.som_id_info = id2center
+            self.meta_data["obs_nodes_info"] = id2center
+            screenshot_som = np.array(bbox_img)
+            return screenshot_som, content_str
         else:
-            try:
-                screenshot = png_bytes_to_numpy(page.screenshot())
-            except:
-                page.wait_for_event("load")
-                screenshot = png_bytes_to_numpy(page.screenshot())
-            return screenshot, ""
+            return png_bytes_to_numpy(captured["screenshot"]), ""
+
+    def process(self, page: Page) -> npt.NDArray[np.uint8]:
+        try:
+            return self.render(self.capture(page))
+        except:
+            page.wait_for_event("load")
+            return self.render(self.capture(page))
 
     def fetch_browser_info(self, page: Page) -> BrowserInfo:
-        client = page.context.new_cdp_session(page)
         # extract domtree
-        tree = client.send(
+        tree = self.cdp_sessions.send(
+            page,
             "DOMSnapshot.captureSnapshot",
             {
                 "computedStyles": [],
@@ -1166,7 +1203,6 @@ class ImageObservationProcessor(ObservationProcessor):
                 "includePaintOrder": True,
             },
         )
-        client.detach()
         # calibrate the bounds, in some cases, the bounds are scaled somehow
         bounds = tree["documents"][0]["layout"]["bounds"]
         b = bounds[0]
@@ -1226,18 +1262,32 @@ class ObservationHandler:
         current_viewport_only: bool,
         viewport_size: ViewportSize,
         captioning_fn=None,
+        concurrent_capture: bool = True,
     ) -> None:
         self.main_observation_type = main_observation_type
+        # one CDP session per page, shared by both processors
+        self.cdp_sessions = CDPSessionManager()
         self.text_processor = TextObervationProcessor(
             text_observation_type,
             current_viewport_only,
             viewport_size,
             captioning_fn,
+            cdp_sessions=self.cdp_sessions,
         )
         self.image_processor = ImageObservationProcessor(
-            image_observation_type, viewport_size
+            image_observation_type,
+            viewport_size,
+            cdp_sessions=self.cdp_sessions,
         )
         self.viewport_size = viewport_size
+        # When enabled, the CPU-side rendering of each processor (tree
+        # serialization, SoM drawing, PNG decoding) runs in a worker thread
+        # while the next browser-side capture is in flight. Playwright calls
+        # themselves always stay on the calling thread.
+        self.concurrent_capture = concurrent_capture
+        self.render_executor: ThreadPoolExecutor | None = None
+        # wall-clock seconds spent in each stage of the last observation
+        self.timings: dict[str, float] = {}
 
     def get_observation_space(self) -> spaces.Dict:
         text_space = spaces.Text(
@@ -1262,13 +1312,73 @@ class ObservationHandler:
 
         return spaces.Dict({"text": text_space, "image": image_space})
 
+    def _timed(self, stage: str, fn: Callable[..., Any], *args: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+
+    def _get_observation_concurrent(
+        self, page: Page
+    ) -> tuple[str, tuple[npt.NDArray[np.uint8], str]]:
+        if self.render_executor is None:
+            self.render_executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="obs_render"
+            )
+
+        # The browser-side captures keep their original order (the text
+        # processor may rewrite image alt text that the SoM script reads).
+        text_captured = self._timed(
+            "text_capture", self.text_processor.capture, page
+        )
+        text_future = self.render_executor.submit(
+            self._timed, "text_render", self.text_processor.render, text_captured
+        )
+        try:
+            image_captured = self._timed(
+                "image_capture", self.image_processor.capture, page
+            )
+            image_obs = self.render_executor.submit(
+                self._timed,
+                "image_render",
+                self.image_processor.render,
+                image_captured,
+            ).result()
+        except Exception:
+            # same recovery as ImageObservationProcessor.process
+            page.wait_for_event("load")
+            image_obs = self._timed(
+                "image_render",
+                self.image_processor.render,
+                self.image_processor.capture(page),
+            )
+        return text_future.result(), image_obs
+
     def get_observation(self, page: Page) -> dict[str, Observation]:
-        text_obs = self.text_processor.process(page)
-        image_obs, content_str = self.image_processor.process(page)
+        self.timings = {}
+        start = time.perf_counter()
+        if self.concurrent_capture:
+            text_obs, (image_obs, content_str) = (
+                self._get_observation_concurrent(page)
+            )
+        else:
+            text_obs = self._timed("text", self.text_processor.process, page)
+            image_obs, content_str = self._timed(
+                "image", self.image_processor.process, page
+            )
+        self.timings["total"] = time.perf_counter() - start
         if content_str != "":
             text_obs = content_str
         return {"text": text_obs, "image": image_obs}
 
+    def close(self) -> None:
+        """Stop the render threads. They are started again by the next
+        concurrent observation."""
+        if self.render_executor is not None:
+            self.render_executor.shutdown(wait=True)
+            self.render_executor = None
+
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
         return {
             "text": self.text_processor.meta_data,
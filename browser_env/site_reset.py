@@ -0,0 +1,212 @@
+"""Reset the benchmark sites before tasks that modify them.
+
+A reset is done by a per-site backend, followed by a readiness probe that
+polls the site with back-off until it serves pages again. Parallel workers
+coordinate through per-site file locks: a task holds a shared lock on its
+sites while it runs, and a reset needs the exclusive lock, so a site is
+never reset under a running task or by two workers at once. The locks are
+taken through a per-site gate, which a waiting reset keeps closed, so new
+tasks cannot keep a busy site from ever being reset.
+"""
+import abc
+import fcntl
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Any, IO, Iterator
+
+import requests
+
+
+class ResetBackend(abc.ABC):
+    """Puts a site back into its initial state"""
+
+    @abc.abstractmethod
+    def reset(self, site: str) -> None:
+        ...
+
+
+class HTTPResetBackend(ResetBackend):
+    """POST to a reset endpoint, e.g. Classifieds' index.php?page=reset"""
+
+    def __init__(
+        self, url: str, data: dict[str, str] | None = None, timeout: float = 300
+    ) -> None:
+        self.url = url
+        self.data = data or {}
+        self.timeout = timeout
+
+    def reset(self, site: str) -> None:
+        response = requests.post(self.url, data=self.data, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Failed to reset {site}: {self.url} returned {response.status_code}"
+            )
+
+
+class ScriptResetBackend(ResetBackend):
+    """Run a script that restores the site, e.g. scripts/reset_shopping.sh"""
+
+    def __init__(self, command: list[str], timeout: float = 900) -> None:
+        self.command = command
+        self.timeout = timeout
+
+    def reset(self, site: str) -> None:
+        subprocess.run(self.command, check=True, timeout=self.timeout)
+
+
+class NoopResetBackend(ResetBackend):
+    """Stand-in for tests and for local sites that need no reset"""
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+
+    def reset(self, site: str) -> None:
+        self.calls.append(site)
+
+
+def wait_until_ready(
+    url: str,
+    timeout: float = 300,
+    initial_delay: float = 0.5,
+    max_delay: float = 10,
+) -> float:
+    """Poll `url` with exponential back-off until it answers without a server
+    error. Returns the time waited in seconds."""
+    start = time.perf_counter()
+    delay = initial_delay
+    while True:
+        try:
+            response = requests.get(url, timeout=max_delay)
+            if response.status_code < 500:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        if time.perf_counter() - start + delay > timeout:
+            raise TimeoutError(f"{url} is not ready after {timeout}s")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def default_reset_backends(
+    use_scripts: bool = False,
+) -> tuple[dict[str, ResetBackend], dict[str, str]]:
+    """Backends and readiness probe URLs for the configured sites.
+
+    The shopping and reddit reset scripts recreate docker containers, so they
+    are only used when `use_scripts` is set.
+    """
+    from browser_env import env_config
+
+    backends: dict[str, ResetBackend] = {}
+    probe_urls: dict[str, str] = {}
+    for site, variable in [
+        ("shopping", "SHOPPING"),
+        ("reddit", "REDDIT"),
+        ("classifieds", "CLASSIFIEDS"),
+    ]:
+        url = getattr(env_config, variable, "")
+        if url:
+            probe_urls[site] = url
+
+    if getattr(env_config, "CLASSIFIEDS", ""):
+        backends["classifieds"] = HTTPResetBackend(
+            f"{env_config.CLASSIFIEDS}/index.php?page=reset",
+            data={"token": env_config.CLASSIFIEDS_RESET_TOKEN},
+        )
+    if getattr(env_config, "REDDIT_RESET_URL", ""):
+        backends["reddit"] = HTTPResetBackend(env_config.REDDIT_RESET_URL)
+    if use_scripts:
+        backends.setdefault(
+            "reddit", ScriptResetBackend(["bash", "scripts/reset_reddit.sh"])
+        )
+        backends.setdefault(
+            "shopping", ScriptResetBackend(["bash", "scripts/reset_shopping.sh"])
+        )
+    return backends, probe_urls
+
+
+class SiteResetter:
+    """Resets sites and holds per-site locks for the duration of a task"""
+
+    def __init__(
+        self,
+        backends: dict[str, ResetBackend],
+        probe_urls: dict[str, str] | None = None,
+        lock_dir: str | Path | None = None,
+        probe_timeout: float = 300,
+    ) -> None:
+        self.backends = backends
+        self.probe_urls = probe_urls or {}
+        self.lock_dir = Path(
+            lock_dir or Path(tempfile.gettempdir()) / "webarena_site_locks"
+        )
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.probe_timeout = probe_timeout
+        # seconds per reset (backend + readiness probe), per site
+        self.latencies: dict[str, list[float]] = {}
+        self._held = ExitStack()
+
+    def _lock_file(self, site: str) -> IO[Any]:
+        f = open(self.lock_dir / f"{site}.lock", "a+")
+        self._held.callback(f.close)
+        return f
+
+    @contextmanager
+    def _gate(self, site: str) -> Iterator[None]:
+        """Exclusive while a lock on `site` is taken. A reset keeps it until
+        the tasks that hold the site are done, so no new task gets in."""
+        with open(self.lock_dir / f"{site}.gate", "a+") as gate:
+            fcntl.flock(gate, fcntl.LOCK_EX)
+            yield
+
+    def hold(
+        self, sites: list[str], reset: bool = False, shared: bool = False
+    ) -> None:
+        """Take a shared lock on `sites` until `release`, resetting the ones
+        that have a backend first if `reset` is set. With `shared`, the
+        caller already holds the sites through another resetter: the lock
+        is taken without the gate, which a reset waiting for the caller
+        keeps closed."""
+        self.release()
+        if shared:
+            for site in sorted(set(sites)):
+                fcntl.flock(self._lock_file(site), fcntl.LOCK_SH)
+            return
+        # always lock in the same order so workers cannot deadlock
+        for site in sorted(set(sites)):
+            f = self._lock_file(site)
+            with self._gate(site):
+                if reset and site in self.backends:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    self._reset_locked(site)
+                elif reset:
+                    print(
+                        f"WARNING: Reset is not supported for {site}. Please manually reset the site."
+                    )
+                fcntl.flock(f, fcntl.LOCK_SH)
+
+    def release(self) -> None:
+        """Release the locks taken by `hold`"""
+        self._held.close()
+        self._held = ExitStack()
+
+    def _reset_locked(self, site: str) -> None:
+        start = time.perf_counter()
+        try:
+            self.backends[site].reset(site)
+        except Exception as e:
+            print(f"Failed to reset {site}: {e}")
+        else:
+            print(f"Reset {site} site.")
+        if site in self.probe_urls:
+            wait_until_ready(self.probe_urls[site], timeout=self.probe_timeout)
+        self.latencies.setdefault(site, []).append(time.perf_counter() - start)
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{site}: {len(v)} resets, {sum(v) / len(v):.1f}s avg"
+            for site, v in self.latencies.items()
+        )
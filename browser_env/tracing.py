@@ -0,0 +1,160 @@
+"""Policies that decide when and how Playwright traces are recorded.
+
+Traces with screenshots and DOM snapshots slow down every action and produce
+large zips, so recording everything for every task is rarely worth it.
+"""
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from playwright.sync_api import BrowserContext
+
+TRACE_MODES = ["off", "always", "on_failure", "sampled", "chunked"]
+
+
+@dataclass
+class TracePolicy:
+    """How traces are recorded.
+
+    mode:
+        off: never trace.
+        always: trace every task and keep the zip.
+        on_failure: trace every task, but only keep the zip for tasks that
+            did not pass.
+        sampled: trace a deterministic `sample_rate` fraction of the tasks.
+        chunked: trace every task and flush a zip to `chunk_dir` every
+            `chunk_steps` steps, so long or crashing tasks do not lose the
+            whole trace.
+    screenshots/snapshots: forwarded to `context.tracing.start`.
+    """
+
+    mode: str = "off"
+    sample_rate: float = 0.1
+    chunk_steps: int = 5
+    chunk_dir: str = "traces"
+    screenshots: bool = True
+    snapshots: bool = True
+
+    def __post_init__(self) -> None:
+        if self.mode not in TRACE_MODES:
+            raise ValueError(
+                f"Unknown trace mode {self.mode}, choose from {TRACE_MODES}"
+            )
+        if not 0.0 <= self.sample_rate <= 1.0:
+            raise ValueError(
+                f"sample_rate must be in [0, 1], got {self.sample_rate}"
+            )
+
+    def should_trace(self, task_key: str) -> bool:
+        """Whether to record a trace for the task identified by `task_key`"""
+        match self.mode:
+            case "off":
+                return False
+            case "sampled":
+                # hash the task so the same tasks are sampled across reruns
+                digest = hashlib.sha1(task_key.encode("utf-8")).hexdigest()
+                return int(digest[:8], 16) / 0xFFFFFFFF < self.sample_rate
+            case _:
+                return True
+
+    def should_keep(self, passed: bool | None) -> bool:
+        """Whether a finished trace is written to disk"""
+        if self.mode == "on_failure":
+            return not passed
+        return True
+
+
+class TraceRecorder:
+    """Drives `context.tracing` for a single task according to a policy"""
+
+    def __init__(self, policy: TracePolicy) -> None:
+        self.policy = policy
+        self.context: BrowserContext | None = None
+        self.active = False
+        self.task_key = ""
+        self.num_steps = 0
+        self.num_chunks = 0
+        # accumulated over the lifetime of the recorder
+        self.bytes_written = 0
+        self.traces_written = 0
+        self.traces_discarded = 0
+        # `discard` may be called from the evaluation threads
+        self._lock = threading.Lock()
+
+    def start(self, context: BrowserContext, task_key: str) -> None:
+        self.context = context
+        self.task_key = task_key
+        self.num_steps = 0
+        self.num_chunks = 0
+        self.active = self.policy.should_trace(task_key)
+        if not self.active:
+            return
+        context.tracing.start(
+            screenshots=self.policy.screenshots,
+            snapshots=self.policy.snapshots,
+        )
+        if self.policy.mode == "chunked":
+            context.tracing.start_chunk(title=f"{task_key} steps 0-")
+
+    def on_step(self) -> None:
+        """Flush a chunk every `chunk_steps` steps in chunked mode"""
+        if not self.active or self.policy.mode != "chunked":
+            return
+        assert self.context is not None
+        self.num_steps += 1
+        if self.num_steps % self.policy.chunk_steps == 0:
+            path = (
+                Path(self.policy.chunk_dir)
+                / f"{self.task_key}_chunk_{self.num_chunks}.zip"
+            )
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.context.tracing.stop_chunk(path=path)
+            self.num_chunks += 1
+            self._count(path)
+            self.context.tracing.start_chunk(
+                title=f"steps {self.num_steps}-"
+            )
+
+    def stop(self, trace_path: str | Path, passed: bool | None = None) -> None:
+        """Finish the trace, writing it to `trace_path` if the policy keeps it.
+
+        In chunked mode the remaining steps are written to `trace_path`; the
+        earlier chunks are already in `chunk_dir`.
+        """
+        if not self.active:
+            return
+        assert self.context is not None
+        self.active = False
+        keep = self.policy.should_keep(passed)
+        if self.policy.mode == "chunked":
+            self.context.tracing.stop_chunk(path=trace_path)
+            self.context.tracing.stop()
+        elif keep:
+            self.context.tracing.stop(path=trace_path)
+        else:
+            self.context.tracing.stop()
+        if keep:
+            self._count(Path(trace_path))
+        else:
+            with self._lock:
+                self.traces_discarded += 1
+
+    def discard(self, trace_path: str | Path) -> None:
+        """Delete a written trace, once its task turned out to pass"""
+        path = Path(trace_path)
+        if not path.exists():
+            return
+        size = os.path.getsize(path)
+        path.unlink()
+        with self._lock:
+            self.bytes_written -= size
+            self.traces_written -= 1
+            self.traces_discarded += 1
+
+    def _count(self, path: Path) -> None:
+        if path.exists():
+            with self._lock:
+                self.bytes_written += os.path.getsize(path)
+                self.traces_written += 1
@@ -8,11 +8,6 @@ import numpy.typing as npt
 from beartype import beartype
 from PIL import Image
 
-try:
-    from vertexai.preview.generative_models import Image as VertexImage
-except:
-    print('Google Cloud not set up, skipping import of vertexai.preview.generative_models.Image')
-
 
 @dataclass
 class DetachedPage:
@@ -32,21 +27,30 @@ def png_bytes_to_numpy(png: bytes) -> npt.NDArray[np.uint8]:
     return np.array(Image.open(BytesIO(png)))
 
 
-def pil_to_b64(img: Image.Image) -> str:
+def pil_to_png_bytes(img: Image.Image) -> bytes:
     with BytesIO() as image_buffer:
         img.save(image_buffer, format="PNG")
-        byte_data = image_buffer.getvalue()
-        img_b64 = base64.b64encode(byte_data).decode("utf-8")
-        img_b64 = "data:image/png;base64," + img_b64
-    return img_b64
+        return image_buffer.getvalue()
+
+
+def pil_to_b64(img: Image.Image) -> str:
+    return png_bytes_to_b64(pil_to_png_bytes(img))
+
+
+def png_bytes_to_b64(byte_data: bytes) -> str:
+    img_b64 = base64.b64encode(byte_data).decode("utf-8")
+    return "data:image/png;base64," + img_b64
 
 
 def pil_to_vertex(img: Image.Image) -> str:
-    with BytesIO() as image_buffer:
-        img.save(image_buffer, format="PNG")
-        byte_data = image_buffer.getvalue()
-        img_vertex = VertexImage.from_bytes(byte_data)
-    return img_vertex
+    return png_bytes_to_vertex(pil_to_png_bytes(img))
+
+
+def png_bytes_to_vertex(byte_data: bytes) -> str:
+    # only the Gemini runs need vertexai
+    from vertexai.preview.generative_models import Image as VertexImage
+
+    return VertexImage.from_bytes(byte_data)
 
 
 class DOMNode(TypedDict):
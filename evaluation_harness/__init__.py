@@ -1,3 +1,5 @@
+from .eval_plan import EvalPlan, EvalPlanCache, load_eval_plan
+from .llm_judge import LLMJudge, get_llm_judge, set_llm_judge
 from .evaluators import *
 from .helper_functions import (
     get_query_text,
@@ -0,0 +1,385 @@
+"""Evaluation plans: the `eval` section of a task config, compiled once.
+
+`evaluator_router` and every evaluator used to re-read and re-parse the
+config file, split the ` |OR| ` alternatives and `eval()` the `func:`
+expressions on every call. An `EvalPlan` does that work once per task:
+
+- `eval_types` are checked when the plan is compiled,
+- ` |OR| ` alternatives are split and reference URLs cleaned,
+- `__SITE__` placeholders in URLs are replaced with the site URLs,
+- `func:` expressions are parsed into `HelperCall`s, which call the helper
+  function directly instead of evaluating a string.
+
+`EvalPlanCache` keeps the plans of a whole test set.
+"""
+import ast
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from browser_env import env_config
+from evaluation_harness import helper_functions
+
+OR = " |OR| "
+EVAL_TYPES = ("string_match", "url_match", "program_html", "page_image_query")
+PLACEHOLDERS = {
+    "__REDDIT__": "REDDIT",
+    "__SHOPPING__": "SHOPPING",
+    "__SHOPPING_ADMIN__": "SHOPPING_ADMIN",
+    "__GITLAB__": "GITLAB",
+    "__WIKIPEDIA__": "WIKIPEDIA",
+    "__MAP__": "MAP",
+    "__HOMEPAGE__": "HOMEPAGE",
+    "__CLASSIFIEDS__": "CLASSIFIEDS",
+}
+# stands for the `__page__` argument of a `func:` expression
+PAGE = object()
+LAST_URL = "__last_url__"
+
+
+def resolve_url(url: str) -> str:
+    """Replace the `__SITE__` placeholders of a URL with the site URLs"""
+    for placeholder, name in PLACEHOLDERS.items():
+        if placeholder in url and getattr(env_config, name, ""):
+            url = url.replace(placeholder, getattr(env_config, name))
+    return url
+
+
+def clean_url(url: str) -> str:
+    url = str(url)
+    # Replace http://localhost with http://127.0.0.1 to keep things consistent across evals.
+    url = url.replace("localhost", "127.0.0.1")
+    if url.endswith("/"):
+        url = url[:-1]
+    return url
+
+
+def split_or(value: str) -> tuple[str, ...]:
+    return tuple(value.split(OR))
+
+
+@dataclass(frozen=True)
+class HelperCall(object):
+    """A `func:` expression, e.g. `get_query_text(__page__, '.price')`"""
+
+    source: str
+    fn: Callable[..., Any]
+    args: tuple[Any, ...] = ()
+    kwargs: tuple[tuple[str, Any], ...] = ()
+
+    def __call__(self, page: Any) -> Any:
+        def bind(value: Any) -> Any:
+            if value is PAGE:
+                return page
+            if isinstance(value, str) and LAST_URL in value:
+                return value.replace(LAST_URL, page.url)
+            return value
+
+        return self.fn(
+            *[bind(a) for a in self.args],
+            **{k: bind(v) for k, v in self.kwargs},
+        )
+
+
+def compile_helper_call(source: str) -> HelperCall:
+    """Compile the expression after `func:`. Only a call of a function of
+    `helper_functions` with literal arguments, `__page__` and
+    `'__last_url__'` is accepted."""
+    try:
+        call = ast.parse(source.strip(), mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"Invalid func: {source}") from e
+    if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+        raise ValueError(f"func: must be a helper function call: {source}")
+    name = call.func.id
+    fn = getattr(helper_functions, name, None)
+    if name.startswith("_") or not callable(fn):
+        raise ValueError(f"Unknown helper function {name} in func: {source}")
+
+    def argument(node: ast.expr) -> Any:
+        if isinstance(node, ast.Name) and node.id == "__page__":
+            return PAGE
+        try:
+            return ast.literal_eval(node)
+        except ValueError as e:
+            raise ValueError(
+                f"Unsupported argument {ast.unparse(node)} in func: {source}"
+            ) from e
+
+    return HelperCall(
+        source=source,
+        fn=fn,
+        args=tuple(argument(a) for a in call.args),
+        kwargs=tuple((k.arg, argument(k.value)) for k in call.keywords),
+    )
+
+
+def compile_url(url: str) -> str | HelperCall:
+    """"last", a `func:` expression or a URL"""
+    if url.startswith("func"):
+        return compile_helper_call(url.split("func:")[1])
+    if url == "last":
+        return url
+    return resolve_url(url)
+
+
+@dataclass(frozen=True)
+class HTMLTarget(object):
+    """One `program_html` target: where to go, what to select, what to
+    check"""
+
+    url: str | HelperCall
+    # "page" (the full page), "js", "lambda" or "func"
+    locator_type: str
+    locator: str | HelperCall
+    prep_actions: tuple[str, ...]
+    # exact_match, must_include, must_exclude, required_values or fuzzy_match
+    check: str
+    # a string for exact_match, the alternatives of each value otherwise
+    required: Any
+
+    def target_url(self, page: Any) -> str:
+        if isinstance(self.url, HelperCall):
+            return self.url(page)
+        return self.url
+
+
+@dataclass(frozen=True)
+class ImageQuery(object):
+    url: str | HelperCall
+    # "" for all the images of the page, or a class selector
+    locator: str
+    vqa: tuple[tuple[str, str], ...]
+    fuzzy_images: tuple[str, ...] | None
+    ssim_threshold: float | None
+
+    def target_url(self, page: Any) -> str:
+        if isinstance(self.url, HelperCall):
+            return self.url(page)
+        return self.url
+
+
+def _compile_reference_answers(answers: Any) -> tuple[tuple[str, Any], ...]:
+    if not isinstance(answers, dict):
+        # e.g. the reference text of string_soft evaluation
+        return ()
+    compiled = []
+    for approach, value in answers.items():
+        match approach:
+            case "required_values" | "must_include":
+                assert isinstance(value, list)
+                value = tuple(split_or(v) for v in value)
+            case "must_exclude" | "one_of":
+                assert isinstance(value, list)
+                value = tuple(value)
+            case "fuzzy_match" if value != "N/A":
+                assert isinstance(value, list)
+                value = tuple(value)
+        compiled.append((approach, value))
+    return tuple(compiled)
+
+
+def _compile_html_target(target: dict[str, Any]) -> HTMLTarget:
+    locator: str = target["locator"]
+    if not locator.strip():
+        locator_type, compiled_locator = "page", locator
+    elif locator.startswith("document.") or locator.startswith(
+        "[...document."
+    ):
+        locator_type, compiled_locator = "js", locator
+    elif locator.startswith("lambda:"):
+        locator_type, compiled_locator = "lambda", locator.removeprefix(
+            "lambda:"
+        )
+    elif locator.startswith("func:"):
+        locator_type = "func"
+        compiled_locator = compile_helper_call(locator.split("func:")[1])
+    else:
+        raise ValueError(f"Unknown locator: {locator}")
+
+    contents = target["required_contents"]
+    if "exact_match" in contents:
+        check, required = "exact_match", contents["exact_match"]
+    elif "must_include" in contents:
+        assert isinstance(contents["must_include"], list)
+        check = "must_include"
+        required = tuple(split_or(c) for c in contents["must_include"])
+    elif "must_exclude" in contents:
+        assert isinstance(contents["must_exclude"], list)
+        assert all(OR not in c for c in contents["must_exclude"])
+        check, required = "must_exclude", tuple(contents["must_exclude"])
+    elif "required_values" in contents:
+        assert isinstance(contents["required_values"], list)
+        check = "required_values"
+        required = tuple(split_or(v) for v in contents["required_values"])
+    elif "fuzzy_match" in contents:
+        assert isinstance(contents["fuzzy_match"], str)
+        check, required = "fuzzy_match", split_or(contents["fuzzy_match"])
+    else:
+        raise ValueError(f"Unknown required_contents: {contents.keys()}")
+
+    return HTMLTarget(
+        url=compile_url(target["url"]),
+        locator_type=locator_type,
+        locator=compiled_locator,
+        prep_actions=tuple(target.get("prep_actions", ())),
+        check=check,
+        required=required,
+    )
+
+
+def _compile_image_query(query: dict[str, Any]) -> ImageQuery:
+    locator: str = query["eval_image_class"]
+    if locator.strip() and not locator.startswith("."):
+        raise ValueError(f"Unknown locator: {locator}")
+    fuzzy_images = None
+    if "eval_fuzzy_image_match" in query:
+        fuzzy_images = tuple(
+            resolve_url(image)
+            for image in split_or(query["eval_fuzzy_image_match"])
+        )
+    vqa = tuple((qa["question"], qa["answer"]) for qa in query.get("eval_vqa", []))
+    assert (
+        len(vqa) > 0 or fuzzy_images is not None
+    ), "eval_vqa must have at least 2 questions or eval_fuzzy_image_match must be True"
+    return ImageQuery(
+        url=compile_url(query["eval_image_url"]),
+        locator=locator,
+        vqa=vqa,
+        fuzzy_images=fuzzy_images,
+        ssim_threshold=query.get("ssim_threshold"),
+    )
+
+
+@dataclass(frozen=True)
+class EvalPlan(object):
+    """Everything the evaluators need from a task config"""
+
+    config_file: str
+    # the parsed config; shared between the users of the plan, not modified
+    config: dict[str, Any] = field(repr=False)
+    eval_types: tuple[str, ...]
+    intent: str
+    string_note: str | None
+    reference_answers: tuple[tuple[str, Any], ...]
+    reference_urls: tuple[str, ...]
+    url_note: str
+    program_html: tuple[HTMLTarget, ...]
+    page_image_queries: tuple[ImageQuery, ...]
+
+    @classmethod
+    def compile(
+        cls, config: dict[str, Any], config_file: str = ""
+    ) -> "EvalPlan":
+        eval_config = config["eval"]
+        eval_types = tuple(eval_config["eval_types"])
+        for eval_type in eval_types:
+            if eval_type not in EVAL_TYPES:
+                raise ValueError(f"eval_type {eval_type} is not supported")
+        reference_url = eval_config.get("reference_url") or ""
+        url_note = eval_config.get("url_note", "EXACT")
+        if "url_match" in eval_types and url_note not in (
+            "EXACT",
+            "GOLD in PRED",
+        ):
+            raise ValueError(f"Unknown matching rule: {url_note}")
+        return cls(
+            config_file=config_file,
+            config=config,
+            eval_types=eval_types,
+            intent=config.get("intent", ""),
+            string_note=eval_config.get("string_note"),
+            reference_answers=_compile_reference_answers(
+                eval_config["reference_answers"]
+            )
+            if "string_match" in eval_types
+            else (),
+            reference_urls=tuple(
+                clean_url(resolve_url(url)) for url in split_or(reference_url)
+            ),
+            url_note=url_note,
+            # the sections of the unused eval types may be placeholders
+            program_html=tuple(
+                _compile_html_target(t)
+                for t in eval_config["program_html"]
+            )
+            if "program_html" in eval_types
+            else (),
+            page_image_queries=tuple(
+                _compile_image_query(q)
+                for q in eval_config["page_image_query"]
+            )
+            if "page_image_query" in eval_types
+            else (),
+        )
+
+    @classmethod
+    def from_file(cls, config_file: Path | str) -> "EvalPlan":
+        with open(config_file, "r") as f:
+            config = json.load(f)
+        return cls.compile(config, str(config_file))
+
+
+@dataclass
+class EvalPlanStats:
+    compiled: int = 0
+    hits: int = 0
+    errors: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"compiled={self.compiled}, hits={self.hits}, errors={self.errors}"
+        )
+
+
+class EvalPlanCache(object):
+    """The plans of a test set, keyed by config file. A file that changed
+    since its plan was compiled is compiled again."""
+
+    def __init__(self) -> None:
+        self._plans: dict[str, tuple[tuple[int, int], EvalPlan]] = {}
+        self._lock = threading.Lock()
+        self.stats = EvalPlanStats()
+
+    def get(self, config_file: Path | str) -> EvalPlan:
+        path = os.path.abspath(config_file)
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._plans.get(path)
+            if cached is not None and cached[0] == version:
+                self.stats.hits += 1
+                return cached[1]
+        plan = EvalPlan.from_file(config_file)
+        with self._lock:
+            self._plans[path] = (version, plan)
+            self.stats.compiled += 1
+        return plan
+
+    def compile_all(
+        self, config_files: list[str]
+    ) -> dict[str, Exception]:
+        """Compile the plans of a test set ahead of time. The configs that
+        cannot be compiled are returned with their error; they fail again
+        when their task is evaluated."""
+        errors = {}
+        for config_file in config_files:
+            try:
+                self.get(config_file)
+            except Exception as e:
+                errors[config_file] = e
+        self.stats.errors += len(errors)
+        return errors
+
+
+_default_cache = EvalPlanCache()
+
+
+def load_eval_plan(config: Path | str | EvalPlan) -> EvalPlan:
+    """The plan of a config file, or the plan itself"""
+    if isinstance(config, EvalPlan):
+        return config
+    return _default_cache.get(config)
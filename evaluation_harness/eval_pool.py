@@ -0,0 +1,234 @@
+"""Evaluate finished tasks in the background while the next task runs.
+
+Evaluation used to run on the agent's page, so the worker could only reset
+into the next task once every evaluator was done navigating. An `EvalPool`
+evaluates in browser contexts of its own instead, created with the task's
+storage state, on a few worker threads that each own a browser.
+
+A new context starts from the agent's final URL, not from its page, so
+tasks whose evaluation reads the page the agent left (`"last"` targets,
+see `needs_live_page`) are still evaluated inline.
+
+From `submit` until its evaluation is done, a task's sites are held with a
+shared lock, so a reset of one of them (for the next task, or by another
+worker) waits for the evaluation.
+"""
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from playwright.sync_api import Browser, Page, sync_playwright
+
+from browser_env.site_reset import SiteResetter
+from evaluation_harness.eval_plan import EvalPlan
+from evaluation_harness.evaluators import Trajectory, evaluator_router
+from evaluation_harness.helper_functions import PseudoPage
+from evaluation_harness.rescore import TaskArtifacts, task_artifacts
+
+
+def needs_live_page(plan: EvalPlan) -> bool:
+    """Whether the evaluation reads the page the agent left"""
+    return any(t.url == "last" for t in plan.program_html) or any(
+        q.url == "last" for q in plan.page_image_queries
+    )
+
+
+def uses_page(plan: EvalPlan) -> bool:
+    """Whether the evaluation needs a browser at all; string and URL
+    matches only need the final answer and URL"""
+    return bool(plan.program_html or plan.page_image_queries)
+
+
+class EvalPage(PseudoPage):
+    """The page of an evaluation context. Its URL is the agent's final URL
+    until an evaluator navigates it."""
+
+    def __init__(self, original_page: Page | None, final_url: str) -> None:
+        self.original_page = original_page
+        self.final_url = final_url
+        self.navigated = False
+
+    @property
+    def url(self) -> str:  # type: ignore[override]
+        return self.original_page.url if self.navigated else self.final_url
+
+    def goto(self, *args: Any, **kwargs: Any) -> Any:
+        self.navigated = True
+        return self.original_page.goto(*args, **kwargs)
+
+
+@dataclass
+class EvalJob:
+    plan: EvalPlan
+    trajectory: Trajectory
+    final_url: str
+    storage_state: str | None = None
+    sites: list[str] = field(default_factory=list)
+    viewport_size: dict[str, int] | None = None
+    # returned as is with the result, e.g. the task id
+    meta: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class EvalResult:
+    job: EvalJob
+    score: float | None = None
+    # the traceback of a failed evaluation
+    error: str | None = None
+    # seconds queued, and evaluating
+    wait_seconds: float = 0.0
+    eval_seconds: float = 0.0
+    # what the evaluation read, to score the task again offline
+    artifacts: TaskArtifacts | None = None
+
+
+@dataclass
+class EvalPoolStats:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    wait_seconds: float = 0.0
+    eval_seconds: float = 0.0
+
+    def summary(self) -> str:
+        done = max(1, self.completed + self.failed)
+        return (
+            f"submitted={self.submitted}, completed={self.completed}, "
+            f"failed={self.failed}, wait={self.wait_seconds / done:.1f}s/task, "
+            f"eval={self.eval_seconds / done:.1f}s/task"
+        )
+
+
+class EvalPool(object):
+    """`workers` threads evaluating `EvalJob`s. `submit` blocks while
+    `max_pending` jobs are queued or running."""
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_pending: int | None = None,
+        captioning_fn: Callable | None = None,
+        headless: bool = True,
+        lock_dir: str | None = None,
+        on_result: Callable[[EvalResult], None] | None = None,
+    ) -> None:
+        self.captioning_fn = captioning_fn
+        self.headless = headless
+        self.lock_dir = lock_dir
+        self.on_result = on_result
+        self.stats = EvalPoolStats()
+        self._queue: queue.Queue = queue.Queue()
+        self._slots = threading.Semaphore(max_pending or 2 * workers)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: EvalJob) -> Future:
+        self._slots.acquire()
+        # taken on the caller's thread, before it can reset the sites for
+        # its next task
+        site_locks = SiteResetter({}, lock_dir=self.lock_dir)
+        # the caller's env still holds them for the task
+        site_locks.hold(job.sites, shared=True)
+        future: Future = Future()
+        with self._lock:
+            self.stats.submitted += 1
+        self._queue.put((job, future, time.perf_counter(), site_locks))
+        return future
+
+    def close(self) -> None:
+        """Wait for the submitted jobs, then stop the workers"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        # the sync API of playwright is bound to the thread that started it
+        playwright = None
+        browser: Browser | None = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                job, future, queued_at, site_locks = item
+                wait_seconds = time.perf_counter() - queued_at
+                try:
+                    if uses_page(job.plan) and (
+                        browser is None or not browser.is_connected()
+                    ):
+                        if playwright is None:
+                            playwright = sync_playwright().start()
+                        browser = playwright.chromium.launch(
+                            headless=self.headless
+                        )
+                    result = self._evaluate(browser, job)
+                except Exception:
+                    result = EvalResult(job, error=traceback.format_exc())
+                finally:
+                    site_locks.release()
+                result.wait_seconds = wait_seconds
+                self._slots.release()
+                with self._lock:
+                    if result.error is None:
+                        self.stats.completed += 1
+                    else:
+                        self.stats.failed += 1
+                    self.stats.wait_seconds += result.wait_seconds
+                    self.stats.eval_seconds += result.eval_seconds
+                if self.on_result is not None:
+                    try:
+                        self.on_result(result)
+                    except Exception:
+                        traceback.print_exc()
+                future.set_result(result)
+        finally:
+            if browser is not None:
+                browser.close()
+            if playwright is not None:
+                playwright.stop()
+
+    def _evaluate(self, browser: Browser | None, job: EvalJob) -> EvalResult:
+        start = time.perf_counter()
+        context = None
+        if uses_page(job.plan):
+            assert browser is not None
+            context = browser.new_context(
+                viewport=job.viewport_size,
+                storage_state=job.storage_state,
+                device_scale_factor=1,
+            )
+        try:
+            page = EvalPage(
+                context.new_page() if context is not None else None,
+                job.final_url,
+            )
+            evaluator = evaluator_router(
+                job.plan, captioning_fn=self.captioning_fn
+            )
+            score = evaluator(
+                trajectory=job.trajectory, config_file=job.plan, page=page
+            )
+            result = EvalResult(
+                job,
+                score=score,
+                artifacts=task_artifacts(
+                    job.plan, job.trajectory, job.final_url, evaluator, score
+                ),
+            )
+        except Exception:
+            result = EvalResult(job, error=traceback.format_exc())
+        finally:
+            if context is not None:
+                context.close()
+        result.eval_seconds = time.perf_counter() - start
+        return result
@@ -1,26 +1,31 @@
 """base class for evaluation"""
 # answer string match
 import importlib
-import json
 import re
-import time
 import urllib
 from pathlib import Path
 from typing import Any, Optional, Tuple, Union
 from urllib.parse import urljoin
 
-import evaluate  # type: ignore[import]
-import requests
 from beartype import beartype
 from beartype.door import is_bearable
-from nltk.tokenize import word_tokenize  # type: ignore
 from PIL import Image
 from playwright.sync_api import CDPSession, Page
 
 from browser_env.actions import Action
 from browser_env.utils import StateInfo
 from evaluation_harness import image_utils
+from evaluation_harness.eval_plan import (
+    EvalPlan,
+    HelperCall,
+    HTMLTarget,
+    clean_url,
+    load_eval_plan,
+)
+from evaluation_harness.llm_judge import JudgeRequest
+from evaluation_harness.site_api import TIMEOUT, site_session
 from evaluation_harness.helper_functions import (
+    SKU_REVIEW_HELPERS,
     PseudoPage,
     get_query_text,
     get_query_text_lowercase,
@@ -42,10 +47,54 @@ from evaluation_harness.helper_functions import (
     shopping_get_sku_latest_review_author,
     shopping_get_sku_latest_review_rating,
     shopping_get_sku_latest_review_text,
+    shopping_reviews_snapshot,
 )
 
 Trajectory = list[Union[Action, StateInfo]]
 
+# ms to wait, after the load event, for an evaluated page to stop loading
+# resources. Pages that keep polling (GitLab, the Magento admin) never go
+# idle, so this is capped at the fixed sleep it replaces.
+NETWORK_IDLE_TIMEOUT = 3_000
+
+
+def navigate(page: Page | PseudoPage, url: str) -> None:
+    """Go to `url` and wait until the page is loaded and its requests are
+    done, or at most NETWORK_IDLE_TIMEOUT after the load event"""
+    page.goto(url)
+    try:
+        page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT)
+    except Exception:
+        # a page that keeps polling never goes idle, read it as it is
+        pass
+
+
+def evaluate_js_locators(
+    page: Page | PseudoPage, locators: list[str]
+) -> list[str]:
+    """`str(page.evaluate(f"() => {locator}"))` of several locators in one
+    round trip, "" for the locators that throw"""
+    expressions = ", ".join(
+        f"(() => {{ try {{ return {{ value: ({locator}) }}; }} "
+        f"catch (e) {{ return {{ error: true }}; }} }})()"
+        for locator in locators
+    )
+    try:
+        results = page.evaluate(f"() => [{expressions}]")
+    except Exception:
+        # e.g. a locator that is not an expression, or a value that cannot
+        # be serialized: one at a time, as before
+        results = []
+        for locator in locators:
+            try:
+                results.append({"value": page.evaluate(f"() => {locator}")})
+            except Exception:
+                results.append({"error": True})
+    return [
+        "" if "error" in result else str(result.get("value")) or ""
+        for result in results
+    ]
+
 
 @beartype
 class Evaluator(object):
@@ -55,7 +104,7 @@ class Evaluator(object):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage
     ) -> float:
         raise NotImplementedError
@@ -168,6 +217,9 @@ class StringEvaluator(Evaluator):
     def must_include(ref: str, pred: str) -> float:
         clean_ref = StringEvaluator.clean_answer(ref)
         clean_pred = StringEvaluator.clean_answer(pred)
+        # nltk pulls in scipy, it is only loaded by the evaluators using it
+        from nltk.tokenize import word_tokenize  # type: ignore
+
         # tokenize the answer if the ref is a single word
         # prevent false positive (e.g, 0)
         if len(word_tokenize(clean_ref)) == 1:
@@ -182,6 +234,8 @@ class StringEvaluator(Evaluator):
         """Returns 1 if pred is not in ref, and 0 otherwise"""
         clean_ref = StringEvaluator.clean_answer(ref)
         clean_pred = StringEvaluator.clean_answer(pred)
+        from nltk.tokenize import word_tokenize  # type: ignore
+
         # tokenize the answer if the ref is a single word
         # prevent false positive (e.g, 0)
         if len(word_tokenize(clean_ref)) == 1:
@@ -200,32 +254,54 @@ class StringEvaluator(Evaluator):
     def ua_match(ref: str, pred: str, intent: str) -> float:
         return llm_ua_match(pred, ref, intent)
 
+    def judge_requests(
+        self, trajectory: Trajectory, config_file: Path | str | EvalPlan
+    ) -> list[JudgeRequest]:
+        """The LLM judgements scoring `trajectory` needs, to grade them in
+        a batch beforehand"""
+        plan = load_eval_plan(config_file)
+        pred = self.clean_answer(self.get_last_action(trajectory)["answer"])
+        requests = []
+        for approach, value in plan.reference_answers:
+            if approach != "fuzzy_match":
+                continue
+            if value == "N/A":
+                if plan.string_note is not None and not self.exact_match(
+                    ref=value, pred=pred
+                ):
+                    requests.append(
+                        JudgeRequest("ua_match", pred, plan.string_note, plan.intent)
+                    )
+            else:
+                requests.extend(
+                    JudgeRequest("fuzzy_match", pred, reference, plan.intent)
+                    for reference in value
+                )
+        return requests
+
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage | None = None
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
+        plan = load_eval_plan(config_file)
 
         last_action = self.get_last_action(trajectory)
         pred = self.clean_answer(last_action["answer"])
 
         score = 1.0
-        for approach, value in configs["eval"]["reference_answers"].items():
+        for approach, value in plan.reference_answers:
             match approach:
                 case "exact_match":
                     score *= self.exact_match(ref=value, pred=pred)
                 case "required_values":
                     required_values = value
-                    assert isinstance(required_values, list)
                     pred = NumericEvaluator.str_2_int(pred)
                     if pred is None:
                         score = 0.0
                     else:
-                        for v in required_values:
-                            value_or = v.split(" |OR| ")
+                        for value_or in required_values:
                             score *= any(
                                 [
                                     NumericEvaluator.compare_inequality(
@@ -235,18 +311,14 @@ class StringEvaluator(Evaluator):
                                 ]
                             )
                 case "must_include":
-                    assert isinstance(value, list)
-                    for must_value in value:
-                        value_or = must_value.split(" |OR| ")
+                    for value_or in value:
                         score *= any([self.must_include(ref=v, pred=pred) for v in value_or])
                 case "must_exclude":
-                    assert isinstance(value, list)
                     for must_excl_value in value:
                         score *= self.must_exclude(
                             ref=must_excl_value, pred=pred
                         )
                 case "one_of":
-                    assert isinstance(value, list)
                     found = False
                     for one_of_value in value:
                         one_of_value = self.clean_answer(one_of_value)
@@ -255,7 +327,7 @@ class StringEvaluator(Evaluator):
                             break
                     score = score * found
                 case "fuzzy_match":
-                    intent = configs["intent"]
+                    intent = plan.intent
                     if value == "N/A":
                         # if the instruction only asks the model to generate N/A when encountering an unachievable task
                         # without more concrete reasons
@@ -264,12 +336,11 @@ class StringEvaluator(Evaluator):
                         # this should be the default as it will prevent false positive N/A`
                         if score != 1:
                             score = 1.0 * self.ua_match(
-                                intent=configs["intent"],
-                                ref=configs["eval"]["string_note"],
+                                intent=plan.intent,
+                                ref=plan.string_note,
                                 pred=pred,
                             )
                     else:
-                        assert isinstance(value, list)
                         for reference in value:
                             score *= self.fuzzy_match(
                                 ref=reference, pred=pred, intent=intent
@@ -284,16 +355,17 @@ class StringSoftEvaluator(Evaluator):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage | None = None
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
+        plan = load_eval_plan(config_file)
 
         last_action = self.get_last_action(trajectory)
         pred = last_action["answer"]
-        ref = configs["eval"]["reference_answers"]
+        ref = plan.config["eval"]["reference_answers"]
         # rouge
+        import evaluate  # type: ignore[import]
+
         m = evaluate.load("rouge")
         rouge = m.compute(predictions=[pred], references=[ref])
         return float(rouge["rouge1"])
@@ -306,24 +378,14 @@ class URLExactEvaluator(Evaluator):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
-
-        def clean_url(url: str) -> str:
-            url = str(url)
-            # Replace http://localhost with http://127.0.0.1 to keep things consistent across evals.
-            url = url.replace("localhost", "127.0.0.1")
-            if url.endswith("/"):
-                url = url[:-1]
-            return url
+        plan = load_eval_plan(config_file)
 
         pred = clean_url(page.url)
-        ref_urls = configs["eval"]["reference_url"].split(" |OR| ")
-        ref_urls = [clean_url(url) for url in ref_urls]
-        matching_rule = configs["eval"].get("url_note", "EXACT")
+        ref_urls = plan.reference_urls
+        matching_rule = plan.url_note
         if matching_rule == "EXACT":
             if pred in ref_urls:
                 return 1.0
@@ -345,81 +407,86 @@ class HTMLContentExactEvaluator(Evaluator):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
-
-        targets = configs["eval"]["program_html"]
-
-        score = 1.0
-        for target in targets:
-            target_url: str = target["url"]  # which url to check
-            if target_url.startswith("func"):
-                func = target_url.split("func:")[1]
-                func = func.replace("__last_url__", page.url)
-                target_url = eval(func)
-
-            locator: str = target["locator"]  # js element locator
-
-            # navigate to that url
-            if target_url != "last":
-                page.goto(target_url)
-                time.sleep(3)  # TODO [shuyanzh]: fix this hard-coded sleep
-
-            # empty, use the full page
-            if not locator.strip():
-                selected_element = page.content()
-            # use JS to select the element
-            elif locator.startswith("document.") or locator.startswith(
-                "[...document."
-            ):
-                if "prep_actions" in target:
-                    try:
-                        for prep_action in target["prep_actions"]:
-                            page.evaluate(f"() => {prep_action}")
-                    except Exception:
-                        pass
-                try:
-                    selected_element = str(page.evaluate(f"() => {locator}"))
-                    if not selected_element:
-                        selected_element = ""
-                except Exception:
-                    # the page is wrong, return empty
-                    selected_element = ""
-            elif locator.startswith("lambda:"):
-                try:
-                    locator = locator.lstrip("lambda:")
-                    selected_element = page.evaluate(locator)
-                    if not selected_element:
-                        selected_element = None
-                except Exception:
-                    # the page is wrong, return empty
-                    selected_element = None
-            # run program to call API
-            elif locator.startswith("func:"):  # a helper function
-                func = locator.split("func:")[1]
-                func = func.replace("__page__", "page")
-                selected_element = eval(func)
+        plan = load_eval_plan(config_file)
+        targets = plan.program_html
+        # what each target selected, kept for re-scoring offline
+        self.selections: list[Any] = []
+        # the targets reading the reviews of the same SKUs share one fetch
+        with shopping_reviews_snapshot(self.review_skus(targets)):
+            self.selections = self.select_all(targets, page)
+        return self.score_selections(targets, self.selections)
+
+    def select_all(
+        self, targets: tuple[HTMLTarget, ...], page: Page | PseudoPage
+    ) -> list[Any]:
+        """What each target selected, up to the first that selected
+        nothing"""
+        current_url: str | None = None
+        # the page was changed by prep actions since it was loaded
+        dirty = False
+        selected: dict[int, Any] = {}
+        selections: list[Any] = []
+        for i, target in enumerate(targets):
+            target_url = target.target_url(page)  # which url to check
+
+            # navigate to that url, unless the previous target is already
+            # on it
+            if target_url != "last" and (target_url != current_url or dirty):
+                navigate(page, target_url)
+                current_url, dirty = target_url, False
+                selected = {}
+
+            if i not in selected:
+                selected.update(self.select_batch(targets, i, current_url, page))
+            if i in selected:
+                selected_element = selected.pop(i)
             else:
-                raise ValueError(f"Unknown locator: {locator}")
+                selected_element = self.select(target, page)
+                dirty = dirty or bool(target.prep_actions)
 
+            selections.append(selected_element)
             # If the selected element is None, then the page is wrong
             if selected_element is None:
-                score = 0.0
                 break
+        return selections
 
-            if "exact_match" in target["required_contents"]:
-                required_contents = target["required_contents"]["exact_match"]
+    @staticmethod
+    def review_skus(targets: tuple[HTMLTarget, ...]) -> list[str]:
+        return [
+            target.locator.args[0]
+            for target in targets
+            if target.locator_type == "func"
+            and isinstance(target.locator, HelperCall)
+            and target.locator.fn in SKU_REVIEW_HELPERS
+            and target.locator.args
+            and isinstance(target.locator.args[0], str)
+        ]
+
+    @staticmethod
+    def score_selections(
+        targets: tuple[HTMLTarget, ...], selections: list[Any]
+    ) -> float:
+        """Check the contents the targets selected, up to the first None"""
+        score = 1.0
+        for target, selected_element in zip(targets, selections):
+            if selected_element is None:
+                return 0.0
+            score *= HTMLContentExactEvaluator.check(target, selected_element)
+        return score
+
+    @staticmethod
+    def check(target: HTMLTarget, selected_element: Any) -> float:
+        score = 1.0
+        match target.check:
+            case "exact_match":
                 score *= StringEvaluator.exact_match(
-                    ref=required_contents, pred=selected_element
+                    ref=target.required, pred=selected_element
                 )
-            elif "must_include" in target["required_contents"]:
-                required_contents = target["required_contents"]["must_include"]
-                assert isinstance(required_contents, list)
-                for content in required_contents:
-                    content_or = content.split(" |OR| ")
+            case "must_include":
+                for content_or in target.required:
                     score *= any(
                         [
                             StringEvaluator.must_include(
@@ -428,19 +495,12 @@ class HTMLContentExactEvaluator(Evaluator):
                             for content in content_or
                         ]
                     )
-            elif "must_exclude" in target["required_contents"]:
-                required_contents = target["required_contents"]["must_exclude"]
-                assert isinstance(required_contents, list)
-                for content in required_contents:
-                    assert " |OR| " not in content
+            case "must_exclude":
+                for content in target.required:
                     score *= StringEvaluator.must_exclude(
                         content, pred=selected_element
                     )
-            elif "required_values" in target["required_contents"]:
-                required_values = target["required_contents"][
-                    "required_values"
-                ]
-                assert isinstance(required_values, list)
+            case "required_values":
                 if isinstance(selected_element, str):
                     selected_element = NumericEvaluator.str_2_int(
                         selected_element
@@ -448,8 +508,7 @@ class HTMLContentExactEvaluator(Evaluator):
                 if selected_element is None:
                     score = 0.0
                 else:
-                    for value in required_values:
-                        value_or = value.split(" |OR| ")
+                    for value_or in target.required:
                         score *= any(
                             [
                                 NumericEvaluator.compare_inequality(
@@ -458,27 +517,79 @@ class HTMLContentExactEvaluator(Evaluator):
                                 for value in value_or
                             ]
                         )
-            elif "fuzzy_match" in target["required_contents"]:
-                targets = target["required_contents"]["fuzzy_match"]
-                assert isinstance(targets, str)
-                targets = targets.split(" |OR| ")
-                for target in targets:
+            case "fuzzy_match":
+                for reference in target.required:
                     score *= max(
                         [
                             StringEvaluator.fuzzy_match(
-                                ref=target,
+                                ref=reference,
                                 pred=selected_element,
                                 intent="NOT USED",
                             )
                         ]
                     )
-            else:
-                raise ValueError(
-                    f"Unknown required_contents: {target['required_contents'].keys()}"
-                )
-
         return score
 
+    @staticmethod
+    def select(target: HTMLTarget, page: Page | PseudoPage) -> Any:
+        """The content of the page the target checks, None if the page is
+        wrong"""
+        locator = target.locator  # js element locator
+        # empty, use the full page
+        if target.locator_type == "page":
+            selected_element = page.content()
+        # use JS to select the element
+        elif target.locator_type == "js":
+            try:
+                for prep_action in target.prep_actions:
+                    page.evaluate(f"() => {prep_action}")
+            except Exception:
+                pass
+            try:
+                selected_element = str(page.evaluate(f"() => {locator}"))
+                if not selected_element:
+                    selected_element = ""
+            except Exception:
+                # the page is wrong, return empty
+                selected_element = ""
+        elif target.locator_type == "lambda":
+            try:
+                selected_element = page.evaluate(locator)
+                if not selected_element:
+                    selected_element = None
+            except Exception:
+                # the page is wrong, return empty
+                selected_element = None
+        # run program to call API
+        else:  # a helper function
+            selected_element = locator(page)
+        return selected_element
+
+    @staticmethod
+    def select_batch(
+        targets: tuple[HTMLTarget, ...],
+        start: int,
+        current_url: str | None,
+        page: Page | PseudoPage,
+    ) -> dict[int, str]:
+        """Select the contents of the JS targets from `start` on that read
+        the current page without changing it, in one `page.evaluate`"""
+        batch: list[int] = []
+        for i in range(start, len(targets)):
+            target = targets[i]
+            if target.locator_type != "js" or target.prep_actions:
+                break
+            # a func: URL is only resolved when its target is reached
+            if i > start and target.url not in ("last", current_url):
+                break
+            batch.append(i)
+        if len(batch) < 2:
+            return {}
+        contents = evaluate_js_locators(
+            page, [str(targets[i].locator) for i in batch]
+        )
+        return dict(zip(batch, contents))
+
 
 @beartype
 class PageImageEvaluator(Evaluator):
@@ -493,30 +604,26 @@ class PageImageEvaluator(Evaluator):
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage | None = None
     ) -> float:
-        with open(config_file, "r") as f:
-            configs = json.load(f)
-
-        for query in configs["eval"]["page_image_query"]:
-            locator: str = query["eval_image_class"]
-            target_url: str = query["eval_image_url"]
-            if target_url.startswith("func"):
-                func = target_url.split("func:")[1]
-                func = func.replace("__last_url__", page.url)
-                target_url = eval(func)
-
-            # navigate to that url
-            if target_url != "last":
-                page.goto(target_url)
-                time.sleep(3)  # TODO(jykoh): fix this hard-coded sleep
+        plan = load_eval_plan(config_file)
+
+        current_url: str | None = None
+        for query in plan.page_image_queries:
+            locator = query.locator
+            target_url = query.target_url(page)
+
+            # navigate to that url, unless the previous query is already on it
+            if target_url != "last" and target_url != current_url:
+                navigate(page, target_url)
+                current_url = target_url
 
             # empty, use the full page
             if not locator.strip():
                 images = page.get_by_role("img").all()
             # use JS to select the element
-            elif locator.startswith("."):
+            else:
                 # Get all img children under the locator
                 elements = page.query_selector_all(locator)
                 images = []
@@ -528,8 +635,6 @@ class PageImageEvaluator(Evaluator):
                         images.append(element)
                     else:
                         images.extend(element.query_selector_all("img"))
-            else:
-                raise ValueError(f"Unknown locator: {locator}")
 
             if images == []:
                 return 0.0
@@ -544,7 +649,9 @@ class PageImageEvaluator(Evaluator):
                     ):
                         image_url = urljoin(page.url, image_url)
                     image = Image.open(
-                        requests.get(image_url, stream=True).raw
+                        site_session(image_url)
+                        .get(image_url, stream=True, timeout=TIMEOUT)
+                        .raw
                     )
                     all_image_pixels.append(image)
                 except Exception as e:
@@ -555,12 +662,7 @@ class PageImageEvaluator(Evaluator):
                 return 0.0
             else:
                 # Run the VQA eval on the image elements.
-                eval_vqas = query.get("eval_vqa", [])
-                assert (
-                    len(eval_vqas) > 0 or "eval_fuzzy_image_match" in query
-                ), "eval_vqa must have at least 2 questions or eval_fuzzy_image_match must be True"
-                for qa in eval_vqas:
-                    question, answer = qa["question"], qa["answer"]
+                for question, answer in query.vqa:
                     prompt = f"Q: {question} A:"
                     pred_ans = self.captioning_fn(
                         all_image_pixels, [prompt] * len(all_image_pixels)
@@ -571,19 +673,20 @@ class PageImageEvaluator(Evaluator):
                         )
                     )
 
-                if "eval_fuzzy_image_match" in query:
-                    ssim_threshold = query.get(
-                        "ssim_threshold", self.ssim_threshold
-                    )
-                    exact_match_imgs = query["eval_fuzzy_image_match"].split(
-                        " |OR| "
+                if query.fuzzy_images is not None:
+                    ssim_threshold = (
+                        query.ssim_threshold
+                        if query.ssim_threshold is not None
+                        else self.ssim_threshold
                     )
                     all_exact_match_pixels = []
 
-                    for exact_match_img in exact_match_imgs:
+                    for exact_match_img in query.fuzzy_images:
                         if exact_match_img.startswith("http"):
                             exact_match_pixels = Image.open(
-                                requests.get(exact_match_img, stream=True).raw
+                                site_session(exact_match_img)
+                                .get(exact_match_img, stream=True, timeout=TIMEOUT)
+                                .raw
                             )
                         else:
                             exact_match_pixels = Image.open(exact_match_img)
@@ -611,7 +714,7 @@ class EvaluatorComb:
     def __call__(
         self,
         trajectory: Trajectory,
-        config_file: Path | str,
+        config_file: Path | str | EvalPlan,
         page: Page | PseudoPage
     ) -> float:
 
@@ -625,15 +728,13 @@ class EvaluatorComb:
 
 @beartype
 def evaluator_router(
-    config_file: Path | str, captioning_fn=None
+    config_file: Path | str | EvalPlan, captioning_fn=None
 ) -> EvaluatorComb:
     """Router to get the evaluator class"""
-    with open(config_file, "r") as f:
-        configs = json.load(f)
+    plan = load_eval_plan(config_file)
 
-    eval_types = configs["eval"]["eval_types"]
-    evaluators: list[Evaluator | EvaluatorPartial] = []
-    for eval_type in eval_types:
+    evaluators: list[Evaluator] = []
+    for eval_type in plan.eval_types:
         match eval_type:
             case "string_match":
                 evaluators.append(StringEvaluator())
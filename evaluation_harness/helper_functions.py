@@ -1,10 +1,9 @@
 """Implements helper functions to assist evaluation cases where other evaluators are not suitable."""
-import json
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Union
+from typing import Any, Iterator, Union
 from urllib.parse import urlparse
 
-import requests
 from beartype import beartype
 from beartype.typing import Dict, List
 from playwright.sync_api import CDPSession, Page
@@ -15,9 +14,8 @@ from browser_env.env_config import (
     SHOPPING,
     WIKIPEDIA,
 )
-from llms.providers.openai_utils import (
-    generate_from_openai_chat_completion,
-)
+from evaluation_harness.llm_judge import get_llm_judge
+from evaluation_harness.site_api import get_shopping_client
 
 
 class PseudoPage:
@@ -35,38 +33,20 @@ class PseudoPage:
 
 @beartype
 def shopping_get_auth_token() -> str:
-    response = requests.post(
-        url=f"{SHOPPING}/rest/default/V1/integration/admin/token",
-        headers={"content-type": "application/json"},
-        data=json.dumps(
-            {
-                "username": ACCOUNTS["shopping_site_admin"]["username"],
-                "password": ACCOUNTS["shopping_site_admin"]["password"],
-            }
-        ),
-    )
-    token: str = response.json()
-    return token
+    """The admin token of the shopping site, cached until it expires"""
+    return get_shopping_client().token()
 
 
 @beartype
 def shopping_get_latest_order_url() -> str:
     """Get the latest order url from the shopping website."""
-
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-
     params = {
         "searchCriteria[sortOrders][0][field]": "created_at",
         "searchCriteria[sortOrders][0][direction]": "DESC",
         "searchCriteria[pageSize]": "1",
     }
 
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/orders", params=params, headers=header
-    )
+    response = get_shopping_client().get("/rest/V1/orders", params=params)
     assert response.status_code == 200
     response_obj = response.json()["items"][0]
     order_id = int(response_obj["increment_id"])
@@ -77,15 +57,7 @@ def shopping_get_latest_order_url() -> str:
 @beartype
 def shopping_get_sku_latest_review_author(sku: str) -> str:
     """Get the latest review for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().reviews(sku)
     if len(response_obj) == 0:
         return ""
     author: str = response_obj[-1]["nickname"]
@@ -95,15 +67,7 @@ def shopping_get_sku_latest_review_author(sku: str) -> str:
 @beartype
 def shopping_get_sku_latest_review_rating(sku: str) -> str:
     """Get the latest review for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().reviews(sku)
     if len(response_obj) == 0:
         return ""
     assert response_obj[0]["ratings"][0]["rating_name"] == "Rating"
@@ -114,15 +78,7 @@ def shopping_get_sku_latest_review_rating(sku: str) -> str:
 @beartype
 def shopping_get_sku_latest_review_text(sku: str) -> str:
     """Get the latest review text for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().reviews(sku)
     if len(response_obj) == 0:
         return ""
     text: str = response_obj[-1]["detail"]
@@ -132,15 +88,7 @@ def shopping_get_sku_latest_review_text(sku: str) -> str:
 @beartype
 def shopping_get_sku_latest_review_title(sku: str) -> str:
     """Get the latest review title for shopping admin."""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}/reviews", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().reviews(sku)
     if len(response_obj) == 0:
         return ""
     title: str = response_obj[-1]["title"]
@@ -150,15 +98,7 @@ def shopping_get_sku_latest_review_title(sku: str) -> str:
 @beartype
 def shopping_get_sku_product_page_url(sku: str) -> str:
     """Get product page url from sku"""
-    header = {
-        "Authorization": f"Bearer {shopping_get_auth_token()}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(
-        f"{SHOPPING}/rest/V1/products/{sku}", headers=header
-    )
-    assert response.status_code == 200
-    response_obj = response.json()
+    response_obj = get_shopping_client().product(sku)
     if len(response_obj) == 0:
         return ""
     for custom_attributes in response_obj["custom_attributes"]:
@@ -167,6 +107,33 @@ def shopping_get_sku_product_page_url(sku: str) -> str:
     return ""
 
 
+@contextmanager
+def shopping_reviews_snapshot(skus: list[str]) -> Iterator[None]:
+    """Serve the `shopping_get_sku_latest_review_*` helpers from one fetch
+    of the reviews of each SKU until the block ends, fetching those of
+    `skus` concurrently up front"""
+    if not skus:
+        yield
+        return
+    client = get_shopping_client()
+    with client.snapshot():
+        try:
+            client.prefetch_reviews(skus)
+        except Exception:
+            # the helpers fetch them one by one, and report the error
+            pass
+        yield
+
+
+# the helpers whose first argument is a SKU whose reviews they read
+SKU_REVIEW_HELPERS = (
+    shopping_get_sku_latest_review_author,
+    shopping_get_sku_latest_review_rating,
+    shopping_get_sku_latest_review_text,
+    shopping_get_sku_latest_review_title,
+)
+
+
 @beartype
 def shopping_get_all_product_order(
     page: Page | PseudoPage,
@@ -579,64 +546,9 @@ def gitlab_get_project_memeber_role(
 @beartype
 def llm_fuzzy_match(pred: str, reference: str, question: str) -> float:
     """Check whether the prediction matches the reference with GPT-4-turbo"""
-    messages: list[dict[str, Any]] = []
-    # construct the question to ask
-    message = "Help a teacher to grade the answer of a student given a question. Keep in mind that the student may use different phrasing or wording to answer the question. The goal is to evaluate whether the answer is semantically equivalent to the reference answer.\n"
-    message += f"question: {question}\n"
-    message += f"reference answer: {reference}\n"
-    message += "all the string 'N/A' that you see is a special sequence that means 'not achievable'\n"
-    message += f"student answer: {pred}\n"
-    message += "Conclude the judgement by 'correct', 'incorrect', or 'partially correct'. Only output one of these options, and nothing else."
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant"},
-        {"role": "user", "content": message},
-    ]
-
-    response = generate_from_openai_chat_completion(
-        model="gpt-4-1106-preview",
-        messages=messages,
-        temperature=0,
-        max_tokens=768,
-        top_p=1.0,
-        context_length=0,
-    ).lower()
-    if "partially correct" in response or "incorrect" in response:
-        return 0.0
-    else:
-        assert "correct" in response, response
-        return 1.0
+    return get_llm_judge().grade("fuzzy_match", pred, reference, question)
 
 
 def llm_ua_match(pred: str, reference: str, question: str) -> float:
     """Check whether the prediction matches the reference with GPT-4-turbo"""
-    messages: list[dict[str, Any]] = []
-    # construct the question to ask
-    message = ""
-    message += f"task: {question}\n"
-    message += f"actual unachievable reason: {reference}\n"
-    message += f"reported unachievable reason: {pred}\n"
-    message += (
-        "The task described above is inherently unachievable due to the reason specified under 'actual unachievable reason'. "
-        "An individual previously attempted this task and was unable to complete it. They provided a reason for their failure, "
-        "which is listed under 'reported unachievable reason'. Your role is to review both the actual and reported reasons. "
-        "Determine if the reported reason aligns with the actual reason, even if implicitly. "
-        "If the stated reason is in line with the actual reason, respond with 'same'. Otherwise, respond with 'different'."
-    )
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant"},
-        {"role": "user", "content": message},
-    ]
-
-    response = generate_from_openai_chat_completion(
-        model="gpt-4-1106-preview",
-        messages=messages,
-        temperature=0,
-        max_tokens=768,
-        top_p=1.0,
-        context_length=0,
-    ).lower()
-    if "different" in response:
-        return 0.0
-    else:
-        assert "same" in response
-        return 1.0
+    return get_llm_judge().grade("ua_match", pred, reference, question)
@@ -3,16 +3,28 @@ from typing import List
 import numpy as np
 from PIL import Image
 from skimage.metrics import structural_similarity as ssim
-from transformers import (
-    Blip2ForConditionalGeneration,
-    Blip2Processor,
-)
+
+from llms.resources import get_resource
 
 
 def get_captioning_fn(
     device, dtype, model_name: str = "Salesforce/blip2-flan-t5-xl"
 ) -> callable:
+    """The captioning function of `model_name` on `device`, loaded once per
+    process and shared by the agent and the evaluators"""
+    return get_resource(
+        ("captioning", model_name, str(device), str(dtype)),
+        lambda: _load_captioning_fn(device, dtype, model_name),
+    )
+
+
+def _load_captioning_fn(device, dtype, model_name: str) -> callable:
     if "blip2" in model_name:
+        from transformers import (
+            Blip2ForConditionalGeneration,
+            Blip2Processor,
+        )
+
         captioning_processor = Blip2Processor.from_pretrained(model_name)
         captioning_model = Blip2ForConditionalGeneration.from_pretrained(
             model_name, torch_dtype=dtype
@@ -0,0 +1,249 @@
+"""LLM-judged string matches (`fuzzy_match` and `ua_match`), memoized.
+
+A verdict is keyed by the kind of match, the question, the reference, the
+prediction and the judge model. Grading the same answer again, e.g. when
+re-scoring a result directory, is answered from the memo. With `path` set,
+every judgement is also appended to a jsonl file together with the judge's
+raw response, for audit, and loaded back by the next `LLMJudge` on it.
+
+`grade_batch` grades the judgements missing from the memo concurrently
+through `agenerate_from_openai_chat_completion`; the evaluators then find
+them in the memo.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+JUDGE_MODEL = "gpt-4-1106-preview"
+JUDGE_KINDS = ["fuzzy_match", "ua_match"]
+
+
+@dataclass(frozen=True)
+class JudgeRequest:
+    kind: str
+    prediction: str
+    reference: str
+    question: str
+
+
+@dataclass
+class Judgement:
+    kind: str
+    prediction: str
+    reference: str
+    question: str
+    model: str
+    response: str
+    score: float
+    created: float
+
+
+def judge_messages(request: JudgeRequest) -> list[dict[str, Any]]:
+    if request.kind == "fuzzy_match":
+        message = "Help a teacher to grade the answer of a student given a question. Keep in mind that the student may use different phrasing or wording to answer the question. The goal is to evaluate whether the answer is semantically equivalent to the reference answer.\n"
+        message += f"question: {request.question}\n"
+        message += f"reference answer: {request.reference}\n"
+        message += "all the string 'N/A' that you see is a special sequence that means 'not achievable'\n"
+        message += f"student answer: {request.prediction}\n"
+        message += "Conclude the judgement by 'correct', 'incorrect', or 'partially correct'. Only output one of these options, and nothing else."
+    elif request.kind == "ua_match":
+        message = ""
+        message += f"task: {request.question}\n"
+        message += f"actual unachievable reason: {request.reference}\n"
+        message += f"reported unachievable reason: {request.prediction}\n"
+        message += (
+            "The task described above is inherently unachievable due to the reason specified under 'actual unachievable reason'. "
+            "An individual previously attempted this task and was unable to complete it. They provided a reason for their failure, "
+            "which is listed under 'reported unachievable reason'. Your role is to review both the actual and reported reasons. "
+            "Determine if the reported reason aligns with the actual reason, even if implicitly. "
+            "If the stated reason is in line with the actual reason, respond with 'same'. Otherwise, respond with 'different'."
+        )
+    else:
+        raise ValueError(f"Unknown judge kind {request.kind}, choose from {JUDGE_KINDS}")
+    return [
+        {"role": "system", "content": "You are a helpful assistant"},
+        {"role": "user", "content": message},
+    ]
+
+
+def parse_verdict(kind: str, response: str) -> float:
+    response = response.lower()
+    if kind == "fuzzy_match":
+        if "partially correct" in response or "incorrect" in response:
+            return 0.0
+        assert "correct" in response, response
+        return 1.0
+    if "different" in response:
+        return 0.0
+    assert "same" in response, response
+    return 1.0
+
+
+def judge_key(request: JudgeRequest, model: str) -> str:
+    payload = [
+        request.kind,
+        request.question,
+        request.reference,
+        request.prediction,
+        model,
+    ]
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class LLMJudgeStats:
+    hits: int = 0
+    graded: int = 0
+    # graded by `grade_batch`, included in `graded`
+    batched: int = 0
+    loaded: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"hits={self.hits}, graded={self.graded}, "
+            f"batched={self.batched}, loaded={self.loaded}"
+        )
+
+
+class LLMJudge(object):
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        model: str = JUDGE_MODEL,
+        requests_per_minute: int = 300,
+    ) -> None:
+        self.path = Path(path) if path else None
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.stats = LLMJudgeStats()
+        self._judgements: dict[str, Judgement] = {}
+        self._lock = threading.Lock()
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        assert self.path is not None
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    judgement = Judgement(**json.loads(line))
+                except (ValueError, TypeError):
+                    # a line cut short by an interrupted run
+                    continue
+                request = JudgeRequest(
+                    judgement.kind,
+                    judgement.prediction,
+                    judgement.reference,
+                    judgement.question,
+                )
+                self._judgements[judge_key(request, judgement.model)] = judgement
+                self.stats.loaded += 1
+
+    def lookup(self, request: JudgeRequest) -> Judgement | None:
+        with self._lock:
+            return self._judgements.get(judge_key(request, self.model))
+
+    def _record(self, request: JudgeRequest, response: str) -> Judgement:
+        judgement = Judgement(
+            kind=request.kind,
+            prediction=request.prediction,
+            reference=request.reference,
+            question=request.question,
+            model=self.model,
+            response=response,
+            score=parse_verdict(request.kind, response),
+            created=time.time(),
+        )
+        with self._lock:
+            self._judgements[judge_key(request, self.model)] = judgement
+            self.stats.graded += 1
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(asdict(judgement)) + "\n")
+        return judgement
+
+    def _generate(self, request: JudgeRequest) -> str:
+        from llms import generate_from_openai_chat_completion
+
+        return generate_from_openai_chat_completion(
+            model=self.model,
+            messages=judge_messages(request),
+            temperature=0,
+            max_tokens=768,
+            top_p=1.0,
+            context_length=0,
+        )
+
+    def judge(self, request: JudgeRequest) -> Judgement:
+        judgement = self.lookup(request)
+        if judgement is not None:
+            with self._lock:
+                self.stats.hits += 1
+            return judgement
+        return self._record(request, self._generate(request))
+
+    def grade(
+        self, kind: str, prediction: str, reference: str, question: str
+    ) -> float:
+        return self.judge(
+            JudgeRequest(kind, prediction, reference, question)
+        ).score
+
+    def grade_batch(self, requests: list[JudgeRequest]) -> list[float | None]:
+        """Grade `requests`, calling the judge concurrently for the ones
+        that are not memoized. None for the requests the judge failed on,
+        which `judge` calls again one by one."""
+        missing = list(
+            dict.fromkeys(r for r in requests if self.lookup(r) is None)
+        )
+        if missing:
+            from llms.providers.openai_utils import (
+                agenerate_from_openai_chat_completion,
+            )
+
+            responses = asyncio.run(
+                agenerate_from_openai_chat_completion(
+                    messages_list=[judge_messages(r) for r in missing],
+                    engine=self.model,
+                    temperature=0,
+                    max_tokens=768,
+                    top_p=1.0,
+                    context_length=0,
+                    requests_per_minute=self.requests_per_minute,
+                )
+            )
+            for request, response in zip(missing, responses):
+                # empty responses are API errors
+                if not response:
+                    continue
+                try:
+                    self._record(request, response)
+                except AssertionError:
+                    # not a verdict
+                    continue
+                self.stats.batched += 1
+        judgements = [self.lookup(r) for r in requests]
+        return [j.score if j is not None else None for j in judgements]
+
+
+_active_judge: LLMJudge | None = None
+
+
+def set_llm_judge(judge: LLMJudge | None) -> None:
+    """Install the judge used by `llm_fuzzy_match` and `llm_ua_match`"""
+    global _active_judge
+    _active_judge = judge
+
+
+def get_llm_judge() -> LLMJudge:
+    """The installed judge, or a memo-only one for the process"""
+    global _active_judge
+    if _active_judge is None:
+        _active_judge = LLMJudge()
+    return _active_judge
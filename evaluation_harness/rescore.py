@@ -0,0 +1,296 @@
+"""Score saved tasks again without a browser or an agent.
+
+`run.py` saves the artifacts of each evaluated task to
+`<result_dir>/artifacts/<task_id>.json`: the final answer, the final URL and
+what each `program_html` target selected on the page. `rescore_dir` scores
+them again with the current configs and evaluators, e.g. after a fix of a
+reference answer or of a string evaluator.
+
+- `string_match` and `url_match` only need the answer and the URL.
+- `program_html` checks the saved selections, as long as the targets still
+  select the same thing (same url, locator and prep actions); only their
+  required contents may have changed.
+- `page_image_query` needs the page images and a captioning model, and is
+  not scored offline.
+
+Tasks that cannot be scored offline get a None score.
+"""
+import json
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from browser_env.actions import create_stop_action
+from evaluation_harness.eval_plan import EvalPlan, load_eval_plan
+from evaluation_harness.evaluators import (
+    EvaluatorComb,
+    HTMLContentExactEvaluator,
+    StringEvaluator,
+    Trajectory,
+    URLExactEvaluator,
+)
+from evaluation_harness.helper_functions import PseudoPage
+from evaluation_harness.llm_judge import (
+    JudgeRequest,
+    LLMJudge,
+    set_llm_judge,
+)
+
+OFFLINE_EVAL_TYPES = ["string_match", "url_match", "program_html"]
+# the parts of a program_html target that decide what it selects
+SELECTION_KEYS = ["url", "locator", "prep_actions"]
+
+
+@dataclass
+class TaskArtifacts:
+    task_id: Any
+    config_file: str
+    answer: str
+    final_url: str
+    # per program_html target, the SELECTION_KEYS of its config and what it
+    # `selected`, up to the first target that selected nothing
+    program_html: list[dict[str, Any]] | None = None
+    score: float | None = None
+
+
+def task_artifacts(
+    plan: EvalPlan,
+    trajectory: Trajectory,
+    final_url: str,
+    evaluator: EvaluatorComb | None = None,
+    score: float | None = None,
+) -> TaskArtifacts:
+    try:
+        answer = StringEvaluator.get_last_action(trajectory)["answer"]
+    except ValueError:
+        answer = ""
+    program_html = None
+    for e in evaluator.evaluators if evaluator is not None else []:
+        if isinstance(e, HTMLContentExactEvaluator) and hasattr(e, "selections"):
+            targets = plan.config["eval"]["program_html"]
+            program_html = [
+                {
+                    **{key: target.get(key) for key in SELECTION_KEYS},
+                    "selected": selected,
+                }
+                for target, selected in zip(targets, e.selections)
+            ]
+    return TaskArtifacts(
+        task_id=plan.config.get("task_id"),
+        config_file=plan.config_file or "",
+        answer=answer,
+        final_url=final_url,
+        program_html=program_html,
+        score=score,
+    )
+
+
+def save_artifacts(result_dir: str | Path, artifacts: TaskArtifacts) -> None:
+    artifacts_dir = Path(result_dir) / "artifacts"
+    artifacts_dir.mkdir(parents=True, exist_ok=True)
+    with open(artifacts_dir / f"{artifacts.task_id}.json", "w") as f:
+        # helper functions may select values json does not know
+        json.dump(asdict(artifacts), f, default=str)
+
+
+def load_artifacts(result_dir: str | Path) -> list[TaskArtifacts]:
+    return [
+        TaskArtifacts(**json.loads(path.read_text()))
+        for path in sorted((Path(result_dir) / "artifacts").glob("*.json"))
+    ]
+
+
+def load_previous_scores(result_dir: str | Path) -> dict[str, float]:
+    """The last recorded score of each task in results.jsonl"""
+    scores = {}
+    results_file = Path(result_dir) / "results.jsonl"
+    if results_file.exists():
+        with open(results_file, "r") as f:
+            for line in f:
+                result = json.loads(line)
+                scores[str(result["task_id"])] = result["score"]
+    return scores
+
+
+def saved_selections(
+    plan: EvalPlan, artifacts: TaskArtifacts
+) -> list[Any] | None:
+    """The saved selections of the plan's targets, None if they were not
+    saved or the targets now select something else"""
+    if artifacts.program_html is None:
+        return None
+    targets = plan.config["eval"]["program_html"]
+    saved = artifacts.program_html
+    if len(saved) > len(targets):
+        return None
+    for target, entry in zip(targets, saved):
+        for key in SELECTION_KEYS:
+            if target.get(key) != entry[key]:
+                return None
+    selections = [entry["selected"] for entry in saved]
+    # the evaluation stops at the first target that selected nothing
+    if len(saved) < len(targets) and (not saved or selections[-1] is not None):
+        return None
+    return selections
+
+
+def rescore_task(plan: EvalPlan, artifacts: TaskArtifacts) -> float | None:
+    if any(t not in OFFLINE_EVAL_TYPES for t in plan.eval_types):
+        return None
+    trajectory = [create_stop_action(artifacts.answer)]
+    page = PseudoPage(None, artifacts.final_url)
+    score = 1.0
+    for eval_type in plan.eval_types:
+        match eval_type:
+            case "string_match":
+                score *= StringEvaluator()(trajectory, plan, page)
+            case "url_match":
+                score *= URLExactEvaluator()(trajectory, plan, page)
+            case "program_html":
+                selections = saved_selections(plan, artifacts)
+                if selections is None:
+                    return None
+                score *= HTMLContentExactEvaluator.score_selections(
+                    plan.program_html, selections
+                )
+    return score
+
+
+def judge_requests(
+    plan: EvalPlan, artifacts: TaskArtifacts
+) -> list[JudgeRequest]:
+    """The LLM judgements `rescore_task` needs, to grade them in a batch"""
+    requests = []
+    if "string_match" in plan.eval_types:
+        requests.extend(
+            StringEvaluator().judge_requests(
+                [create_stop_action(artifacts.answer)], plan
+            )
+        )
+    if "program_html" in plan.eval_types:
+        selections = saved_selections(plan, artifacts) or []
+        for target, selected in zip(plan.program_html, selections):
+            if target.check == "fuzzy_match" and isinstance(selected, str):
+                requests.extend(
+                    JudgeRequest("fuzzy_match", selected, reference, "NOT USED")
+                    for reference in target.required
+                )
+    return requests
+
+
+@dataclass
+class RescoreResult:
+    task_id: Any
+    config_file: str
+    previous: float | None
+    score: float | None
+    error: str | None = None
+
+    @property
+    def changed(self) -> bool:
+        return self.score is not None and self.score != self.previous
+
+
+def _config_path(artifacts: TaskArtifacts, config_dir: str | None) -> str:
+    if config_dir:
+        return str(Path(config_dir) / Path(artifacts.config_file).name)
+    return artifacts.config_file
+
+
+def _init_worker(judge_path: str | None) -> None:
+    set_llm_judge(LLMJudge(judge_path))
+
+
+def _rescore(
+    artifacts: TaskArtifacts, config_file: str, previous: float | None
+) -> RescoreResult:
+    try:
+        score = rescore_task(load_eval_plan(config_file), artifacts)
+        return RescoreResult(artifacts.task_id, config_file, previous, score)
+    except Exception:
+        return RescoreResult(
+            artifacts.task_id,
+            config_file,
+            previous,
+            None,
+            error=traceback.format_exc(),
+        )
+
+
+def rescore_dir(
+    result_dir: str | Path,
+    config_dir: str | None = None,
+    workers: int = 8,
+    judge_path: str | Path | None = None,
+) -> list[RescoreResult]:
+    """Score the saved tasks of `result_dir` again. The LLM judgements are
+    graded in one batch first, then the tasks are scored by `workers`
+    processes that read the judgements from `judge_path`, and grade the
+    ones the batch failed on."""
+    artifacts_list = load_artifacts(result_dir)
+    previous_scores = load_previous_scores(result_dir)
+    config_files = [_config_path(a, config_dir) for a in artifacts_list]
+    judge_path = str(judge_path or Path(result_dir) / "llm_judge.jsonl")
+
+    judge = LLMJudge(judge_path)
+    set_llm_judge(judge)
+    requests: list[JudgeRequest] = []
+    for artifacts, config_file in zip(artifacts_list, config_files):
+        try:
+            requests.extend(
+                judge_requests(load_eval_plan(config_file), artifacts)
+            )
+        except Exception:
+            # reported by the worker scoring the task
+            continue
+    if requests:
+        try:
+            judge.grade_batch(requests)
+        except Exception as e:
+            # the workers grade what is missing one by one
+            logging.warning(f"Grading the LLM judgements in a batch failed: {e!r}")
+
+    previous = [
+        previous_scores.get(str(a.task_id), a.score) for a in artifacts_list
+    ]
+    if workers <= 1:
+        return list(map(_rescore, artifacts_list, config_files, previous))
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(judge_path,),
+    ) as pool:
+        return list(
+            pool.map(
+                _rescore,
+                artifacts_list,
+                config_files,
+                previous,
+                chunksize=max(1, len(artifacts_list) // (4 * workers)),
+            )
+        )
+
+
+def summarize(results: list[RescoreResult]) -> str:
+    scored = [r for r in results if r.score is not None]
+    compared = [r for r in scored if r.previous is not None]
+    changed = [r for r in results if r.changed]
+    lines = [
+        f"tasks={len(results)}, scored={len(scored)}, "
+        f"unscorable={sum(r.score is None and r.error is None for r in results)}, "
+        f"errors={sum(r.error is not None for r in results)}, "
+        f"changed={len(changed)}"
+    ]
+    if compared:
+        before = sum(r.previous for r in compared) / len(compared)
+        after = sum(r.score for r in compared) / len(compared)
+        lines.append(
+            f"success rate: {before:.4f} -> {after:.4f} "
+            f"(over the {len(compared)} tasks scored before and now)"
+        )
+    for r in changed:
+        lines.append(f"  {r.task_id}: {r.previous} -> {r.score} ({r.config_file})")
+    return "\n".join(lines)
@@ -0,0 +1,186 @@
+"""REST access to the benchmark sites for the evaluation helpers.
+
+- Each site gets one keep-alive `requests` session per process, with a
+  timeout on every request and retries of GETs on connection errors and
+  502/503/504.
+- The Magento admin token is fetched once and reused until `token_ttl`
+  (Magento's admin tokens live 4 hours by default); a 401 fetches a new
+  one, once for all the threads that got it, and retries the request once.
+- Within `ShoppingClient.snapshot`, e.g. while a task is evaluated, the
+  reviews of each SKU are fetched once, and `prefetch_reviews` fetches
+  those of several SKUs concurrently.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from llms.resources import get_resource
+
+# seconds to connect, and to read the response
+TIMEOUT = (5, 60)
+TOKEN_TTL = 3600
+
+
+def site_session(url: str, pool_size: int = 8) -> requests.Session:
+    """The session of the site serving `url`, shared by the process"""
+    parsed = urlparse(url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+
+    def create() -> requests.Session:
+        session = requests.Session()
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    return get_resource(("site_session", origin), create)
+
+
+class ShoppingClient(object):
+    """The admin REST API of the Magento shopping site"""
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        token_ttl: float = TOKEN_TTL,
+    ) -> None:
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.token_ttl = token_ttl
+        self.session = site_session(base_url)
+        self._token: str | None = None
+        self._token_expires = 0.0
+        self._lock = threading.Lock()
+        # the reviews of the current snapshot of each thread
+        self._local = threading.local()
+
+    def token(self, stale: str | None = None) -> str:
+        """The admin token. `stale` is a token the API rejected: a new one
+        is fetched, unless another thread already replaced it."""
+        with self._lock:
+            if (
+                self._token is None
+                or self._token == stale
+                or time.time() >= self._token_expires
+            ):
+                response = self.session.post(
+                    f"{self.base_url}/rest/default/V1/integration/admin/token",
+                    headers={"content-type": "application/json"},
+                    data=json.dumps(
+                        {"username": self.username, "password": self.password}
+                    ),
+                    timeout=TIMEOUT,
+                )
+                if response.status_code != 200:
+                    raise RuntimeError(
+                        f"Failed to get the shopping admin token: "
+                        f"{response.status_code} {response.text[:200]}"
+                    )
+                self._token = response.json()
+                self._token_expires = time.time() + self.token_ttl
+            assert self._token is not None
+            return self._token
+
+    def get(
+        self, path: str, params: dict[str, str] | None = None
+    ) -> requests.Response:
+        """GET `path` of the REST API, e.g. /rest/V1/orders"""
+        token = self.token()
+        response = self._get(path, params, token)
+        if response.status_code == 401:
+            # the token was revoked or expired early
+            response = self._get(path, params, self.token(stale=token))
+        return response
+
+    def _get(
+        self, path: str, params: dict[str, str] | None, token: str
+    ) -> requests.Response:
+        return self.session.get(
+            f"{self.base_url}{path}",
+            params=params,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            timeout=TIMEOUT,
+        )
+
+    @contextmanager
+    def snapshot(self) -> Iterator[None]:
+        """Fetch the reviews of each SKU once on this thread until the
+        block ends, for reads of a site that does not change meanwhile"""
+        if getattr(self._local, "reviews", None) is not None:
+            # nested in another snapshot
+            yield
+            return
+        self._local.reviews = {}
+        try:
+            yield
+        finally:
+            self._local.reviews = None
+
+    def reviews(self, sku: str) -> list[dict[str, Any]]:
+        """The reviews of a product, oldest first"""
+        memo = getattr(self._local, "reviews", None)
+        if memo is not None and sku in memo:
+            return memo[sku]
+        reviews = self._fetch_reviews(sku)
+        if memo is not None:
+            memo[sku] = reviews
+        return reviews
+
+    def prefetch_reviews(self, skus: list[str], max_workers: int = 8) -> None:
+        """Fetch the reviews of `skus` into the current snapshot. The review
+        endpoint is per product, so the SKUs are fetched concurrently over
+        the shared session."""
+        memo = getattr(self._local, "reviews", None)
+        assert memo is not None, "prefetch_reviews needs a snapshot"
+        missing = [sku for sku in dict.fromkeys(skus) if sku not in memo]
+        if not missing:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+            memo.update(zip(missing, pool.map(self._fetch_reviews, missing)))
+
+    def _fetch_reviews(self, sku: str) -> list[dict[str, Any]]:
+        response = self.get(f"/rest/V1/products/{sku}/reviews")
+        assert response.status_code == 200
+        return response.json()
+
+    def product(self, sku: str) -> dict[str, Any]:
+        response = self.get(f"/rest/V1/products/{sku}")
+        assert response.status_code == 200
+        return response.json()
+
+
+def get_shopping_client() -> ShoppingClient:
+    """The shopping client of the process, for the configured site"""
+    from browser_env.env_config import ACCOUNTS, SHOPPING
+
+    return get_resource(
+        ("shopping_client", SHOPPING),
+        lambda: ShoppingClient(
+            SHOPPING,
+            ACCOUNTS["shopping_site_admin"]["username"],
+            ACCOUNTS["shopping_site_admin"]["password"],
+        ),
+    )
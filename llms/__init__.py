@@ -1,20 +1,37 @@
 """This module is adapt from https://github.com/zeno-ml/zeno-build"""
-try:
-    from .providers.gemini_utils import generate_from_gemini_completion
-except:
-    print('Google Cloud not set up, skipping import of providers.gemini_utils.generate_from_gemini_completion')
+import importlib
+from typing import Any
+
+from .utils import call_llm, call_llm_streaming
+
+# provider functions and their modules, imported on first access so that
+# importing `llms` does not load the SDKs of the providers that are not used
+_PROVIDER_FUNCTIONS = {
+    "generate_from_openai_completion": ".providers.openai_utils",
+    "generate_from_openai_chat_completion": ".providers.openai_utils",
+    "stream_from_openai_chat_completion": ".providers.openai_utils",
+    "generate_from_huggingface_completion": ".providers.hf_utils",
+    "stream_from_huggingface_completion": ".providers.hf_utils",
+    "generate_from_gemini_completion": ".providers.gemini_utils",
+    "stream_from_gemini_completion": ".providers.gemini_utils",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _PROVIDER_FUNCTIONS:
+        module = importlib.import_module(_PROVIDER_FUNCTIONS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-from .providers.hf_utils import generate_from_huggingface_completion
-from .providers.openai_utils import (
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-)
-from .utils import call_llm
 
 __all__ = [
     "generate_from_openai_completion",
     "generate_from_openai_chat_completion",
     "generate_from_huggingface_completion",
     "generate_from_gemini_completion",
+    "stream_from_openai_chat_completion",
+    "stream_from_huggingface_completion",
+    "stream_from_gemini_completion",
     "call_llm",
+    "call_llm_streaming",
 ]
@@ -41,7 +41,11 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
         llm_config.gen_config["max_tokens"] = args.max_tokens
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_truncation"] = args.obs_truncation
+        llm_config.gen_config["obs_compression"] = args.obs_compression
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["speculative_samples"] = args.speculative_samples
+        llm_config.gen_config["stream_actions"] = args.stream_actions
     elif args.provider == "huggingface":
         llm_config.gen_config["temperature"] = args.temperature
         llm_config.gen_config["top_p"] = args.top_p
@@ -50,8 +54,12 @@ def construct_llm_config(args: argparse.Namespace) -> LMConfig:
             [args.stop_token] if args.stop_token else None
         )
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["obs_truncation"] = args.obs_truncation
+        llm_config.gen_config["obs_compression"] = args.obs_compression
         llm_config.gen_config["model_endpoint"] = args.model_endpoint
         llm_config.gen_config["max_retry"] = args.max_retry
+        llm_config.gen_config["speculative_samples"] = args.speculative_samples
+        llm_config.gen_config["stream_actions"] = args.stream_actions
     else:
         raise NotImplementedError(f"provider {args.provider} not implemented")
     return llm_config
@@ -0,0 +1,236 @@
+"""Rate limiting and back-off shared by every worker process.
+
+Parallel `run.py` workers each used to retry on their own: after a 429 they
+all slept for about the same time and hit the API again together. The
+`RateLimiter` keeps token buckets for requests and tokens per minute in a
+small state file under a file lock, so the budget is split between the
+processes that use the same file. When a server asks to back off
+(`Retry-After`), the pause is written to the same file and every process
+waits it out.
+"""
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Iterator, Mapping
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from llms.resources import get_resource
+
+# extra random wait so that the processes do not retry in lockstep
+MAX_JITTER = 0.5
+
+
+def retry_after_seconds(headers: Mapping[str, str] | None) -> float | None:
+    """The back-off asked for by the server, if any"""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(prompt: Any, max_tokens: int = 0) -> int:
+    """Rough token count of a prompt (4 characters per token, a fixed cost
+    per image) plus the tokens that may be generated"""
+    if isinstance(prompt, str):
+        return len(prompt) // 4 + max_tokens
+    if isinstance(prompt, dict):
+        if prompt.get("type") in ("image_url", "input_image"):
+            return 85 + max_tokens
+        return (
+            sum(estimate_tokens(v) for v in prompt.values()) + max_tokens
+        )
+    if isinstance(prompt, (list, tuple)):
+        return sum(estimate_tokens(p) for p in prompt) + max_tokens
+    return max_tokens
+
+
+@dataclass
+class RateLimiterStats:
+    requests: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    back_offs: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.requests}, waits={self.waits}, "
+            f"wait={self.wait_seconds:.1f}s, back_offs={self.back_offs}"
+        )
+
+
+class RateLimiter(object):
+    """Token buckets for requests and tokens per minute, stored in
+    `state_path` and shared by the processes that use the same file. A limit
+    of 0 disables that bucket."""
+
+    def __init__(
+        self,
+        state_path: str | Path,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+    ) -> None:
+        self.state_path = Path(state_path)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.stats = RateLimiterStats()
+        self._stats_lock = threading.Lock()
+
+    @contextmanager
+    def _state(self) -> Iterator[dict[str, float]]:
+        # each call opens its own file, so the lock also works between
+        # threads of the same process
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            # buckets start full
+            state.setdefault("requests", self.requests_per_minute)
+            state.setdefault("tokens", self.tokens_per_minute)
+            state.setdefault("blocked_until", 0.0)
+            elapsed = max(0.0, now - state.get("updated", now))
+            state["requests"] = min(
+                self.requests_per_minute,
+                state["requests"] + elapsed * self.requests_per_minute / 60,
+            )
+            state["tokens"] = min(
+                self.tokens_per_minute,
+                state["tokens"] + elapsed * self.tokens_per_minute / 60,
+            )
+            state["updated"] = now
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def _wait_time(self, state: dict[str, float], tokens: float) -> float:
+        wait = state["blocked_until"] - state["updated"]
+        if self.requests_per_minute and state["requests"] < 1:
+            wait = max(
+                wait, (1 - state["requests"]) * 60 / self.requests_per_minute
+            )
+        if self.tokens_per_minute and state["tokens"] < tokens:
+            wait = max(
+                wait,
+                (tokens - state["tokens"]) * 60 / self.tokens_per_minute,
+            )
+        return wait
+
+    def _blocked_for(self) -> float:
+        """Seconds left of the shared back-off, read without the lock"""
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.loads(f.read() or "{}")
+        except (OSError, ValueError):
+            # missing, or being rewritten
+            return 0.0
+        return state.get("blocked_until", 0.0) - time.time()
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until a request of about `tokens` tokens may be sent"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            # no buckets to update, only the back-offs to respect
+            wait = self._blocked_for()
+            if wait > 0:
+                wait += random.uniform(0, MAX_JITTER)
+                with self._stats_lock:
+                    self.stats.waits += 1
+                    self.stats.wait_seconds += wait
+                time.sleep(wait)
+            with self._stats_lock:
+                self.stats.requests += 1
+            return
+        # a request larger than the bucket would never fit
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        while True:
+            with self._state() as state:
+                wait = self._wait_time(state, tokens)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        state["requests"] -= 1
+                    state["tokens"] -= tokens
+                    break
+            wait += random.uniform(0, MAX_JITTER)
+            with self._stats_lock:
+                self.stats.waits += 1
+                self.stats.wait_seconds += wait
+            time.sleep(wait)
+        with self._stats_lock:
+            self.stats.requests += 1
+
+    def back_off(self, seconds: float) -> None:
+        """Make every process wait `seconds` before its next request"""
+        with self._state() as state:
+            state["blocked_until"] = max(
+                state["blocked_until"], state["updated"] + seconds
+            )
+        with self._stats_lock:
+            self.stats.back_offs += 1
+
+
+_active_limiter: RateLimiter | None = None
+
+
+def set_rate_limiter(limiter: RateLimiter | None) -> None:
+    """Install the limiter used by the provider calls, or remove it"""
+    global _active_limiter
+    _active_limiter = limiter
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    return _active_limiter
+
+
+def acquire(tokens: int = 0) -> None:
+    """Wait for the installed limiter, if any"""
+    if _active_limiter is not None:
+        _active_limiter.acquire(tokens)
+
+
+def back_off(seconds: float) -> None:
+    """Share a server's back-off with the other processes, if a limiter is
+    installed"""
+    if _active_limiter is not None:
+        _active_limiter.back_off(seconds)
+
+
+def get_session(endpoint: str, pool_size: int = 16) -> requests.Session:
+    """A `requests` session with a connection pool, one per endpoint and
+    process"""
+
+    def create() -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    return get_resource(("session", endpoint), create)
@@ -2,7 +2,7 @@
 
 import random
 import time
-from typing import Any
+from typing import Any, Iterator
 
 from google.api_core.exceptions import InvalidArgument
 from vertexai.preview.generative_models import (
@@ -12,7 +12,15 @@ from vertexai.preview.generative_models import (
     Image,
 )
 
-model = GenerativeModel("gemini-pro-vision")
+from llms.resources import get_resource
+
+
+def get_model() -> GenerativeModel:
+    """The Gemini model of the process, created on first use"""
+    return get_resource(
+        ("gemini_model", "gemini-pro-vision"),
+        lambda: GenerativeModel("gemini-pro-vision"),
+    )
 
 
 def retry_with_exponential_backoff(  # type: ignore
@@ -60,6 +68,15 @@ def retry_with_exponential_backoff(  # type: ignore
     return wrapper
 
 
+SAFETY_CONFIG = {
+    HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+}
+
+
 @retry_with_exponential_backoff
 def generate_from_gemini_completion(
     prompt: list[str | Image],
@@ -69,14 +86,7 @@ def generate_from_gemini_completion(
     top_p: float,
 ) -> str:
     del engine
-    safety_config = {
-        HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    }
-    response = model.generate_content(
+    response = get_model().generate_content(
         prompt,
         generation_config=dict(
             candidate_count=1,
@@ -84,12 +94,45 @@ def generate_from_gemini_completion(
             top_p=top_p,
             temperature=temperature,
         ),
-        safety_settings=safety_config,
+        safety_settings=SAFETY_CONFIG,
     )
     answer = response.text
     return answer
 
 
+@retry_with_exponential_backoff
+def _generate_content_stream(
+    prompt: list[str | Image],
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+) -> Any:
+    return get_model().generate_content(
+        prompt,
+        generation_config=dict(
+            candidate_count=1,
+            max_output_tokens=max_tokens,
+            top_p=top_p,
+            temperature=temperature,
+        ),
+        safety_settings=SAFETY_CONFIG,
+        stream=True,
+    )
+
+
+def stream_from_gemini_completion(
+    prompt: list[str | Image],
+    engine: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+) -> Iterator[str]:
+    """Yield the text of the response as it is generated"""
+    del engine
+    for chunk in _generate_content_stream(prompt, temperature, max_tokens, top_p):
+        yield chunk.text
+
+
 @retry_with_exponential_backoff
 # debug only
 def fake_generate_from_gemini_chat_completion(
@@ -1,4 +1,64 @@
-from text_generation import Client  # type: ignore
+import json
+import random
+import time
+from typing import Any, Iterator
+
+import requests
+
+from llms.providers import gateway
+from llms.resilience import request_timeout
+
+MAX_RETRIES = 3
+TIMEOUT = 60
+
+
+def _post(
+    prompt: str,
+    model_endpoint: str,
+    stream: bool,
+    temperature: float,
+    top_p: float,
+    max_new_tokens: int,
+    stop_sequences: list[str] | None,
+) -> requests.Response:
+    """Send a request to a text-generation-inference endpoint.
+
+    Same request as `text_generation.Client`, but over the pooled session
+    of the endpoint, and a 429 or 503 is retried after the server's
+    `Retry-After`, shared with the other workers.
+    """
+    from text_generation.errors import parse_error  # type: ignore
+    from text_generation.types import Parameters, Request  # type: ignore
+
+    parameters = Parameters(
+        details=True,
+        max_new_tokens=max_new_tokens,
+        stop=stop_sequences if stop_sequences is not None else [],
+        temperature=temperature,
+        top_p=top_p,
+    )
+    request = Request(inputs=prompt, stream=stream, parameters=parameters)
+    session = gateway.get_session(model_endpoint)
+    for attempt in range(MAX_RETRIES + 1):
+        gateway.acquire(gateway.estimate_tokens(prompt, max_new_tokens))
+        resp = session.post(
+            model_endpoint,
+            json=request.dict(),
+            timeout=request_timeout() or TIMEOUT,
+            stream=stream,
+        )
+        if resp.status_code in [429, 503] and attempt < MAX_RETRIES:
+            retry_after = gateway.retry_after_seconds(resp.headers)
+            if retry_after is None:
+                retry_after = 2**attempt
+            gateway.back_off(retry_after)
+            resp.close()
+            time.sleep(retry_after + random.uniform(0, gateway.MAX_JITTER))
+            continue
+        if resp.status_code != 200:
+            raise parse_error(resp.status_code, resp.json())
+        return resp
+    raise AssertionError("unreachable")
 
 
 def generate_from_huggingface_completion(
@@ -9,13 +69,50 @@ def generate_from_huggingface_completion(
     max_new_tokens: int,
     stop_sequences: list[str] | None = None,
 ) -> str:
-    client = Client(model_endpoint, timeout=60)
-    generation: str = client.generate(
-        prompt=prompt,
+    resp = _post(
+        prompt,
+        model_endpoint,
+        stream=False,
         temperature=temperature,
         top_p=top_p,
         max_new_tokens=max_new_tokens,
         stop_sequences=stop_sequences,
-    ).generated_text
+    )
+    generation: str = resp.json()[0]["generated_text"]
 
     return generation
+
+
+def stream_from_huggingface_completion(
+    prompt: str,
+    model_endpoint: str,
+    temperature: float,
+    top_p: float,
+    max_new_tokens: int,
+    stop_sequences: list[str] | None = None,
+) -> Iterator[str]:
+    """Yield the generated text token by token"""
+    resp = _post(
+        prompt,
+        model_endpoint,
+        stream=True,
+        temperature=temperature,
+        top_p=top_p,
+        max_new_tokens=max_new_tokens,
+        stop_sequences=stop_sequences,
+    )
+    try:
+        # server-sent events
+        for line in resp.iter_lines():
+            payload = line.decode("utf-8")
+            if not payload.startswith("data:"):
+                continue
+            event: dict[str, Any] = json.loads(payload[len("data:") :])
+            if "error" in event:
+                from text_generation.errors import parse_error  # type: ignore
+
+                raise parse_error(resp.status_code, event)
+            if not event["token"]["special"]:
+                yield event["token"]["text"]
+    finally:
+        resp.close()
@@ -6,16 +6,43 @@ import logging
 import os
 import random
 import time
-from typing import Any
+from typing import Any, Iterator
 
 import aiolimiter
 import openai
 from openai import AsyncOpenAI, OpenAI
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"], base_url=os.environ.get("OPENAI_BASE_URL"))
-aclient = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], base_url=os.environ.get("OPENAI_BASE_URL"))
 from tqdm.asyncio import tqdm_asyncio
 
+from llms.providers import gateway
+from llms.resilience import request_timeout
+from llms.resources import get_resource
+
+
+def get_client() -> OpenAI:
+    """The OpenAI client of the process, created on first use"""
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    # retries are left to `retry_with_exponential_backoff`, which shares the
+    # server's back-off with the other workers
+    return get_resource(
+        ("openai_client", base_url),
+        lambda: OpenAI(
+            api_key=os.environ["OPENAI_API_KEY"],
+            base_url=base_url,
+            max_retries=0,
+        ),
+    )
+
+
+def get_async_client() -> AsyncOpenAI:
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    return get_resource(
+        ("openai_async_client", base_url),
+        lambda: AsyncOpenAI(
+            api_key=os.environ["OPENAI_API_KEY"], base_url=base_url
+        ),
+    )
+
 
 def _get_openai_seed() -> int | None:
     """Return a stable seed for OpenAI requests.
@@ -43,10 +70,12 @@ def retry_with_exponential_backoff(  # type: ignore
     exponential_base: float = 2,
     jitter: bool = True,
     max_retries: int = 3,
+    # a bad request fails the same way every time, it is not retried
     errors: tuple[Any] = (
         openai.RateLimitError,
-        openai.BadRequestError,
         openai.InternalServerError,
+        # including the timeouts
+        openai.APIConnectionError,
     ),
 ):
     """Retry a function with exponential backoff."""
@@ -71,11 +100,23 @@ def retry_with_exponential_backoff(  # type: ignore
                 if num_retries > max_retries:
                     raise Exception(
                         f"Maximum number of retries ({max_retries}) exceeded."
-                    )
+                    ) from e
 
                 # Increment the delay
                 delay *= exponential_base * (1 + jitter * random.random())
 
+                # Wait as long as the server asks, if it does
+                response = getattr(e, "response", None)
+                retry_after = gateway.retry_after_seconds(
+                    getattr(response, "headers", None)
+                )
+                if retry_after is not None:
+                    gateway.back_off(retry_after)
+                    time.sleep(
+                        retry_after + jitter * random.uniform(0, gateway.MAX_JITTER)
+                    )
+                    continue
+
                 # Sleep for the delay
                 time.sleep(delay)
 
@@ -97,7 +138,7 @@ async def _throttled_openai_completion_acreate(
     async with limiter:
         for _ in range(3):
             try:
-                return await aclient.completions.create(
+                return await get_async_client().completions.create(
                     engine=engine,
                     prompt=prompt,
                     temperature=temperature,
@@ -173,13 +214,17 @@ def generate_from_openai_completion(
             "OPENAI_API_KEY environment variable must be set when using OpenAI API."
         )
 
-    response = client.completions.create(
+    gateway.acquire(gateway.estimate_tokens(prompt, max_tokens))
+    # None would disable the client's own timeout
+    timeout = request_timeout()
+    response = get_client().completions.create(
         prompt=prompt,
         engine=engine,
         temperature=temperature,
         max_tokens=max_tokens,
         top_p=top_p,
         stop=[stop_token],
+        **({"timeout": timeout} if timeout is not None else {}),
     )
     answer: str = response["choices"][0]["text"]
     return answer
@@ -207,12 +252,12 @@ async def _throttled_openai_chat_completion_acreate(
                 if seed is not None:
                     kwargs["seed"] = seed
                 try:
-                    return await aclient.chat.completions.create(**kwargs)
+                    return await get_async_client().chat.completions.create(**kwargs)
                 except openai.BadRequestError as e:
                     # Backwards compatibility: some servers/models may not support `seed`.
                     if seed is not None and "seed" in str(e).lower():
                         kwargs.pop("seed", None)
-                        return await aclient.chat.completions.create(**kwargs)
+                        return await get_async_client().chat.completions.create(**kwargs)
                     raise
             except openai.RateLimitError:
                 logging.warning(
@@ -268,19 +313,26 @@ async def agenerate_from_openai_chat_completion(
         for message in messages_list
     ]
     responses = await tqdm_asyncio.gather(*async_responses)
-    return [x["choices"][0]["message"]["content"] for x in responses]
+    # ChatCompletion objects, or the placeholder dict of a failed request
+    return [
+        (
+            x["choices"][0]["message"]["content"]
+            if isinstance(x, dict)
+            else x.choices[0].message.content
+        )
+        or ""
+        for x in responses
+    ]
 
 
-@retry_with_exponential_backoff
-def generate_from_openai_chat_completion(
+def _chat_completion_kwargs(
     messages: list[dict[str, Any]],
     model: str,
     temperature: float,
     max_tokens: int,
     top_p: float,
-    context_length: int,
-    stop_token: str | None = None,
-) -> str:
+    sample: int = 0,
+) -> dict[str, Any]:
     if "OPENAI_API_KEY" not in os.environ:
         raise ValueError(
             "OPENAI_API_KEY environment variable must be set when using OpenAI API."
@@ -304,30 +356,87 @@ def generate_from_openai_chat_completion(
             m = dict(m)
             m["role"] = "user"
         fixed_messages.append(m)
-    messages = fixed_messages
     kwargs: dict[str, Any] = {
         "model": model,
-        "messages": messages,
+        "messages": fixed_messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
         "top_p": top_p,
     }
     seed = _get_openai_seed()
     if seed is not None:
-        kwargs["seed"] = seed
+        # concurrent samples of the same prompt must not share a seed
+        kwargs["seed"] = seed + sample
+    timeout = request_timeout()
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return kwargs
+
+
+def _create_chat_completion(kwargs: dict[str, Any]) -> Any:
+    gateway.acquire(
+        gateway.estimate_tokens(kwargs["messages"], kwargs["max_tokens"])
+    )
     try:
-        response = client.chat.completions.create(**kwargs)
+        return get_client().chat.completions.create(**kwargs)
     except openai.BadRequestError as e:
         # Backwards compatibility: some servers/models may not support `seed`.
-        if seed is not None and "seed" in str(e).lower():
-            kwargs.pop("seed", None)
-            response = client.chat.completions.create(**kwargs)
-        else:
-            raise
+        if "seed" in kwargs and "seed" in str(e).lower():
+            kwargs = {k: v for k, v in kwargs.items() if k != "seed"}
+            return get_client().chat.completions.create(**kwargs)
+        raise
+
+
+@retry_with_exponential_backoff
+def generate_from_openai_chat_completion(
+    messages: list[dict[str, Any]],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    stop_token: str | None = None,
+    sample: int = 0,
+) -> str:
+    kwargs = _chat_completion_kwargs(
+        messages, model, temperature, max_tokens, top_p, sample
+    )
+    response = _create_chat_completion(kwargs)
     answer: str = response.choices[0].message.content
     return answer
 
 
+# the request is retried, the stream itself is not
+_create_chat_completion_stream = retry_with_exponential_backoff(
+    _create_chat_completion
+)
+
+
+def stream_from_openai_chat_completion(
+    messages: list[dict[str, Any]],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    context_length: int,
+    stop_token: str | None = None,
+    sample: int = 0,
+) -> Iterator[str]:
+    """Yield the text of the response as it is generated. Closing the
+    generator closes the connection, which stops the generation."""
+    kwargs = _chat_completion_kwargs(
+        messages, model, temperature, max_tokens, top_p, sample
+    )
+    kwargs["stream"] = True
+    stream = _create_chat_completion_stream(kwargs)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
 @retry_with_exponential_backoff
 # debug only
 def fake_generate_from_openai_chat_completion(
@@ -0,0 +1,311 @@
+"""Deadlines, hedged requests and circuit breaking around the provider
+calls of `call_llm`.
+
+- The deadline is the timeout of every request to the provider (see
+  `request_timeout`), so a hung request fails in the thread that sent it
+  instead of being left behind.
+- Once a model has enough latency samples, a call that takes longer than
+  the given percentile of its latencies is hedged: a duplicate request is
+  sent and the first response wins.
+- Retries stay with the providers (e.g. `retry_with_exponential_backoff`),
+  which share the server's back-off with the other workers. The errors they
+  give up on are classified: timeouts, connection errors, 429 and 5xx count
+  as failures of the provider, anything else (e.g. a bad request) does not.
+- After `failure_threshold` consecutive provider failures, the circuit
+  breaker of the provider opens and calls wait for `cooldown` seconds
+  before a single probe call is let through.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+
+import requests
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# latencies needed before the percentile is trusted for hedging
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 1000
+
+
+def is_timeout(e: BaseException) -> bool:
+    if e.__cause__ is not None and is_timeout(e.__cause__):
+        return True
+    if isinstance(e, (TimeoutError, requests.exceptions.Timeout)):
+        return True
+    try:
+        import openai
+
+        return isinstance(e, openai.APITimeoutError)
+    except ImportError:
+        return False
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Whether the same request may succeed if it is sent again"""
+    if e.__cause__ is not None:
+        # e.g. the provider's own retries gave up on a 429
+        return is_retryable(e.__cause__)
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(
+        e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    ):
+        return True
+    try:
+        import openai
+
+        if isinstance(e, openai.APIConnectionError):
+            return True
+    except ImportError:
+        pass
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in RETRYABLE_STATUS
+
+
+class LatencyTracker(object):
+    """Latencies of the successful calls of each model, over a sliding
+    window"""
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self.window = window
+        self._latencies: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(
+                model, deque(maxlen=self.window)
+            ).append(seconds)
+
+    def percentile(self, model: str, p: float) -> float | None:
+        with self._lock:
+            values = sorted(self._latencies.get(model, []))
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+        return values[index]
+
+    def count(self, model: str) -> int:
+        with self._lock:
+            return len(self._latencies.get(model, []))
+
+    def export(self) -> dict[str, dict[str, float]]:
+        """p50, p95 and p99 latency of every model, in seconds"""
+        with self._lock:
+            models = list(self._latencies)
+        return {
+            model: {
+                "n": self.count(model),
+                "p50": self.percentile(model, 50) or 0.0,
+                "p95": self.percentile(model, 95) or 0.0,
+                "p99": self.percentile(model, 99) or 0.0,
+            }
+            for model in models
+        }
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{model}: n={s['n']}, p50={s['p50']:.2f}s, "
+            f"p95={s['p95']:.2f}s, p99={s['p99']:.2f}s"
+            for model, s in self.export().items()
+        )
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 60) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.paused_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Wait while the circuit is open. When the cooldown is over, the
+        first caller goes through as the probe and the others keep
+        waiting for its result."""
+        while True:
+            with self._lock:
+                now = time.time()
+                if self.state == "closed":
+                    return
+                if self.state == "open" and now >= self.opened_at + self.cooldown:
+                    self.state = "half_open"
+                    return
+                if self.state == "open":
+                    delay = self.opened_at + self.cooldown - now
+                else:
+                    # a probe is in flight
+                    delay = min(1.0, self.cooldown)
+            time.sleep(delay)
+            with self._lock:
+                self.paused_seconds += delay
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed"
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = time.time()
+                self.trips += 1
+
+
+@dataclass
+class ResilienceStats:
+    calls: int = 0
+    hedged: int = 0
+    # hedged calls answered by the duplicate
+    hedge_wins: int = 0
+    # calls that failed on a request timeout
+    deadlines: int = 0
+    # calls that failed on a provider error, after the provider's retries
+    failures: int = 0
+    fatal: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"calls={self.calls}, hedged={self.hedged}, "
+            f"hedge_wins={self.hedge_wins}, deadlines={self.deadlines}, "
+            f"failures={self.failures}, fatal={self.fatal}"
+        )
+
+
+class ResilientCaller(object):
+    def __init__(
+        self,
+        deadline: float = 180,
+        hedge_percentile: float = 95,
+        failure_threshold: int = 5,
+        cooldown: float = 60,
+        max_workers: int = 16,
+    ) -> None:
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latencies = LatencyTracker()
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.stats = ResilienceStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(
+                    self.failure_threshold, self.cooldown
+                )
+            return self.breakers[provider]
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+
+    def call(
+        self,
+        provider: str,
+        model: str,
+        fn: Callable[[], str],
+        streaming: bool = False,
+    ) -> str:
+        """Call `fn`, hedged, through the circuit breaker of `provider`.
+
+        A streaming `fn` feeds its chunks to a callback, so it cannot be
+        duplicated: it is called once, in this thread.
+        """
+        breaker = self.breaker(provider)
+        self._count("calls")
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            response = fn() if streaming else self._attempt(model, fn)
+        except Exception as e:
+            if not is_retryable(e):
+                # the provider answered, the request itself is wrong
+                breaker.record_success()
+                self._count("fatal")
+                raise
+            breaker.record_failure()
+            self._count("deadlines" if is_timeout(e) else "failures")
+            raise
+        breaker.record_success()
+        self.latencies.record(model, time.perf_counter() - start)
+        return response
+
+    def summary(self) -> str:
+        trips = sum(breaker.trips for breaker in self.breakers.values())
+        paused = sum(breaker.paused_seconds for breaker in self.breakers.values())
+        return (
+            f"{self.stats.summary()}, breaker_trips={trips}, "
+            f"paused={paused:.1f}s"
+        )
+
+    def _hedge_delay(self, model: str) -> float | None:
+        if (
+            not self.hedge_percentile
+            or self.latencies.count(model) < MIN_HEDGE_SAMPLES
+        ):
+            return None
+        return self.latencies.percentile(model, self.hedge_percentile)
+
+    def _attempt(self, model: str, fn: Callable[[], str]) -> str:
+        """The first response of `fn`, and of a duplicate sent once the
+        call is slower than usual. Every request ends by itself, at the
+        latest on its timeout."""
+        hedge_delay = self._hedge_delay(model)
+        first = self._executor.submit(fn)
+        pending: set[Future[str]] = {first}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=hedge_delay, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            if not done and hedge_delay is not None:
+                # slower than usual, send a duplicate
+                self._count("hedged")
+                pending.add(self._executor.submit(fn))
+                hedge_delay = None
+        assert error is not None
+        raise error
+
+
+_active_caller: ResilientCaller | None = None
+
+
+def set_resilient_caller(caller: ResilientCaller | None) -> None:
+    """Install the caller used by `call_llm`, or remove it with None"""
+    global _active_caller
+    _active_caller = caller
+
+
+def get_resilient_caller() -> ResilientCaller | None:
+    return _active_caller
+
+
+def request_timeout() -> float | None:
+    """Seconds before a request to a provider times out, the deadline of the
+    installed caller"""
+    if _active_caller is None or not _active_caller.deadline:
+        return None
+    return _active_caller.deadline
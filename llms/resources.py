@@ -0,0 +1,73 @@
+"""Process-wide registry of expensive resources: tokenizers, captioning
+models and provider clients.
+
+Each resource is built on first use and shared by every agent, prompt
+constructor and evaluator of the process afterwards. Heavy libraries
+(transformers, tiktoken, text_generation) are imported by the factories, so
+a run only pays for the ones it uses.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class ResourceStats:
+    hits: int = 0
+    # seconds spent building each resource
+    load_seconds: dict[str, float] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        loads = ", ".join(
+            f"{name}={seconds:.2f}s"
+            for name, seconds in self.load_seconds.items()
+        )
+        return f"loads={len(self.load_seconds)} ({loads}), hits={self.hits}"
+
+
+class ResourceRegistry(object):
+    def __init__(self) -> None:
+        self.stats = ResourceStats()
+        self._resources: dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        # one lock per key, so two threads never build the same resource
+        # and building one does not block the others
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """The resource of `key`, built with `factory` the first time"""
+        if key in self._resources:
+            self.stats.hits += 1
+            return self._resources[key]
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self._resources:
+                self.stats.hits += 1
+                return self._resources[key]
+            start = time.perf_counter()
+            resource = factory()
+            self.stats.load_seconds[_name(key)] = time.perf_counter() - start
+            self._resources[key] = resource
+        return resource
+
+    def clear(self) -> None:
+        with self._lock:
+            self._resources.clear()
+            self._key_locks.clear()
+
+
+def _name(key: Hashable) -> str:
+    if isinstance(key, tuple):
+        return "/".join(str(k) for k in key)
+    return str(key)
+
+
+registry = ResourceRegistry()
+
+
+def get_resource(key: Hashable, factory: Callable[[], T]) -> T:
+    return registry.get(key, factory)
@@ -0,0 +1,223 @@
+"""Content-addressed cache of LLM responses around `call_llm`.
+
+The key is a hash of the provider, model, generation config and prompt, with
+images hashed by content. Identical prompts sent again in the same run (e.g.
+after a parsing failure) are numbered, so a replayed run sees the same
+sequence of responses as the recorded one.
+
+Modes:
+    off: always call the provider.
+    read_through: serve hits from the cache, call and store on a miss.
+    record: always call the provider and store the response.
+    replay: serve from the cache only, raise `ResponseCacheMiss` on a miss.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from llms.lm_config import LMConfig
+
+CACHE_MODES = ["off", "read_through", "record", "replay"]
+
+# generation config entries that only shape the prompt, which is hashed
+# anyway, or the retry loop around the call
+IGNORED_GEN_CONFIG_KEYS = [
+    "max_obs_length",
+    "obs_truncation",
+    "obs_compression",
+    "max_retry",
+    "speculative_samples",
+]
+
+
+class ResponseCacheMiss(Exception):
+    """Raised in replay mode when a prompt was not recorded"""
+
+
+def _canonical(value: Any) -> Any:
+    """A json-serializable version of a prompt, with images replaced by the
+    hash of their content"""
+    if isinstance(value, str):
+        if value.startswith("data:image/"):
+            return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+        return value
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, "tobytes"):  # PIL images
+        content = value.tobytes()
+        meta = f"{getattr(value, 'mode', '')}{getattr(value, 'size', '')}"
+        return "sha256:" + hashlib.sha256(meta.encode() + content).hexdigest()
+    data = getattr(value, "data", None)  # vertexai images
+    if isinstance(data, bytes):
+        return "sha256:" + hashlib.sha256(data).hexdigest()
+    return repr(value)
+
+
+def cache_key(lm_config: LMConfig, prompt: Any, seed: int | None = None) -> str:
+    gen_config = {
+        k: v
+        for k, v in lm_config.gen_config.items()
+        if k not in IGNORED_GEN_CONFIG_KEYS
+    }
+    payload = {
+        "provider": lm_config.provider,
+        "model": lm_config.model,
+        "mode": lm_config.mode,
+        "gen_config": _canonical(gen_config),
+        "seed": seed,
+        "prompt": _canonical(prompt),
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stored: int = 0
+    evicted: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"hits={self.hits}, misses={self.misses}, "
+            f"stored={self.stored}, evicted={self.evicted}"
+        )
+
+
+class ResponseCache:
+    """Responses stored as one json file per key under `cache_dir`.
+
+    Writes are atomic, so several workers can share the directory. When the
+    directory grows past `max_bytes`, the least recently used entries are
+    removed until it is back under 90% of the limit.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | Path,
+        mode: str = "read_through",
+        max_bytes: int = 1_000_000_000,
+    ) -> None:
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}, choose from {CACHE_MODES}")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.stats = ResponseCacheStats()
+        self._occurrences: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._size = sum(p.stat().st_size for p in self.cache_dir.glob("*/*.json"))
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            # mark as recently used for the eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry["response"]
+
+    def put(self, key: str, response: str, model: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(
+            {"response": response, "model": model, "created": time.time()}
+        ).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.stats.stored += 1
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for p in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = p.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            self._size -= size
+            self.stats.evicted += 1
+
+    def call(
+        self,
+        lm_config: LMConfig,
+        prompt: Any,
+        generate: Callable[[LMConfig, Any], str],
+        seed: int | None = None,
+    ) -> str:
+        """Return the response to `prompt`, calling `generate` as the mode
+        allows"""
+        if self.mode == "off":
+            return generate(lm_config, prompt)
+        base_key = cache_key(lm_config, prompt, seed)
+        # concurrent samples of the same prompt get distinct numbers
+        with self._lock:
+            occurrence = self._occurrences[base_key]
+            self._occurrences[base_key] += 1
+        key = f"{base_key}-{occurrence}"
+
+        if self.mode in ["read_through", "replay"]:
+            response = self.get(key)
+            if response is not None:
+                self.stats.hits += 1
+                return response
+            self.stats.misses += 1
+            if self.mode == "replay":
+                raise ResponseCacheMiss(
+                    f"No recorded response for {lm_config.provider}/{lm_config.model} prompt {key}"
+                )
+        response = generate(lm_config, prompt)
+        # empty responses are what the providers return after API errors
+        if response:
+            self.put(key, response, lm_config.model)
+        return response
+
+
+_active_cache: ResponseCache | None = None
+
+
+def set_response_cache(cache: ResponseCache | None) -> None:
+    """Install the cache used by `call_llm`, or remove it with None"""
+    global _active_cache
+    _active_cache = cache
+
+
+def get_response_cache() -> ResponseCache | None:
+    return _active_cache
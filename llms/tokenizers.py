@@ -1,14 +1,20 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Any
 
-import tiktoken
-from transformers import LlamaTokenizer  # type: ignore
+from llms.resources import get_resource
 
 
 class Tokenizer(object):
     def __init__(self, provider: str, model_name: str) -> None:
+        # imported here so that a run only loads the library it uses
         if provider == "openai":
+            import tiktoken
+
             self.tokenizer = tiktoken.encoding_for_model(model_name)
         elif provider == "huggingface":
+            from transformers import LlamaTokenizer  # type: ignore
+
             self.tokenizer = LlamaTokenizer.from_pretrained(model_name)
             # turn off adding special tokens automatically
             self.tokenizer.add_special_tokens = False  # type: ignore[attr-defined]
@@ -27,3 +33,108 @@ class Tokenizer(object):
 
     def __call__(self, text: str) -> list[int]:
         return self.tokenizer.encode(text)
+
+
+def get_tokenizer(provider: str, model_name: str) -> Tokenizer:
+    """The tokenizer of `model_name`, shared by the whole process"""
+    return get_resource(
+        ("tokenizer", provider, model_name),
+        lambda: Tokenizer(provider, model_name),
+    )
+
+
+@dataclass
+class TruncationStats:
+    calls: int = 0
+    # under budget by character count, the tokenizer was not called
+    fast_path: int = 0
+    memo_hits: int = 0
+    truncated: int = 0
+    dropped_tokens: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"calls={self.calls}, fast_path={self.fast_path}, "
+            f"memo_hits={self.memo_hits}, truncated={self.truncated}, "
+            f"dropped_tokens={self.dropped_tokens}"
+        )
+
+
+class ObservationTruncator(object):
+    """Truncate observations to a token budget.
+
+    `mode` is "tokens" to cut at the token budget, like
+    `decode(encode(text)[:max_length])`, or "lines" to also drop the last,
+    partial line so accessibility tree nodes are never split. With the
+    "google" provider the budget is in characters, as Gemini is.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        provider: str,
+        mode: str = "tokens",
+        memo_size: int = 16,
+    ) -> None:
+        if mode not in ["tokens", "lines"]:
+            raise ValueError(f"Unknown truncation mode {mode}")
+        self.tokenizer = tokenizer
+        self.provider = provider
+        self.mode = mode
+        self.memo_size = memo_size
+        self.stats = TruncationStats()
+        # tokens dropped from the last observation
+        self.last_dropped_tokens = 0
+        self._memo: OrderedDict[tuple[str, int], tuple[str, int]] = OrderedDict()
+
+    def __call__(self, text: str, max_length: int) -> str:
+        self.stats.calls += 1
+        if not max_length:
+            self.last_dropped_tokens = 0
+            return text
+        if self.provider == "google":
+            if self.stats.calls == 1:
+                print("NOTE: This is a Gemini model, so we use characters instead of tokens for max_obs_length.")
+            self.last_dropped_tokens = 0
+            return text[:max_length]
+        # A token covers at least one byte of the utf-8 text, plus one token
+        # for the prefix space sentencepiece adds, so shorter texts are
+        # under budget without tokenizing them.
+        if len(text.encode("utf-8")) < max_length:
+            self.stats.fast_path += 1
+            self.last_dropped_tokens = 0
+            return text
+
+        key = (text, max_length)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            self.stats.memo_hits += 1
+            truncated, dropped = self._memo[key]
+        else:
+            truncated, dropped = self._truncate(text, max_length)
+            self._memo[key] = (truncated, dropped)
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+            if dropped:
+                self.stats.truncated += 1
+                self.stats.dropped_tokens += dropped
+        self.last_dropped_tokens = dropped
+        return truncated
+
+    def count_tokens(self, text: str) -> int:
+        """Length of `text` in the unit of the budget"""
+        if self.provider == "google":
+            return len(text)
+        return len(self.tokenizer.encode(text))
+
+    def _truncate(self, text: str, max_length: int) -> tuple[str, int]:
+        tokens = self.tokenizer.encode(text)
+        if len(tokens) <= max_length:
+            # as the fast path, decoding may not give the text back
+            return text, 0
+        truncated = self.tokenizer.decode(tokens[:max_length])
+        dropped = len(tokens) - max_length
+        if self.mode == "lines" and "\n" in truncated:
+            truncated = truncated[: truncated.rindex("\n")]
+            dropped = len(tokens) - len(self.tokenizer.encode(truncated))
+        return truncated, dropped
@@ -1,28 +1,70 @@
 import argparse
-from typing import Any
+import sys
+from typing import Any, Callable, Iterator
 
-try:
-    from vertexai.preview.generative_models import Image
-    from llms import generate_from_gemini_completion
-except:
-    print('Google Cloud not set up, skipping import of vertexai.preview.generative_models.Image and llms.generate_from_gemini_completion')
-
-from llms import (
-    generate_from_huggingface_completion,
-    generate_from_openai_chat_completion,
-    generate_from_openai_completion,
-    lm_config,
-)
+from llms import lm_config
+from llms.resilience import get_resilient_caller
+from llms.response_cache import get_response_cache
 
 APIInput = str | list[Any] | dict[str, Any]
 
 
+def openai_errors() -> tuple[type[BaseException], ...]:
+    """`openai.OpenAIError` once the OpenAI SDK is loaded, for `except`
+    clauses that should not import it themselves"""
+    openai = sys.modules.get("openai")
+    return (openai.OpenAIError,) if openai is not None else ()
+
+
 def call_llm(
     lm_config: lm_config.LMConfig,
     prompt: APIInput,
+    sample: int = 0,
+) -> str:
+    """Generate a response, through the response cache and the resilient
+    caller when they are installed (`llms.response_cache.set_response_cache`,
+    `llms.resilience.set_resilient_caller`). Samples of the same prompt
+    with another `sample` number are generated with another seed."""
+
+    def generate(config: Any, prompt: APIInput) -> str:
+        caller = get_resilient_caller()
+        if caller is None:
+            return _call_provider(config, prompt, sample)
+        return caller.call(
+            config.provider,
+            config.model,
+            lambda: _call_provider(config, prompt, sample),
+        )
+
+    cache = get_response_cache()
+    if cache is None:
+        return generate(lm_config, prompt)
+    seed = _openai_seed(lm_config, sample)
+    return cache.call(lm_config, prompt, generate, seed=seed)
+
+
+def _openai_seed(lm_config: lm_config.LMConfig, sample: int = 0) -> int | None:
+    if lm_config.provider != "openai":
+        return None
+    from llms.providers.openai_utils import _get_openai_seed
+
+    seed = _get_openai_seed()
+    return seed + sample if seed is not None else None
+
+
+def _call_provider(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    sample: int = 0,
 ) -> str:
+    # the provider modules are imported on first use
     response: str
     if lm_config.provider == "openai":
+        from llms.providers.openai_utils import (
+            generate_from_openai_chat_completion,
+            generate_from_openai_completion,
+        )
+
         if lm_config.mode == "chat":
             assert isinstance(prompt, list)
             response = generate_from_openai_chat_completion(
@@ -33,6 +75,7 @@ def call_llm(
                 context_length=lm_config.gen_config["context_length"],
                 max_tokens=lm_config.gen_config["max_tokens"],
                 stop_token=None,
+                sample=sample,
             )
         elif lm_config.mode == "completion":
             assert isinstance(prompt, str)
@@ -49,6 +92,8 @@ def call_llm(
                 f"OpenAI models do not support mode {lm_config.mode}"
             )
     elif lm_config.provider == "huggingface":
+        from llms.providers.hf_utils import generate_from_huggingface_completion
+
         assert isinstance(prompt, str)
         response = generate_from_huggingface_completion(
             prompt=prompt,
@@ -59,6 +104,10 @@ def call_llm(
             max_new_tokens=lm_config.gen_config["max_new_tokens"],
         )
     elif lm_config.provider == "google":
+        from vertexai.preview.generative_models import Image
+
+        from llms.providers.gemini_utils import generate_from_gemini_completion
+
         assert isinstance(prompt, list)
         assert all(
             [isinstance(p, str) or isinstance(p, Image) for p in prompt]
@@ -76,3 +125,96 @@ def call_llm(
         )
 
     return response
+
+
+def call_llm_streaming(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    on_chunk: Callable[[str], bool],
+    sample: int = 0,
+) -> str:
+    """Like `call_llm`, but every piece of the response is passed to
+    `on_chunk` as it arrives and the generation is cancelled as soon as
+    `on_chunk` returns True. Returns the response up to that point."""
+
+    def generate(config: Any, prompt: APIInput) -> str:
+        caller = get_resilient_caller()
+        if caller is None:
+            return _stream_until(config, prompt, on_chunk, sample)
+        return caller.call(
+            config.provider,
+            config.model,
+            lambda: _stream_until(config, prompt, on_chunk, sample),
+            streaming=True,
+        )
+
+    cache = get_response_cache()
+    if cache is None:
+        return generate(lm_config, prompt)
+    seed = _openai_seed(lm_config, sample)
+    return cache.call(lm_config, prompt, generate, seed=seed)
+
+
+def _stream_until(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    on_chunk: Callable[[str], bool],
+    sample: int = 0,
+) -> str:
+    chunks: list[str] = []
+    stream = _stream_provider(lm_config, prompt, sample)
+    try:
+        for chunk in stream:
+            chunks.append(chunk)
+            if on_chunk(chunk):
+                break
+    finally:
+        stream.close()
+    return "".join(chunks)
+
+
+def _stream_provider(
+    lm_config: lm_config.LMConfig,
+    prompt: APIInput,
+    sample: int = 0,
+) -> Iterator[str]:
+    if lm_config.provider == "openai" and lm_config.mode == "chat":
+        from llms.providers.openai_utils import stream_from_openai_chat_completion
+
+        assert isinstance(prompt, list)
+        yield from stream_from_openai_chat_completion(
+            messages=prompt,
+            model=lm_config.model,
+            temperature=lm_config.gen_config["temperature"],
+            top_p=lm_config.gen_config["top_p"],
+            context_length=lm_config.gen_config["context_length"],
+            max_tokens=lm_config.gen_config["max_tokens"],
+            stop_token=None,
+            sample=sample,
+        )
+    elif lm_config.provider == "huggingface":
+        from llms.providers.hf_utils import stream_from_huggingface_completion
+
+        assert isinstance(prompt, str)
+        yield from stream_from_huggingface_completion(
+            prompt=prompt,
+            model_endpoint=lm_config.gen_config["model_endpoint"],
+            temperature=lm_config.gen_config["temperature"],
+            top_p=lm_config.gen_config["top_p"],
+            stop_sequences=lm_config.gen_config["stop_sequences"],
+            max_new_tokens=lm_config.gen_config["max_new_tokens"],
+        )
+    elif lm_config.provider == "google":
+        from llms.providers.gemini_utils import stream_from_gemini_completion
+
+        assert isinstance(prompt, list)
+        yield from stream_from_gemini_completion(
+            prompt=prompt,
+            engine=lm_config.model,
+            temperature=lm_config.gen_config["temperature"],
+            max_tokens=lm_config.gen_config["max_tokens"],
+            top_p=lm_config.gen_config["top_p"],
+        )
+    else:
+        # no streaming, e.g. the legacy completion endpoint
+        yield _call_provider(lm_config, prompt)
@@ -8,16 +8,13 @@ import json
 import logging
 import os
 import random
-import subprocess
-import sys
 import tempfile
+import threading
 import time
 from pathlib import Path
-from typing import List
+from typing import Any, List
 
-import openai
 import requests
-import torch
 from PIL import Image
 
 from agent import (
@@ -30,16 +27,44 @@ from browser_env import (
     ActionTypes,
     ScriptBrowserEnv,
     StateInfo,
+    TracePolicy,
     Trajectory,
     create_stop_action,
 )
 from browser_env.actions import is_equivalent
+from browser_env.auth_cache import AuthCache
 from browser_env.auto_login import get_site_comb_from_filepath
 from browser_env.helper_functions import (
     RenderHelper,
     get_action_description,
 )
-from evaluation_harness import evaluator_router, image_utils
+from browser_env.asset_cache import (
+    AssetCache,
+    ResourceRouter,
+    default_site_urls,
+    load_resource_rules,
+)
+from browser_env.site_reset import SiteResetter, default_reset_backends
+from browser_env.tracing import TRACE_MODES
+from evaluation_harness import (
+    EvalPlanCache,
+    LLMJudge,
+    evaluator_router,
+    image_utils,
+    set_llm_judge,
+)
+from evaluation_harness.eval_pool import (
+    EvalJob,
+    EvalPool,
+    EvalResult,
+    needs_live_page,
+)
+from evaluation_harness.rescore import save_artifacts, task_artifacts
+from llms.providers.gateway import RateLimiter, set_rate_limiter
+from llms.resilience import ResilientCaller, set_resilient_caller
+from llms.resources import registry as resource_registry
+from llms.response_cache import CACHE_MODES, ResponseCache, set_response_cache
+from llms.utils import openai_errors
 
 DATASET = os.environ["DATASET"]
 
@@ -100,8 +125,99 @@ def config() -> argparse.Namespace:
     )
     parser.add_argument("--viewport_width", type=int, default=1280)
     parser.add_argument("--viewport_height", type=int, default=2048)
-    parser.add_argument("--save_trace_enabled", action="store_true")
+    parser.add_argument(
+        "--save_trace_enabled",
+        action="store_true",
+        help="Shorthand for --trace_mode always",
+    )
+    parser.add_argument(
+        "--trace_mode",
+        choices=TRACE_MODES,
+        default="on_failure",
+        help="When to record Playwright traces, see browser_env/tracing.py",
+    )
+    parser.add_argument(
+        "--trace_sample_rate",
+        type=float,
+        default=0.1,
+        help="Fraction of tasks to trace with --trace_mode sampled",
+    )
+    parser.add_argument(
+        "--trace_chunk_steps",
+        type=int,
+        default=5,
+        help="Steps per trace chunk with --trace_mode chunked",
+    )
+    parser.add_argument(
+        "--trace_screenshots",
+        choices=["auto", "on", "off"],
+        default="auto",
+        help="Include screenshots in traces. 'auto' drops them when the rendered html already contains the screenshots",
+    )
+    parser.add_argument(
+        "--sequential_observation",
+        action="store_true",
+        help="Capture and render the text and image observations one after the other instead of overlapping them",
+    )
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
+    parser.add_argument(
+        "--asset_cache_dir",
+        type=str,
+        default="",
+        help="Serve static assets of the benchmark sites from this shared disk cache. Disabled when empty",
+    )
+    parser.add_argument(
+        "--resource_rules",
+        type=str,
+        default="",
+        help="Json file with per-site resource blocking rules, see browser_env/asset_cache.py",
+    )
+    parser.add_argument(
+        "--revalidate_assets",
+        action="store_true",
+        help="Revalidate cached assets with their ETag before serving them",
+    )
+    parser.add_argument(
+        "--reset_lock_dir",
+        type=str,
+        default="",
+        help="Directory of the per-site locks shared by parallel workers. Defaults to a folder in the system temp dir",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=0,
+        help="Evaluate finished tasks in this many background browser contexts while the next task runs. 0 evaluates on the agent's page before the next task",
+    )
+    parser.add_argument(
+        "--llm_judge_cache",
+        type=str,
+        default="",
+        help="Jsonl file of the fuzzy_match/ua_match verdicts and the judge's raw responses, reused across runs. Defaults to llm_judge.jsonl in the result dir",
+    )
+    parser.add_argument(
+        "--reset_with_scripts",
+        action="store_true",
+        help="Reset shopping and reddit with scripts/reset_*.sh, which recreate their docker containers",
+    )
+    parser.add_argument(
+        "--reset_probe_timeout",
+        type=float,
+        default=300,
+        help="Seconds to wait for a site to serve pages again after a reset",
+    )
+    parser.add_argument(
+        "--auth_folder",
+        type=str,
+        default="./.auth",
+        help="Storage states shared by all tasks and workers, renewed when their cookies stop working",
+    )
+    parser.add_argument(
+        "--auth_verify_interval",
+        type=float,
+        default=300,
+        help="Seconds during which a storage state that passed the login check is reused without checking again",
+    )
 
     parser.add_argument("--max_steps", type=int, default=30)
 
@@ -164,12 +280,99 @@ def config() -> argparse.Namespace:
         help="max retry times to perform generations when parsing fails",
         default=1,
     )
+    parser.add_argument(
+        "--speculative_samples",
+        type=int,
+        default=1,
+        help="After a parsing failure, sample this many responses concurrently, each with its own seed, and use the first that parses. Only retries are sampled this way, within --max_retry, so it needs --max_retry above 1",
+    )
+    parser.add_argument(
+        "--stream_actions",
+        action="store_true",
+        help="Stream the LLM responses and stop generating once they contain a complete action",
+    )
+    parser.add_argument(
+        "--llm_cache_mode",
+        choices=CACHE_MODES,
+        default="off",
+        help="LLM response cache: read_through serves identical prompts from the cache, record only writes to it, replay fails on prompts that were not recorded",
+    )
+    parser.add_argument(
+        "--llm_cache_dir",
+        type=str,
+        default="cache/llm_responses",
+        help="Directory of the LLM response cache, can be shared by workers",
+    )
+    parser.add_argument(
+        "--llm_cache_max_gb",
+        type=float,
+        default=1.0,
+        help="Size of the LLM response cache before the least recently used responses are evicted",
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=float,
+        default=0,
+        help="LLM requests per minute shared by the workers using the same --rate_limit_dir, 0 for no limit",
+    )
+    parser.add_argument(
+        "--tokens_per_minute",
+        type=float,
+        default=0,
+        help="LLM tokens per minute shared by the workers using the same --rate_limit_dir, 0 for no limit",
+    )
+    parser.add_argument(
+        "--rate_limit_dir",
+        type=str,
+        default="cache/rate_limit",
+        help="Directory of the rate limiter state shared by the workers, which also share the server back-offs",
+    )
+    parser.add_argument(
+        "--llm_resilience",
+        action="store_true",
+        help="Send LLM requests with a timeout (--llm_deadline), hedging and a circuit breaker per provider",
+    )
+    parser.add_argument(
+        "--llm_deadline",
+        type=float,
+        default=180,
+        help="With --llm_resilience, seconds before an LLM request times out and is retried by the provider, 0 for the client's default",
+    )
+    parser.add_argument(
+        "--llm_hedge_percentile",
+        type=float,
+        default=95,
+        help="Send a duplicate LLM request when a call is slower than this percentile of the model's latencies, 0 to disable",
+    )
+    parser.add_argument(
+        "--llm_breaker_failures",
+        type=int,
+        default=5,
+        help="Consecutive failed LLM calls before the provider is paused",
+    )
+    parser.add_argument(
+        "--llm_breaker_cooldown",
+        type=float,
+        default=60,
+        help="Seconds a provider is paused after --llm_breaker_failures failures",
+    )
     parser.add_argument(
         "--max_obs_length",
         type=int,
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=3840,
     )
+    parser.add_argument(
+        "--obs_truncation",
+        choices=["tokens", "lines"],
+        default="tokens",
+        help="Cut the observation exactly at max_obs_length tokens, or also drop the last partial line",
+    )
+    parser.add_argument(
+        "--obs_compression",
+        action="store_true",
+        help="When the observation is over max_obs_length, keep the nodes most relevant to the intent instead of its head",
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
@@ -272,6 +475,10 @@ def test(
 
     # Captioning model is only needed when the observation itself includes captions.
     # Loading BLIP2 is heavy and can fail on some local environments; avoid it unless required.
+    if "captioner" in args.observation_type:
+        # only the captioning models need torch
+        import torch
+
     if args.observation_type == "accessibility_tree_with_captioner":
         device = torch.device("cuda") if torch.cuda.is_available() else "cpu"
         dtype = torch.float16 if torch.cuda.is_available() else torch.float32
@@ -313,6 +520,35 @@ def test(
         else None,
     )  # NOTE: captioning_fn here is used for captioning input images.
 
+    trace_policy = TracePolicy(
+        mode="always" if args.save_trace_enabled else args.trace_mode,
+        sample_rate=args.trace_sample_rate,
+        chunk_steps=args.trace_chunk_steps,
+        chunk_dir=str(Path(args.result_dir) / "traces"),
+        screenshots=args.trace_screenshots == "on"
+        or (
+            args.trace_screenshots == "auto"
+            and not args.render_screenshot
+        ),
+    )
+
+    resource_router = None
+    if args.asset_cache_dir or args.resource_rules:
+        resource_router = ResourceRouter(
+            cache=AssetCache(args.asset_cache_dir)
+            if args.asset_cache_dir
+            else None,
+            rules=load_resource_rules(args.resource_rules),
+            site_urls=default_site_urls(),
+            revalidate=args.revalidate_assets,
+        )
+
+    site_resetter = SiteResetter(
+        *default_reset_backends(use_scripts=args.reset_with_scripts),
+        lock_dir=args.reset_lock_dir or None,
+        probe_timeout=args.reset_probe_timeout,
+    )
+
     env = ScriptBrowserEnv(
         headless=not args.render,
         slow_mo=args.slow_mo,
@@ -322,13 +558,106 @@ def test(
             "width": args.viewport_width,
             "height": args.viewport_height,
         },
-        save_trace_enabled=args.save_trace_enabled,
+        trace_policy=trace_policy,
+        resource_router=resource_router,
+        site_resetter=site_resetter,
         sleep_after_execution=args.sleep_after_execution,
+        concurrent_observation=not args.sequential_observation,
         # NOTE: captioning_fn here is used for LLM + captioning baselines.
         # This can be different from the captioning model used for evals.
         captioning_fn=caption_image_fn,
     )
 
+    rate_limiter = RateLimiter(
+        os.path.join(args.rate_limit_dir, f"{args.provider}.json"),
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+    set_rate_limiter(rate_limiter)
+    resilient_caller = None
+    if args.llm_resilience:
+        resilient_caller = ResilientCaller(
+            deadline=args.llm_deadline,
+            hedge_percentile=args.llm_hedge_percentile,
+            failure_threshold=args.llm_breaker_failures,
+            cooldown=args.llm_breaker_cooldown,
+        )
+        set_resilient_caller(resilient_caller)
+
+    response_cache = None
+    if args.llm_cache_mode != "off":
+        response_cache = ResponseCache(
+            args.llm_cache_dir,
+            mode=args.llm_cache_mode,
+            max_bytes=int(args.llm_cache_max_gb * 1e9),
+        )
+        set_response_cache(response_cache)
+
+    llm_judge = LLMJudge(
+        args.llm_judge_cache or Path(args.result_dir) / "llm_judge.jsonl"
+    )
+    set_llm_judge(llm_judge)
+
+    auth_cache = AuthCache(
+        args.auth_folder, verify_interval=args.auth_verify_interval
+    )
+    # configs rewritten to point at the cached storage states
+    config_dir = tempfile.TemporaryDirectory()
+
+    results_lock = threading.Lock()
+
+    def record_result(config_file: str, task_id: Any, score: float) -> None:
+        scores.append(score)
+        if score == 1:
+            logger.info(f"[Result] (PASS) {config_file}")
+        else:
+            logger.info(f"[Result] (FAIL) {config_file}")
+        with results_lock:
+            with open(Path(args.result_dir) / "results.jsonl", "a") as f:
+                f.write(
+                    json.dumps(
+                        {
+                            "task_id": task_id,
+                            "config_file": config_file,
+                            "score": score,
+                        }
+                    )
+                    + "\n"
+                )
+
+    def record_eval_result(result: EvalResult) -> None:
+        meta = result.job.meta
+        if result.error is not None:
+            logger.info(f"[Unhandled Error] evaluating {meta['config_file']}")
+            with results_lock:
+                with open(Path(args.result_dir) / "error.txt", "a") as f:
+                    f.write(f"[Config file]: {meta['config_file']}\n")
+                    f.write(result.error)
+            return
+        assert result.score is not None
+        record_result(meta["config_file"], meta["task_id"], result.score)
+        if result.artifacts is not None:
+            save_artifacts(args.result_dir, result.artifacts)
+        # the trace was kept in case the task failed
+        if result.score == 1 and trace_policy.mode == "on_failure":
+            env.trace_recorder.discard(meta["trace_path"])
+
+    eval_pool = None
+    if args.eval_workers > 0:
+        eval_pool = EvalPool(
+            workers=args.eval_workers,
+            captioning_fn=eval_caption_image_fn,
+            lock_dir=args.reset_lock_dir or None,
+            on_result=record_eval_result,
+        )
+
+    # parse the configs and compile their evaluation once, up front
+    eval_plans = EvalPlanCache()
+    for failed_config, e in eval_plans.compile_all(config_file_list).items():
+        logger.info(f"[Eval plan error] {failed_config}: {repr(e)}")
+
+    # seconds of every env.step, tracing included
+    step_times: list[float] = []
     for config_file in config_file_list:
         try:
             render_helper = RenderHelper(
@@ -336,50 +665,39 @@ def test(
             )
 
             # Load task.
-            with open(config_file) as f:
-                _c = json.load(f)
-                intent = _c["intent"]
-                task_id = _c["task_id"]
-                image_paths = _c.get("image", None)
-                images = []
-
-                # automatically login
-                if _c["storage_state"]:
-                    cookie_file_name = os.path.basename(_c["storage_state"])
-                    comb = get_site_comb_from_filepath(cookie_file_name)
-                    temp_dir = tempfile.mkdtemp()
-                    # subprocess to renew the cookie
-                    subprocess.run(
-                        [
-                            sys.executable,
-                            "browser_env/auto_login.py",
-                            "--auth_folder",
-                            temp_dir,
-                            "--site_list",
-                            *comb,
-                        ],
-                        check=True,
-                    )
-                    _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
-                    assert os.path.exists(_c["storage_state"])
+            eval_plan = eval_plans.get(config_file)
+            # the top-level keys may be rewritten below, the plan's are not
+            _c = dict(eval_plan.config)
+            intent = _c["intent"]
+            task_id = _c["task_id"]
+            image_paths = _c.get("image", None)
+            images = []
+
+            # automatically login, reusing the cookies while they work
+            if _c["storage_state"]:
+                cookie_file_name = os.path.basename(_c["storage_state"])
+                comb = get_site_comb_from_filepath(cookie_file_name)
+                storage_state = auth_cache.get(comb)
+                if storage_state != _c["storage_state"]:
+                    _c["storage_state"] = storage_state
                     # update the config file
-                    config_file = f"{temp_dir}/{os.path.basename(config_file)}"
+                    config_file = f"{config_dir.name}/{os.path.basename(config_file)}"
                     with open(config_file, "w") as f:
                         json.dump(_c, f)
 
-                # Load input images for the task, if any.
-                if image_paths is not None:
-                    if isinstance(image_paths, str):
-                        image_paths = [image_paths]
-                    for image_path in image_paths:
-                        # Load image either from the web or from a local path.
-                        if image_path.startswith("http"):
-                            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                            input_image = Image.open(requests.get(image_path, stream=True, headers = headers).raw)
-                        else:
-                            input_image = Image.open(image_path)
+            # Load input images for the task, if any.
+            if image_paths is not None:
+                if isinstance(image_paths, str):
+                    image_paths = [image_paths]
+                for image_path in image_paths:
+                    # Load image either from the web or from a local path.
+                    if image_path.startswith("http"):
+                        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+                        input_image = Image.open(requests.get(image_path, stream=True, headers = headers).raw)
+                    else:
+                        input_image = Image.open(image_path)
 
-                        images.append(input_image)
+                    images.append(input_image)
 
             logger.info(f"[Config file]: {config_file}")
             logger.info(f"[Intent]: {intent}")
@@ -437,28 +755,71 @@ def test(
                     trajectory.append(create_stop_action(""))
                     break
 
-            # NOTE: eval_caption_image_fn is used for running eval_vqa functions.
-            evaluator = evaluator_router(
-                config_file, captioning_fn=eval_caption_image_fn
-            )
-            score = evaluator(
-                trajectory=trajectory,
-                config_file=config_file,
-                page=env.page
-            )
-
-            scores.append(score)
+            obs_timings = [
+                t["info"]["observation_timings"]["total"]
+                for t in trajectory[::2]
+                if "observation_timings" in t["info"]
+            ]
+            if obs_timings:
+                logger.info(
+                    f"[Observation time] {sum(obs_timings) / len(obs_timings):.3f}s/step over {len(obs_timings)} steps"
+                )
+            task_step_times = [
+                t["info"]["step_seconds"]
+                for t in trajectory[::2]
+                if "step_seconds" in t["info"]
+            ]
+            if task_step_times:
+                step_times.extend(task_step_times)
+                logger.info(
+                    f"[Step time] {sum(task_step_times) / len(task_step_times):.3f}s/step over {len(task_step_times)} steps"
+                )
 
-            if score == 1:
-                logger.info(f"[Result] (PASS) {config_file}")
+            trace_path = Path(args.result_dir) / "traces" / f"{task_id}.zip"
+            if eval_pool is not None and not needs_live_page(eval_plan):
+                # written before the job can finish and discard it
+                env.save_trace(trace_path)
+                # evaluated in its own context, the env is free for the
+                # next task
+                eval_pool.submit(
+                    EvalJob(
+                        plan=eval_plan,
+                        trajectory=trajectory,
+                        final_url=env.page.url,
+                        storage_state=_c["storage_state"],
+                        sites=_c.get("sites", []),
+                        viewport_size={
+                            **env.viewport_size,
+                            **_c.get("viewport_size", {}),
+                        },
+                        meta={
+                            "config_file": config_file,
+                            "task_id": task_id,
+                            "trace_path": str(trace_path),
+                        },
+                    )
+                )
             else:
-                logger.info(f"[Result] (FAIL) {config_file}")
-
-            if args.save_trace_enabled:
-                env.save_trace(
-                    Path(args.result_dir) / "traces" / f"{task_id}.zip"
+                # the evaluators may navigate away from it
+                final_url = env.page.url
+                # NOTE: eval_caption_image_fn is used for running eval_vqa functions.
+                evaluator = evaluator_router(
+                    eval_plan, captioning_fn=eval_caption_image_fn
+                )
+                score = evaluator(
+                    trajectory=trajectory,
+                    config_file=eval_plan,
+                    page=env.page
                 )
-        except openai.OpenAIError as e:
+                record_result(config_file, task_id, score)
+                save_artifacts(
+                    args.result_dir,
+                    task_artifacts(
+                        eval_plan, trajectory, final_url, evaluator, score
+                    ),
+                )
+                env.save_trace(trace_path, passed=score == 1)
+        except openai_errors() as e:
             logger.info(f"[OpenAI Error] {repr(e)}")
         except Exception as e:
             logger.info(f"[Unhandled Error] {repr(e)}]")
@@ -469,11 +830,52 @@ def test(
                 f.write(f"[Config file]: {config_file}\n")
                 f.write(f"[Unhandled Error] {repr(e)}\n")
                 f.write(traceback.format_exc())  # write stack trace to file
+        finally:
+            # the task raised before its trace was saved, keep it
+            if env.trace_recorder.active:
+                env.save_trace(
+                    Path(args.result_dir)
+                    / "traces"
+                    / f"{env.trace_recorder.task_key}.zip",
+                    passed=False,
+                )
 
         if render_helper is not None:
             render_helper.close()
 
+    if eval_pool is not None:
+        eval_pool.close()
+        logger.info(f"[Eval pool] {eval_pool.stats.summary()}")
     env.close()
+    config_dir.cleanup()
+    logger.info(f"[Auth cache] {auth_cache.stats.summary()}")
+    logger.info(f"[Eval plans] {eval_plans.stats.summary()}")
+    logger.info(f"[Resources] {resource_registry.stats.summary()}")
+    logger.info(f"[Rate limiter] {rate_limiter.stats.summary()}")
+    if resilient_caller is not None:
+        logger.info(f"[LLM calls] {resilient_caller.summary()}")
+        logger.info(f"[LLM latency] {resilient_caller.latencies.summary()}")
+        with open(Path(args.result_dir) / "llm_latency.json", "w") as f:
+            json.dump(resilient_caller.latencies.export(), f, indent=2)
+    logger.info(f"[LLM judge] {llm_judge.stats.summary()}")
+    if response_cache is not None:
+        logger.info(f"[LLM cache] {response_cache.stats.summary()}")
+    if isinstance(agent, PromptAgent):
+        truncation_stats = agent.prompt_constructor.truncator.stats
+        logger.info(f"[Observation truncation] {truncation_stats.summary()}")
+        logger.info(f"[Action sampling] {agent.sampling_stats.summary()}")
+    recorder = env.trace_recorder
+    step_latency = sum(step_times) / len(step_times) if step_times else 0.0
+    logger.info(
+        f"[Traces] mode={trace_policy.mode}, written={recorder.traces_written}, "
+        f"discarded={recorder.traces_discarded}, "
+        f"size={recorder.bytes_written / 1e6:.1f}MB, "
+        f"step_latency={step_latency:.3f}s over {len(step_times)} steps"
+    )
+    if resource_router is not None:
+        logger.info(f"[Asset cache] {resource_router.stats.summary()}")
+    if site_resetter.latencies:
+        logger.info(f"[Site resets] {site_resetter.summary()}")
     if len(scores):
         logger.info(f"Average score: {sum(scores) / len(scores)}")
 
@@ -544,7 +946,6 @@ if __name__ == "__main__":
     print(f"Total {len(test_file_list)} tasks left")
     args.render = False
     args.render_screenshot = True
-    args.save_trace_enabled = True
 
     args.current_viewport_only = True
     dump_config(args)
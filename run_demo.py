@@ -11,9 +11,7 @@ import time
 import tempfile
 from pathlib import Path
 
-import openai
 import requests
-import torch
 from beartype import beartype
 from PIL import Image
 
@@ -36,6 +34,7 @@ from browser_env.helper_functions import (
     get_action_description,
 )
 from evaluation_harness import image_utils
+from llms.utils import openai_errors
 
 LOG_FOLDER = "log_files"
 Path(LOG_FOLDER).mkdir(parents=True, exist_ok=True)
@@ -156,12 +155,34 @@ def config() -> argparse.Namespace:
         help="max retry times to perform generations when parsing fails",
         default=1,
     )
+    parser.add_argument(
+        "--speculative_samples",
+        type=int,
+        default=1,
+        help="After a parsing failure, sample this many responses concurrently and use the first that parses (within max_retry)",
+    )
+    parser.add_argument(
+        "--stream_actions",
+        action="store_true",
+        help="Stream the LLM responses and stop generating once they contain a complete action",
+    )
     parser.add_argument(
         "--max_obs_length",
         type=int,
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=3840,
     )
+    parser.add_argument(
+        "--obs_truncation",
+        choices=["tokens", "lines"],
+        default="tokens",
+        help="Cut the observation exactly at max_obs_length tokens, or also drop the last partial line",
+    )
+    parser.add_argument(
+        "--obs_compression",
+        action="store_true",
+        help="When the observation is over max_obs_length, keep the nodes most relevant to the intent instead of its head",
+    )
 
 
     # example config
@@ -376,7 +397,7 @@ def test(
             env.save_trace(
                 Path(args.result_dir) / "trace.zip"
             )
-    except openai.OpenAIError as e:
+    except openai_errors() as e:
         logger.info(f"[OpenAI Error] {repr(e)}")
     except Exception as e:
         logger.info(f"[Unhandled Error] {repr(e)}]")
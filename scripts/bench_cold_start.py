@@ -0,0 +1,65 @@
+"""Measure the cold start of agents with and without the resource registry.
+
+Every measurement runs in a fresh interpreter: it imports the agent module
+and builds `--agents` tokenizers, one per agent, either with a new
+`Tokenizer` each time (as before) or through `get_tokenizer`.
+
+Example:
+    python scripts/bench_cold_start.py --provider openai --model gpt-4o
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import json, time
+start = time.perf_counter()
+from agent import agent
+from llms.tokenizers import Tokenizer, get_tokenizer
+imported = time.perf_counter()
+build = get_tokenizer if {shared} else Tokenizer
+for _ in range({agents}):
+    build({provider!r}, {model!r})
+done = time.perf_counter()
+print(json.dumps({{"import": imported - start, "tokenizers": done - imported}}))
+"""
+
+
+def measure(provider: str, model: str, agents: int, shared: bool) -> dict:
+    code = SNIPPET.format(
+        shared=shared, agents=agents, provider=provider, model=model
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--provider", default="openai")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--agents", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    for shared in [False, True]:
+        runs = [
+            measure(args.provider, args.model, args.agents, shared)
+            for _ in range(args.repeats)
+        ]
+        mode = "registry" if shared else "per agent"
+        stages = ", ".join(
+            f"{stage}={statistics.median(run[stage] for run in runs) * 1000:.1f}ms"
+            for stage in ["import", "tokenizers"]
+        )
+        print(f"{mode:<10} median: {stages}")
+
+
+if __name__ == "__main__":
+    main()
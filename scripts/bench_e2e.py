@@ -0,0 +1,107 @@
+"""End-to-end throughput of `run.py` against the mock LLM server.
+
+Starts `scripts/mock_llm_server.py`, runs `run.py` with `OPENAI_BASE_URL`
+pointing at it, and reports tasks per hour twice: as measured, and without
+the time during which an LLM request was in flight, i.e. the throughput of
+the environment, agent loop and evaluators alone. Overlapping requests are
+only counted once.
+
+Everything after `--` is passed to `run.py`.
+
+Example:
+    python scripts/bench_e2e.py --latency lognormal:2.0,0.5 -- \
+        --test_config_base_dir config_files/vwa/test_classifieds \
+        --test_start_idx 0 --test_end_idx 10 --model gpt-4o \
+        --result_dir results/bench_e2e
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+
+def start_server(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "scripts/mock_llm_server.py",
+            "--port",
+            "0",
+            "--latency",
+            args.latency,
+            "--steps",
+            str(args.steps),
+            "--error_rate",
+            str(args.error_rate),
+            "--rate_limit_rate",
+            str(args.rate_limit_rate),
+        ]
+        + (["--script", args.script] if args.script else []),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert server.stdout is not None
+    # "Mock LLM server on http://host:port/v1"
+    base_url = server.stdout.readline().strip().split()[-1]
+    return server, base_url
+
+
+def result_dir(run_args: list[str]) -> str | None:
+    if "--result_dir" in run_args:
+        return run_args[run_args.index("--result_dir") + 1]
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--script", type=str, default=None)
+    parser.add_argument("run_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    run_args = [a for a in args.run_args if a != "--"]
+    out_dir = result_dir(run_args)
+    if out_dir is None:
+        parser.error("pass --result_dir to run.py to count the finished tasks")
+    before = set(Path(out_dir).glob("*.html"))
+
+    server, base_url = start_server(args)
+    try:
+        env = {**os.environ, "OPENAI_BASE_URL": base_url}
+        env.setdefault("OPENAI_API_KEY", "mock")
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "run.py", "--provider", "openai"] + run_args,
+            env=env,
+            check=False,
+        )
+        wall = time.perf_counter() - start
+        with urllib.request.urlopen(f"{base_url}/stats") as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+
+    tasks = len(set(Path(out_dir).glob("*.html")) - before)
+    # the injected latencies overlap when requests are concurrent, so
+    # their sum can exceed the wall time
+    without_llm = max(1e-9, wall - stats["busy_seconds"])
+    print(f"tasks: {tasks} in {wall:.1f}s")
+    print(
+        f"LLM: {stats['requests']} requests, {stats['latency_seconds']:.1f}s "
+        f"injected latency, {stats['busy_seconds']:.1f}s with a request in "
+        f"flight, {stats['errors']} errors, "
+        f"{stats['rate_limited']} rate limited"
+    )
+    print(f"tasks/hour: {tasks / wall * 3600:.1f}")
+    print(f"tasks/hour without LLM latency: {tasks / without_llm * 3600:.1f}")
+
+
+if __name__ == "__main__":
+    main()
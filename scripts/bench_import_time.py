@@ -0,0 +1,76 @@
+"""Start-up cost of `run.py`, from `python -X importtime`.
+
+Two cases are measured in fresh interpreters: `run.py --help`, and the
+imports of a worker (the packages every parallel worker loads before its
+first task). For each, the wall time of the process, the total import
+time and the most expensive top-level imports are reported.
+
+Example:
+    python scripts/bench_import_time.py --repeats 5 --top 10
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    "run.py --help": ["run.py", "--help"],
+    "worker spawn": [
+        "-c",
+        "import agent.agent, browser_env, evaluation_harness, llms",
+    ],
+}
+# "import time: self [us] | cumulative | imported package"
+LINE_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def measure(args: list[str]) -> tuple[float, dict[str, float]]:
+    """Wall time of the process and cumulative import time of each
+    top-level import, in seconds"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    top_level: dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match and not match.group(3):
+            top_level[match.group(4)] = int(match.group(2)) / 1e6
+    return wall, top_level
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for name, case_args in CASES.items():
+        walls, totals = [], []
+        per_module: dict[str, list[float]] = {}
+        for _ in range(args.repeats):
+            wall, top_level = measure(case_args)
+            walls.append(wall)
+            totals.append(sum(top_level.values()))
+            for module, seconds in top_level.items():
+                per_module.setdefault(module, []).append(seconds)
+        print(
+            f"== {name}: wall={statistics.median(walls) * 1000:.0f}ms, "
+            f"imports={statistics.median(totals) * 1000:.0f}ms"
+        )
+        slowest = sorted(
+            per_module.items(),
+            key=lambda item: statistics.median(item[1]),
+            reverse=True,
+        )
+        for module, seconds in slowest[: args.top]:
+            print(f"  {statistics.median(seconds) * 1000:8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
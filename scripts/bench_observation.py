@@ -0,0 +1,71 @@
+"""Compare per-step observation latency with and without overlapped capture.
+
+Example:
+    python scripts/bench_observation.py --observation_type image_som \
+        --url http://127.0.0.1:7770 --repeats 10
+"""
+import argparse
+import json
+import statistics
+import tempfile
+
+from browser_env import ScriptBrowserEnv
+
+
+def bench(
+    url: str,
+    observation_type: str,
+    concurrent: bool,
+    repeats: int,
+    viewport: dict[str, int],
+) -> dict[str, list[float]]:
+    env = ScriptBrowserEnv(
+        observation_type=observation_type,
+        current_viewport_only=True,
+        viewport_size=viewport,  # type: ignore[arg-type]
+        concurrent_observation=concurrent,
+    )
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"start_url": url, "storage_state": None}, f)
+        config_file = f.name
+    env.reset(options={"config_file": config_file})
+
+    timings: dict[str, list[float]] = {}
+    for _ in range(repeats):
+        env.observation_handler.get_observation(env.page)
+        for stage, value in env.observation_handler.timings.items():
+            timings.setdefault(stage, []).append(value)
+    env.close()
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", nargs="+", required=True)
+    parser.add_argument(
+        "--observation_type",
+        default="image_som",
+        choices=["accessibility_tree", "html", "image", "image_som"],
+    )
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--viewport_width", type=int, default=1280)
+    parser.add_argument("--viewport_height", type=int, default=2048)
+    args = parser.parse_args()
+    viewport = {"width": args.viewport_width, "height": args.viewport_height}
+
+    for url in args.url:
+        print(f"== {url} ({args.observation_type})")
+        for concurrent in [False, True]:
+            timings = bench(
+                url, args.observation_type, concurrent, args.repeats, viewport
+            )
+            mode = "concurrent" if concurrent else "sequential"
+            stages = ", ".join(
+                f"{stage}={statistics.median(values) * 1000:.1f}ms"
+                for stage, values in timings.items()
+            )
+            print(f"  {mode:<10} median: {stages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""A local stand-in for the OpenAI chat completions API, to load-test the
+environment, the agent loop and the evaluators without paying for LLM calls.
+
+Point the agent at it with `OPENAI_BASE_URL=http://127.0.0.1:<port>/v1`.
+
+Responses are either scripted per task, from a json file mapping a substring
+of the objective to the responses of the successive steps (e.g. the
+`raw_prediction`s of a previous run), or synthetic: `--steps` actions on
+elements of the observation followed by a stop action. The latency of each
+response is drawn from `--latency`, and 5xx errors and 429s with a
+Retry-After header can be injected. `stream: true` is answered with
+server-sent events. `GET /stats` returns the request counts, the total
+latency injected and `busy_seconds`, the time during which at least one
+request was being answered.
+
+Example:
+    python scripts/mock_llm_server.py --port 8808 \
+        --latency lognormal:2.0,0.5 --rate_limit_rate 0.05 --steps 4
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+OBJECTIVE_PATTERN = re.compile(r"OBJECTIVE: (.*)")
+ELEMENT_PATTERN = re.compile(r"\[(\d+)\] (link|button|textbox|combobox|img)")
+ANSWER_PHRASE = "In summary, the next action I will perform is"
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """`fixed:S`, `uniform:A,B`, `lognormal:MEDIAN,SIGMA` or
+    `exponential:MEAN`, in seconds"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    match kind:
+        case "fixed":
+            return lambda rng: values[0]
+        case "uniform":
+            return lambda rng: rng.uniform(values[0], values[1])
+        case "lognormal":
+            mu = math.log(values[0])
+            return lambda rng: rng.lognormvariate(mu, values[1])
+        case "exponential":
+            return lambda rng: rng.expovariate(1 / values[0])
+        case _:
+            raise ValueError(f"Unknown latency distribution {spec}")
+
+
+def prompt_text(messages: list[dict[str, Any]]) -> str:
+    """Text of the last message, the one with the current observation"""
+    content = messages[-1].get("content", "") if messages else ""
+    if isinstance(content, list):
+        return "\n".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    return str(content)
+
+
+class MockLLM(object):
+    def __init__(
+        self,
+        script: dict[str, list[str]] | None = None,
+        steps: int = 3,
+        latency: Callable[[random.Random], float] = parse_latency("fixed:0"),
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+        responder: Callable[[dict[str, Any]], str] | None = None,
+    ) -> None:
+        self.script = script or {}
+        self.steps = steps
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        # answers the whole request instead of the script and the synthetic
+        # actions, e.g. in tests
+        self.responder = responder
+        self.lock = threading.Lock()
+        # step of each objective
+        self.step: dict[str, int] = {}
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "latency_seconds": 0.0,
+            "busy_seconds": 0.0,
+        }
+        self.in_flight = 0
+        self.busy_since = 0.0
+
+    def draw(self) -> tuple[str | None, float]:
+        """The injected failure, if any, and the latency of the request"""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            latency = max(0.0, self.latency(self.rng))
+            if roll < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return "rate_limit", 0.0
+            # the errors are answered after the latency too
+            self.stats["latency_seconds"] += latency
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return "error", latency
+            return None, latency
+
+    def begin(self) -> None:
+        with self.lock:
+            if self.in_flight == 0:
+                self.busy_since = time.perf_counter()
+            self.in_flight += 1
+
+    def end(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.stats["busy_seconds"] += time.perf_counter() - self.busy_since
+
+    def respond(self, messages: list[dict[str, Any]]) -> str:
+        text = prompt_text(messages)
+        objectives = OBJECTIVE_PATTERN.findall(text)
+        objective = objectives[-1] if objectives else ""
+        with self.lock:
+            if "PREVIOUS ACTION: None" in text:
+                self.step[objective] = 0
+            step = self.step.get(objective, 0)
+            self.step[objective] = step + 1
+            for pattern, responses in self.script.items():
+                if pattern in objective:
+                    return responses[min(step, len(responses) - 1)]
+            if step >= self.steps:
+                return f"{ANSWER_PHRASE} ```stop [N/A]```"
+            elements = ELEMENT_PATTERN.findall(text)
+            if elements and self.rng.random() < 0.7:
+                element_id = self.rng.choice(elements)[0]
+                return f"Let's think step-by-step. {ANSWER_PHRASE} ```click [{element_id}]```"
+        return f"Let's think step-by-step. {ANSWER_PHRASE} ```scroll [down]```"
+
+
+def make_handler(llm: MockLLM) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(
+            self,
+            status: int,
+            body: Any,
+            headers: dict[str, str] | None = None,
+        ) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                with llm.lock:
+                    self._send_json(200, dict(llm.stats))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            llm.begin()
+            try:
+                self._complete(request, length)
+            finally:
+                llm.end()
+
+        def _complete(self, request: dict[str, Any], length: int) -> None:
+            failure, latency = llm.draw()
+            if failure == "rate_limit":
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit", "type": "rate_limit"}},
+                    {"Retry-After": str(llm.retry_after)},
+                )
+                return
+            time.sleep(latency)
+            if failure == "error":
+                self._send_json(
+                    500, {"error": {"message": "Injected", "type": "server"}}
+                )
+                return
+            if llm.responder is not None:
+                content = llm.responder(request)
+            else:
+                content = llm.respond(request.get("messages", []))
+            model = request.get("model", "mock")
+            if request.get("stream"):
+                self._stream(content, model)
+                return
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": length // 4,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": (length + len(content)) // 4,
+                    },
+                },
+            )
+
+        def _stream(self, content: str, model: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = re.findall(r"\S+\s*", content)
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": word},
+                            "finish_reason": "stop"
+                            if i == len(words) - 1
+                            else None,
+                        }
+                    ],
+                }
+                try:
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                except BrokenPipeError:
+                    # the client stopped the generation
+                    return
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def serve(llm: MockLLM, host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(llm))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument(
+        "--script",
+        type=str,
+        default=None,
+        help="json file mapping a substring of the objective to the responses of its steps",
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=3,
+        help="Synthetic actions before stopping, for unscripted tasks",
+    )
+    parser.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="fixed:S, uniform:A,B, lognormal:MEDIAN,SIGMA or exponential:MEAN",
+    )
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--retry_after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    script = {}
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    llm = MockLLM(
+        script=script,
+        steps=args.steps,
+        latency=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    server = serve(llm, args.host, args.port)
+    print(f"Mock LLM server on http://{args.host}:{server.server_port}/v1", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Score the saved tasks of a result dir again, without a browser or an agent,
+and report the tasks whose score changed.
+
+Uses the artifacts `run.py` saves under <result_dir>/artifacts and the
+current task configs (or the ones of --config_dir, matched by file name).
+The new scores are written to <result_dir>/rescored.jsonl.
+
+Example:
+    python scripts/rescore.py --result_dir cache/results_x --workers 16
+"""
+import argparse
+import json
+from dataclasses import asdict
+from pathlib import Path
+
+from evaluation_harness.rescore import rescore_dir, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument(
+        "--config_dir",
+        type=str,
+        default="",
+        help="Score with the configs of this dir instead of the ones the tasks ran with",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--llm_judge_cache",
+        type=str,
+        default="",
+        help="Jsonl file of the LLM-judge verdicts, defaults to llm_judge.jsonl in the result dir",
+    )
+    parser.add_argument(
+        "--output", type=str, default="", help="Defaults to rescored.jsonl in the result dir"
+    )
+    args = parser.parse_args()
+
+    results = rescore_dir(
+        args.result_dir,
+        config_dir=args.config_dir or None,
+        workers=args.workers,
+        judge_path=args.llm_judge_cache or None,
+    )
+    output = args.output or Path(args.result_dir) / "rescored.jsonl"
+    with open(output, "w") as f:
+        for result in results:
+            f.write(json.dumps(asdict(result)) + "\n")
+    print(summarize(results))
+    for result in results:
+        if result.error is not None:
+            print(f"[Rescore error] {result.config_file}\n{result.error}")
+
+
+if __name__ == "__main__":
+    main()
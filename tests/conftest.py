@@ -1,14 +1,66 @@
-from typing import AsyncGenerator, Generator
+import http.server
+import threading
+from typing import AsyncGenerator, Callable, Generator
 
 import pytest
 import pytest_asyncio
 
 from browser_env import AsyncScriptBrowserEnv, ScriptBrowserEnv
+from scripts.mock_llm_server import MockLLM, serve
 
 HEADLESS = True
 SLOW_MO = 0
 
 
+class LocalHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.server_port}"
+
+
+@pytest.fixture
+def local_http_server() -> Generator[
+    Callable[[type[http.server.BaseHTTPRequestHandler]], LocalHTTPServer],
+    None,
+    None,
+]:
+    """Serve a request handler class on a free local port, without logging
+    the requests. The servers are shut down after the test."""
+    servers: list[LocalHTTPServer] = []
+
+    def serve(
+        handler: type[http.server.BaseHTTPRequestHandler],
+    ) -> LocalHTTPServer:
+        quiet = type(
+            handler.__name__, (handler,), {"log_message": lambda *args: None}
+        )
+        server = LocalHTTPServer(("127.0.0.1", 0), quiet)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def mock_llm(monkeypatch) -> Generator[MockLLM, None, None]:
+    """The mock chat completions API, used through the real OpenAI clients.
+    Tests set its `responder`."""
+    llm = MockLLM()
+    server = serve(llm, "127.0.0.1", 0)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv(
+        "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1"
+    )
+    yield llm
+    server.shutdown()
+
+
 @pytest.fixture(scope="function")
 def script_browser_env() -> Generator[ScriptBrowserEnv, None, None]:
     """Create a ScriptBrowserEnv instance for testing.
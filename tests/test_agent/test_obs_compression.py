@@ -0,0 +1,51 @@
+from agent.prompts.obs_compression import AccessibilityTreeCompressor
+
+
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+def cost(text: str) -> int:
+    return sum(count_tokens(line) + 1 for line in text.split("\n"))
+
+
+def _product_page(n: int, match: int) -> str:
+    lines = ["Tab 0 (current): One Stop Market", "", "[1] RootWebArea 'One Stop Market'"]
+    for i in range(n):
+        name = "Blue Ceramic Teapot" if i == match else f"Garden Hose {i}"
+        lines.append(f"\t[{100 + 2 * i}] link '{name}'")
+        lines.append(f"\t\t[{101 + 2 * i}] StaticText '$ {i}.99'")
+    return "\n".join(lines)
+
+
+def test_summaries_are_within_the_budget() -> None:
+    obs = _product_page(300, match=150)
+    compressor = AccessibilityTreeCompressor(count_tokens)
+    for max_length in [50, 200, 500]:
+        compressed = compressor(obs, "buy the blue ceramic teapot", max_length)
+        assert cost(compressed) <= max_length
+        assert "nodes omitted" in compressed
+
+
+def test_matching_nodes_and_their_ancestors_are_kept() -> None:
+    obs = _product_page(300, match=150)
+    compressed = AccessibilityTreeCompressor(count_tokens)(
+        obs, "buy the blue ceramic teapot", 200
+    )
+    lines = compressed.split("\n")
+    # the tab list and the root before the tree
+    assert lines[0] == "Tab 0 (current): One Stop Market"
+    assert "[1] RootWebArea 'One Stop Market'" in lines
+    assert "\t[400] link 'Blue Ceramic Teapot'" in lines
+    # its price, a child, comes along as the context of a match
+    assert "\t\t[401] StaticText '$ 150.99'" in lines
+    # element ids are not renumbered
+    assert all(
+        line.strip().startswith(("[", "Tab")) or not line for line in lines
+    )
+
+
+def test_short_observations_are_unchanged() -> None:
+    obs = _product_page(3, match=1)
+    compressor = AccessibilityTreeCompressor(count_tokens)
+    assert compressor(obs, "teapot", 10_000) == obs
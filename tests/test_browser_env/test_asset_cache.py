@@ -0,0 +1,135 @@
+from playwright.sync_api import Error
+
+from browser_env.asset_cache import (
+    AssetCache,
+    ResourceRouter,
+    load_resource_rules,
+)
+
+
+def test_asset_cache_roundtrip(tmp_path) -> None:
+    cache = AssetCache(tmp_path, max_entry_bytes=10)
+    url = "http://127.0.0.1:7770/static/style.css"
+    assert cache.get(url) is None
+
+    headers = {"content-type": "text/css", "content-encoding": "gzip", "etag": '"abc"'}
+    assert cache.put(url, 200, headers, b"body{}")
+    meta, body = cache.get(url)  # type: ignore[misc]
+    assert body == b"body{}"
+    assert meta["etag"] == '"abc"'
+    assert "content-encoding" not in meta["headers"]
+
+    # another process sees the same entry
+    assert AssetCache(tmp_path).get(url) is not None
+    # too large to cache
+    assert not cache.put(url + "?v=2", 200, {}, b"x" * 11)
+
+
+def test_resource_router_blocking(tmp_path) -> None:
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text('{"reddit": {"block_resource_types": ["font"]}}')
+    router = ResourceRouter(
+        rules=load_resource_rules(rules_file),
+        site_urls={
+            "shopping": "http://127.0.0.1:7770",
+            "shopping_admin": "http://127.0.0.1:7770/admin",
+            "reddit": "http://127.0.0.1:9999",
+        },
+    )
+    assert router.site_of("http://127.0.0.1:7770/admin/dashboard") == "shopping_admin"
+    assert router.site_of("http://example.com") is None
+
+    assert router.is_blocked("https://www.google-analytics.com/collect", "xhr")
+    assert router.is_blocked("http://127.0.0.1:9999/font.woff2", "font")
+    assert not router.is_blocked("http://127.0.0.1:7770/font.woff2", "font")
+
+
+class FakeRequest(object):
+    def __init__(self, url: str, resource_type: str = "stylesheet") -> None:
+        self.url = url
+        self.method = "GET"
+        self.resource_type = resource_type
+        self.headers = {"accept": "text/css"}
+
+
+class FakeResponse(object):
+    def __init__(self, status: int, headers: dict[str, str], body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    def body(self) -> bytes:
+        return self._body
+
+
+class FakeRoute(object):
+    """Records what the router did with the request"""
+
+    def __init__(self, request: FakeRequest, response: FakeResponse | None) -> None:
+        self.request = request
+        self.response = response
+        self.fetched = 0
+        self.outcome: tuple[str, dict] | None = None
+
+    def fetch(self, headers: dict[str, str]) -> FakeResponse:
+        self.fetched += 1
+        if self.response is None:
+            raise Error("net::ERR_CONNECTION_REFUSED")
+        return self.response
+
+    def fulfill(self, **kwargs) -> None:
+        self.outcome = ("fulfill", kwargs)
+
+    def continue_(self) -> None:
+        self.outcome = ("continue", {})
+
+    def abort(self, error_code: str) -> None:
+        self.outcome = ("abort", {})
+
+
+def test_resource_router_handle(tmp_path) -> None:
+    router = ResourceRouter(
+        cache=AssetCache(tmp_path),
+        site_urls={"shopping": "http://127.0.0.1:7770"},
+    )
+    url = "http://127.0.0.1:7770/static/style.css"
+    css = FakeResponse(
+        200, {"content-type": "text/css", "connection": "keep-alive"}, b"body{}"
+    )
+    route = FakeRoute(FakeRequest(url), css)
+    router.handle(route)
+    assert route.fetched == 1 and route.outcome[0] == "fulfill"
+
+    # served from the cache, without the hop-by-hop headers
+    route = FakeRoute(FakeRequest(url), None)
+    router.handle(route)
+    assert route.fetched == 0
+    assert route.outcome == (
+        "fulfill",
+        {"status": 200, "headers": {"content-type": "text/css"}, "body": b"body{}"},
+    )
+    assert (router.stats.hits, router.stats.misses) == (1, 1)
+
+    # another session's cookies are passed through, not cached
+    image_url = "http://127.0.0.1:7770/static/logo.png"
+    image = FakeResponse(200, {"set-cookie": "PHPSESSID=a"}, b"png")
+    route = FakeRoute(FakeRequest(image_url, "image"), image)
+    router.handle(route)
+    assert route.outcome[1]["headers"] == {"set-cookie": "PHPSESSID=a"}
+    assert router.cache.get(image_url) is None
+
+    # a failed fetch is left to the browser
+    route = FakeRoute(FakeRequest(image_url, "image"), None)
+    router.handle(route)
+    assert route.outcome == ("continue", {})
+    assert router.stats.fetch_errors == 1
+
+    # not a static resource of a site
+    route = FakeRoute(FakeRequest("http://example.com/style.css"), css)
+    router.handle(route)
+    assert route.fetched == 0 and route.outcome == ("continue", {})
+    route = FakeRoute(
+        FakeRequest("https://www.google-analytics.com/ga.js", "script"), css
+    )
+    router.handle(route)
+    assert route.outcome == ("abort", {}) and router.stats.blocked == 1
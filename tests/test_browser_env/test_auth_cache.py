@@ -0,0 +1,71 @@
+import http.server
+import json
+import time
+
+from browser_env.auth_cache import AuthCache, cookies_expired
+from browser_env.http_login import is_logged_in, session_from_storage_state
+
+
+class AccountPageHandler(http.server.BaseHTTPRequestHandler):
+    """/account shows "My listings" with the session cookie, otherwise it
+    redirects to /login"""
+
+    def do_GET(self) -> None:
+        if self.path == "/account" and "sid=valid" in str(
+            self.headers.get("Cookie")
+        ):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"<h1>My listings</h1>")
+        elif self.path == "/account":
+            self.send_response(302)
+            self.send_header("Location", "/login")
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"<form>Log in</form>")
+
+
+def _state(value: str, expires: float = -1) -> dict:
+    return {
+        "cookies": [
+            {
+                "name": "sid",
+                "value": value,
+                "domain": "localhost",
+                "path": "/",
+                "expires": expires,
+            }
+        ],
+        "origins": [],
+    }
+
+
+def test_http_login_check(local_http_server) -> None:
+    account_url = f"{local_http_server(AccountPageHandler).url}/account"
+
+    session = session_from_storage_state(_state("valid"))
+    assert is_logged_in(session, account_url, "My listings")
+    assert is_logged_in(session, account_url, "")
+
+    session = session_from_storage_state(_state("stale"))
+    assert not is_logged_in(session, account_url, "My listings")
+    assert not is_logged_in(session, account_url, "")
+
+
+def test_cookies_expired() -> None:
+    assert not cookies_expired(_state("valid"))
+    assert not cookies_expired(_state("valid", expires=time.time() + 3600))
+    assert cookies_expired(_state("valid", expires=time.time() - 1))
+
+
+def test_auth_cache_reuses_recently_verified_state(tmp_path) -> None:
+    cache = AuthCache(tmp_path, verify_interval=300)
+    path = cache.path(["classifieds"])
+    path.write_text(json.dumps(_state("valid")))
+    # pretend the state was checked a moment ago, no request is made
+    cache._verified["classifieds"] = (time.time(), path.stat().st_mtime)
+    assert cache.get(["classifieds"]) == str(path)
+    assert cache.stats.hits == 1
+    assert cache.stats.renewals == 0
@@ -0,0 +1,116 @@
+import http.server
+import secrets
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+
+from browser_env.http_login import (
+    http_login,
+    is_logged_in,
+    parse_login_form,
+    session_from_storage_state,
+    storage_state_from_session,
+)
+
+LOGIN_PAGE = """
+<form action="/newsletter" method="post"><input type="email" name="email"></form>
+<form action="/login_post" method="post">
+  <input type="hidden" name="_csrf_token" value="{token}">
+  <input type="text" name="_username">
+  <input type="password" name="_password">
+  <input type="checkbox" name="_remember_me">
+</form>
+"""
+
+
+@pytest.fixture
+def login_site(local_http_server) -> tuple[str, dict[str, str]]:
+    """A stand-in for the sites' login flow: a CSRF token bound to a
+    pre-login session, then an HttpOnly auth cookie after the POST. Returns
+    its url and the auth cookie it issued."""
+    csrf_tokens: dict[str, str] = {}
+    issued: dict[str, str] = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def _cookies(self) -> dict[str, str]:
+            cookies = {}
+            for part in str(self.headers.get("Cookie", "")).split(";"):
+                if "=" in part:
+                    k, v = part.strip().split("=", 1)
+                    cookies[k] = v
+            return cookies
+
+        def do_GET(self) -> None:
+            if self.path == "/login":
+                sid, token = secrets.token_hex(8), secrets.token_hex(8)
+                csrf_tokens[sid] = token
+                self.send_response(200)
+                self.send_header("Set-Cookie", f"sid={sid}; Path=/")
+                self.end_headers()
+                self.wfile.write(LOGIN_PAGE.format(token=token).encode())
+            elif self._cookies().get("auth") in issued.values():
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b"My listings")
+            else:
+                self.send_response(302)
+                self.send_header("Location", "/login")
+                self.end_headers()
+
+        def do_POST(self) -> None:
+            length = int(self.headers["Content-Length"])
+            form = parse_qs(self.rfile.read(length).decode())
+            sid = self._cookies().get("sid", "")
+            self.send_response(302)
+            if (
+                form.get("_csrf_token") == [csrf_tokens.get(sid)]
+                and form.get("_username") == ["alice"]
+                and form.get("_password") == ["secret"]
+            ):
+                issued["auth"] = secrets.token_hex(8)
+                self.send_header(
+                    "Set-Cookie", f"auth={issued['auth']}; Path=/; HttpOnly"
+                )
+                self.send_header("Location", "/account")
+            else:
+                self.send_header("Location", "/login")
+            self.end_headers()
+
+    return local_http_server(Handler).url, issued
+
+
+def test_parse_login_form() -> None:
+    form = parse_login_form(
+        LOGIN_PAGE.format(token="abc"), "http://localhost:1/login"
+    )
+    assert form is not None
+    assert form.action == "http://localhost:1/login_post"
+    assert form.fields == {"_csrf_token": "abc"}
+    assert form.username_field == "_username"
+    assert form.password_field == "_password"
+    assert parse_login_form("<form><input name='q'></form>", "") is None
+
+
+def test_http_login_storage_state(login_site) -> None:
+    url, issued = login_site
+    session = requests.Session()
+    assert http_login(session, f"{url}/login", "alice", "secret")
+    assert is_logged_in(session, f"{url}/account", "My listings")
+
+    state = storage_state_from_session(session)
+    cookies = {c["name"]: c for c in state["cookies"]}
+    # the cookie the site issued, as the browser would have stored it
+    assert cookies["auth"]["value"] == issued["auth"]
+    assert cookies["auth"]["domain"] == "localhost"
+    assert cookies["auth"]["path"] == "/"
+    assert cookies["auth"]["httpOnly"]
+    assert cookies["auth"]["expires"] == -1
+
+    # the storage state logs in on its own
+    restored = session_from_storage_state(state)
+    assert is_logged_in(restored, f"{url}/account", "My listings")
+
+    session = requests.Session()
+    assert http_login(session, f"{url}/login", "alice", "wrong")
+    assert not is_logged_in(session, f"{url}/account", "My listings")
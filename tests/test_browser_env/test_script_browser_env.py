@@ -290,3 +290,59 @@ def test_click_open_new_tab(
     )
     assert "heading 'Example Domain'" in obs["text"]
     assert "www.example.com" in info['page'].url
+
+
+def test_concurrent_observation_matches_sequential(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    obs, *_, info = env.step(
+        create_playwright_action(
+            f"page.goto('file:///{os.getcwd()}/tests/test_browser_env/sites/new_tab.html')"
+        )
+    )
+    assert "text_render" in info["observation_timings"]
+
+    env.observation_handler.concurrent_capture = False
+    sequential_obs = env.observation_handler.get_observation(env.page)
+    assert "text" in env.observation_handler.timings
+    assert sequential_obs["text"] == obs["text"]
+    assert (sequential_obs["image"] == obs["image"]).all()
+
+
+def test_cdp_session_reused_across_steps(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    cdp_sessions = env.observation_handler.cdp_sessions
+    for _ in range(3):
+        env.step(
+            create_playwright_action(
+                f"page.goto('file:///{os.getcwd()}/tests/test_browser_env/sites/new_tab.html')"
+            )
+        )
+    assert cdp_sessions.num_attached == 1
+
+
+def test_cdp_session_reattached_after_detach(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.observation_handler.text_processor.current_viewport_only = True
+    env.reset()
+    cdp_sessions = env.observation_handler.cdp_sessions
+    action = create_playwright_action(
+        f"page.goto('file:///{os.getcwd()}/tests/test_browser_env/sites/new_tab.html')"
+    )
+    obs, *_, info = env.step(action)
+    expected = obs["text"]
+    # e.g. the session was dropped by a crashed target
+    cdp_sessions.get(env.page).detach()
+    obs, *_, info = env.step(action)
+    assert cdp_sessions.num_attached == 2
+    assert obs["text"] == expected
+    nodes_info = info["observation_metadata"]["text"]["obs_nodes_info"]
+    assert nodes_info
+    assert all(node["union_bound"] is not None for node in nodes_info.values())
@@ -0,0 +1,106 @@
+import fcntl
+import http.server
+import threading
+import time
+
+import pytest
+
+from browser_env.site_reset import (
+    NoopResetBackend,
+    ResetBackend,
+    SiteResetter,
+    wait_until_ready,
+)
+
+
+class OkHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+def _is_locked(lock_file, mode: int) -> bool:
+    with open(lock_file, "a+") as f:
+        try:
+            fcntl.flock(f, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+def test_site_resetter_resets_and_holds(tmp_path, local_http_server) -> None:
+    url = local_http_server(OkHandler).url
+    backend = NoopResetBackend()
+    resetter = SiteResetter(
+        {"classifieds": backend},
+        probe_urls={"classifieds": url},
+        lock_dir=tmp_path,
+    )
+
+    resetter.hold(["classifieds", "wikipedia"], reset=True)
+    assert backend.calls == ["classifieds"]
+    assert len(resetter.latencies["classifieds"]) == 1
+    # the task holds the site: another worker cannot reset it, but can share it
+    lock_file = tmp_path / "classifieds.lock"
+    assert _is_locked(lock_file, fcntl.LOCK_EX)
+    assert not _is_locked(lock_file, fcntl.LOCK_SH)
+
+    resetter.hold(["classifieds"])
+    assert backend.calls == ["classifieds"]
+
+    resetter.release()
+    assert not _is_locked(lock_file, fcntl.LOCK_EX)
+
+
+def test_waiting_reset_goes_before_new_tasks(tmp_path) -> None:
+    events = []
+
+    class Backend(ResetBackend):
+        def reset(self, site: str) -> None:
+            events.append("reset")
+
+    running = SiteResetter({}, lock_dir=tmp_path)
+    running.hold(["shopping"])
+    # the evaluation of the running task shares its locks
+    evaluation = SiteResetter({}, lock_dir=tmp_path)
+
+    def reset() -> None:
+        SiteResetter({"shopping": Backend()}, lock_dir=tmp_path).hold(
+            ["shopping"], reset=True
+        )
+
+    def new_task() -> None:
+        SiteResetter({}, lock_dir=tmp_path).hold(["shopping"])
+        events.append("new task")
+
+    resetting = threading.Thread(target=reset, daemon=True)
+    resetting.start()
+    time.sleep(0.2)
+    starting = threading.Thread(target=new_task, daemon=True)
+    starting.start()
+    time.sleep(0.2)
+    # the reset waits for the running task, the new task for the reset
+    assert events == []
+    evaluation.hold(["shopping"], shared=True)
+    running.release()
+    time.sleep(0.2)
+    assert events == []
+    evaluation.release()
+    resetting.join(timeout=5)
+    starting.join(timeout=5)
+    assert events == ["reset", "new task"]
+
+    with pytest.raises(TypeError):
+        ResetBackend()  # type: ignore[abstract]
+
+
+def test_wait_until_ready_times_out(local_http_server) -> None:
+    server = local_http_server(OkHandler)
+    url = server.url
+    assert wait_until_ready(url, timeout=1) < 1
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(TimeoutError):
+        wait_until_ready(url, timeout=0.3, initial_delay=0.1)
@@ -0,0 +1,58 @@
+import pytest
+
+from browser_env import TracePolicy
+from browser_env.tracing import TraceRecorder
+
+
+def test_trace_policy_modes() -> None:
+    assert not TracePolicy(mode="off").should_trace("1")
+    assert TracePolicy(mode="always").should_trace("1")
+
+    on_failure = TracePolicy(mode="on_failure")
+    assert on_failure.should_trace("1")
+    assert not on_failure.should_keep(passed=True)
+    assert on_failure.should_keep(passed=False)
+    assert TracePolicy(mode="always").should_keep(passed=True)
+
+    with pytest.raises(ValueError):
+        TracePolicy(mode="sometimes")
+
+
+def test_trace_policy_sampling_is_deterministic() -> None:
+    policy = TracePolicy(mode="sampled", sample_rate=0.3)
+    keys = [str(i) for i in range(1000)]
+    sampled = [k for k in keys if policy.should_trace(k)]
+    assert sampled == [k for k in keys if policy.should_trace(k)]
+    assert 200 < len(sampled) < 400
+
+    assert not any(
+        TracePolicy(mode="sampled", sample_rate=0.0).should_trace(k)
+        for k in keys
+    )
+
+
+class FakeTracing(object):
+    def start(self, **kwargs) -> None:
+        pass
+
+    def stop(self, path=None) -> None:
+        if path is not None:
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+
+
+class FakeContext(object):
+    tracing = FakeTracing()
+
+
+def test_discarded_traces_are_not_counted(tmp_path) -> None:
+    recorder = TraceRecorder(TracePolicy(mode="on_failure"))
+    for task in ["1", "2"]:
+        recorder.start(FakeContext(), task)  # type: ignore[arg-type]
+        # the task is still being evaluated
+        recorder.stop(tmp_path / f"{task}.zip", passed=None)
+    recorder.discard(tmp_path / "1.zip")
+
+    assert not (tmp_path / "1.zip").exists()
+    assert (recorder.traces_written, recorder.traces_discarded) == (1, 1)
+    assert recorder.bytes_written == 100
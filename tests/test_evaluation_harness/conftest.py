@@ -0,0 +1,31 @@
+from typing import Any
+
+import pytest
+
+from scripts.mock_llm_server import MockLLM
+
+
+def judge_verdict(prompt: str) -> str:
+    """The verdict of the stub judge: an answer is right when it contains
+    the reference"""
+
+    def field(name: str) -> str:
+        return prompt.split(f"{name}:")[1].split("\n")[0].strip().lower()
+
+    if "student answer:" in prompt:
+        right = field("reference answer") in field("student answer")
+        return "correct" if right else "incorrect"
+    right = field("actual unachievable reason") in field(
+        "reported unachievable reason"
+    )
+    return "same" if right else "different"
+
+
+@pytest.fixture
+def judge_server(mock_llm: MockLLM) -> dict[str, Any]:
+    """Answers the LLM judge with `judge_verdict`. Returns the request
+    counts."""
+    mock_llm.responder = lambda request: judge_verdict(
+        request["messages"][-1]["content"]
+    )
+    return mock_llm.stats
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from browser_env import create_stop_action
+from evaluation_harness import (
+    EvalPlan,
+    EvalPlanCache,
+    StringEvaluator,
+    URLExactEvaluator,
+)
+from evaluation_harness.eval_plan import PAGE, compile_helper_call
+from evaluation_harness.helper_functions import PseudoPage
+
+config_file_folder = "tests/test_evaluation_harness/configs"
+
+
+def _config(**eval_config) -> dict:
+    return {"task_id": 0, "intent": "", "eval": eval_config}
+
+
+def test_compile_func_locators() -> None:
+    call = compile_helper_call("get_query_text(__page__, '.price')")
+    assert call.args == (PAGE, ".price")
+
+    call = compile_helper_call("reddit_get_post_url('__last_url__')")
+    page = PseudoPage(None, "http://r/f/books/12/a-title/comment/3")
+    assert call(page) == "http://r/f/books/12/"
+
+    for source in [
+        "__import__('os').system('true')",
+        "get_query_text(__page__, open('x'))",
+        "not_a_helper()",
+    ]:
+        with pytest.raises(ValueError):
+            compile_helper_call(source)
+
+
+def test_compile_plan() -> None:
+    plan = EvalPlan.compile(
+        _config(
+            eval_types=["string_match", "url_match", "program_html"],
+            reference_answers={"must_include": ["a |OR| b", "c"]},
+            reference_url="http://localhost:7770/ |OR| __SHOPPING__/x",
+            program_html=[
+                {
+                    "url": "func:shopping_get_latest_order_url()",
+                    "locator": "lambda:(() => 1)()",
+                    "required_contents": {"required_values": ["> 0 |OR| < -1"]},
+                }
+            ],
+        )
+    )
+    assert plan.reference_answers == (("must_include", (("a", "b"), ("c",))),)
+    assert plan.reference_urls[0] == "http://127.0.0.1:7770"
+    assert "__SHOPPING__" not in plan.reference_urls[1]
+    (target,) = plan.program_html
+    assert target.locator_type == "lambda"
+    assert target.locator == "(() => 1)()"
+    assert target.required == (("> 0", "< -1"),)
+
+    with pytest.raises(ValueError):
+        EvalPlan.compile(_config(eval_types=["unknown"]))
+
+
+def test_string_match_with_plan() -> None:
+    plan = EvalPlan.compile(
+        _config(
+            eval_types=["string_match"],
+            reference_answers={"required_values": ["> 10 |OR| < 2"]},
+        )
+    )
+    evaluator = StringEvaluator()
+    assert evaluator([create_stop_action("12")], plan) == 1.0
+    assert evaluator([create_stop_action("1")], plan) == 1.0
+    assert evaluator([create_stop_action("5")], plan) == 0.0
+
+
+def test_url_match_with_plan() -> None:
+    plan = EvalPlan.from_file(f"{config_file_folder}/url_exact_match.json")
+    trajectory = [create_stop_action("")]
+    evaluator = URLExactEvaluator()
+    assert evaluator(trajectory, plan, PseudoPage(None, "https://www.google.com")) == 1.0
+    assert evaluator(trajectory, plan, PseudoPage(None, "https://www.bing.com")) == 0.0
+
+
+def test_plan_cache(tmp_path) -> None:
+    config_file = tmp_path / "0.json"
+    config_file.write_text(
+        json.dumps(_config(eval_types=["url_match"], reference_url="http://a"))
+    )
+    cache = EvalPlanCache()
+    plan = cache.get(config_file)
+    assert cache.get(str(config_file)) is plan
+    assert cache.stats.hits == 1
+
+    config_file.write_text(
+        json.dumps(_config(eval_types=["url_match"], reference_url="http://b/"))
+    )
+    assert cache.get(config_file).reference_urls == ("http://b",)
+    assert cache.compile_all([str(tmp_path / "missing.json")])
+    assert cache.stats.compiled == 2
@@ -0,0 +1,98 @@
+import fcntl
+import threading
+
+from browser_env import create_stop_action
+from evaluation_harness import EvalPlan
+from evaluation_harness.eval_pool import (
+    EvalJob,
+    EvalPage,
+    EvalPool,
+    EvalResult,
+    needs_live_page,
+)
+
+
+def _plan(**eval_config) -> EvalPlan:
+    return EvalPlan.compile({"task_id": 0, "intent": "", "eval": eval_config})
+
+
+def test_pool_scores_jobs(tmp_path) -> None:
+    results: list[EvalResult] = []
+    pool = EvalPool(workers=2, lock_dir=str(tmp_path), on_result=results.append)
+    url_plan = _plan(eval_types=["url_match"], reference_url="http://s/cart")
+    string_plan = _plan(
+        eval_types=["string_match"], reference_answers={"exact_match": "42"}
+    )
+    futures = [
+        pool.submit(
+            EvalJob(url_plan, [create_stop_action("")], "http://s/cart/")
+        ),
+        pool.submit(
+            EvalJob(string_plan, [create_stop_action("41")], "http://s/")
+        ),
+        pool.submit(EvalJob(string_plan, [], "http://s/")),
+    ]
+    pool.close()
+
+    scores = [future.result().score for future in futures]
+    assert scores == [1.0, 0.0, None]
+    # an empty trajectory is not a valid one
+    assert futures[2].result().error is not None
+    assert len(results) == 3
+    # saved for re-scoring offline
+    assert futures[1].result().artifacts.answer == "41"
+    assert (pool.stats.completed, pool.stats.failed) == (2, 1)
+
+
+def test_needs_live_page() -> None:
+    target = {
+        "locator": "document.title",
+        "required_contents": {"exact_match": "a"},
+    }
+    assert needs_live_page(
+        _plan(eval_types=["program_html"], program_html=[{"url": "last", **target}])
+    )
+    assert not needs_live_page(
+        _plan(
+            eval_types=["program_html"],
+            program_html=[{"url": "http://s/", **target}],
+        )
+    )
+
+
+def test_eval_page_url() -> None:
+    class Page(object):
+        url = "about:blank"
+
+        def goto(self, url: str) -> None:
+            self.url = url
+
+    page = EvalPage(Page(), "http://s/final")
+    assert page.url == "http://s/final"
+    page.goto("http://s/other")
+    assert page.url == "http://s/other"
+
+
+def test_sites_are_held_from_submit(tmp_path) -> None:
+    gate = threading.Event()
+    pool = EvalPool(
+        workers=1, lock_dir=str(tmp_path), on_result=lambda r: gate.wait()
+    )
+    plan = _plan(eval_types=["url_match"], reference_url="http://s/cart")
+    job = EvalJob(plan, [create_stop_action("")], "http://s/cart")
+    # the worker is busy with the first job, the second one is queued
+    pool.submit(job)
+    pool.submit(EvalJob(plan, job.trajectory, job.final_url, sites=["shopping"]))
+
+    def can_reset() -> bool:
+        with open(tmp_path / "shopping.lock", "a+") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+
+    assert not can_reset()
+    gate.set()
+    pool.close()
+    assert can_reset()
@@ -0,0 +1,84 @@
+from typing import Any
+
+from browser_env import create_stop_action
+from evaluation_harness import EvalPlan, HTMLContentExactEvaluator
+from evaluation_harness.helper_functions import PseudoPage
+
+
+class FakePage(object):
+    """Records the navigations and answers the locators from `values`"""
+
+    def __init__(self, values: dict[str, Any]) -> None:
+        self.values = values
+        self.gotos: list[str] = []
+        self.evaluations: list[str] = []
+
+    def goto(self, url: str) -> None:
+        self.gotos.append(url)
+
+    def wait_for_load_state(self, state: str, timeout: float) -> None:
+        pass
+
+    def evaluate(self, expression: str) -> Any:
+        self.evaluations.append(expression)
+        if expression.startswith("() => ["):
+            return [
+                {"value": value}
+                for locator, value in self.values.items()
+                if f"({locator})" in expression
+            ]
+        return self.values.get(expression.removeprefix("() => "))
+
+
+def _plan(targets: list[dict]) -> EvalPlan:
+    return EvalPlan.compile(
+        {
+            "task_id": 0,
+            "intent": "",
+            "eval": {"eval_types": ["program_html"], "program_html": targets},
+        }
+    )
+
+
+def _target(url: str, locator: str, value: str, **kwargs: Any) -> dict:
+    return {
+        "url": url,
+        "locator": locator,
+        "required_contents": {"exact_match": value},
+        **kwargs,
+    }
+
+
+def test_targets_on_the_same_url_share_one_navigation() -> None:
+    fake = FakePage({"document.title": "Cart", "document.body.id": "checkout"})
+    plan = _plan(
+        [
+            _target("http://s/cart", "document.title", "cart"),
+            _target("http://s/cart", "document.body.id", "checkout"),
+        ]
+    )
+    trajectory = [create_stop_action("")]
+    score = HTMLContentExactEvaluator()(trajectory, plan, PseudoPage(fake, "http://s/"))
+    assert score == 1.0
+    assert fake.gotos == ["http://s/cart"]
+    assert len(fake.evaluations) == 1
+
+
+def test_prep_actions_reload_the_page() -> None:
+    fake = FakePage({"document.title": "Cart"})
+    plan = _plan(
+        [
+            _target(
+                "http://s/cart",
+                "document.title",
+                "cart",
+                prep_actions=["document.title = 'x'"],
+            ),
+            _target("http://s/cart", "document.title", "cart"),
+            _target("http://s/other", "document.title", "wrong"),
+        ]
+    )
+    trajectory = [create_stop_action("")]
+    score = HTMLContentExactEvaluator()(trajectory, plan, PseudoPage(fake, "http://s/"))
+    assert score == 0.0
+    assert fake.gotos == ["http://s/cart", "http://s/cart", "http://s/other"]
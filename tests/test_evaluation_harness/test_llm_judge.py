@@ -0,0 +1,83 @@
+import llms.providers.openai_utils as openai_utils
+from browser_env import create_stop_action
+from evaluation_harness import EvalPlan, StringEvaluator
+from evaluation_harness.llm_judge import JudgeRequest, LLMJudge
+
+
+def _verdict(messages: list[dict]) -> str:
+    # the reference of the tests is "blue"
+    return "Correct" if "student answer: blue" in messages[1]["content"] else "incorrect"
+
+
+def test_verdicts_are_memoized_and_saved(tmp_path, monkeypatch) -> None:
+    calls = []
+
+    def generate(messages, **kwargs) -> str:
+        calls.append(messages)
+        return _verdict(messages)
+
+    monkeypatch.setattr(
+        openai_utils, "generate_from_openai_chat_completion", generate
+    )
+    path = tmp_path / "llm_judge.jsonl"
+    judge = LLMJudge(path)
+    assert judge.grade("fuzzy_match", "blue", "blue", "color?") == 1.0
+    assert judge.grade("fuzzy_match", "blue", "blue", "color?") == 1.0
+    assert judge.grade("fuzzy_match", "red", "blue", "color?") == 0.0
+    assert len(calls) == 2
+    assert judge.stats.hits == 1
+
+    # the next judge on the file reuses the verdicts, a new model does not
+    judge = LLMJudge(path)
+    assert judge.grade("fuzzy_match", "red", "blue", "color?") == 0.0
+    judgement = judge.lookup(JudgeRequest("fuzzy_match", "red", "blue", "color?"))
+    assert judgement is not None and judgement.response == "incorrect"
+    assert len(calls) == 2
+    judge = LLMJudge(path, model="another-judge")
+    assert judge.grade("fuzzy_match", "red", "blue", "color?") == 0.0
+    assert len(calls) == 3
+
+
+def test_grade_batch(monkeypatch) -> None:
+    batches = []
+
+    async def agenerate(messages_list, **kwargs) -> list[str]:
+        batches.append(messages_list)
+        # the API failed on the last one
+        return [_verdict(m) for m in messages_list[:-1]] + [""]
+
+    monkeypatch.setattr(
+        openai_utils, "agenerate_from_openai_chat_completion", agenerate
+    )
+    plan = EvalPlan.compile(
+        {
+            "task_id": 0,
+            "intent": "color?",
+            "eval": {
+                "eval_types": ["string_match"],
+                "reference_answers": {"fuzzy_match": ["blue"]},
+            },
+        }
+    )
+    evaluator = StringEvaluator()
+    requests = [
+        request
+        for answer in ["blue", "red", "blue", "green"]
+        for request in evaluator.judge_requests([create_stop_action(answer)], plan)
+    ]
+    judge = LLMJudge()
+    assert judge.grade_batch(requests) == [1.0, 0.0, 1.0, None]
+    # duplicates are graded once
+    assert len(batches[0]) == 3
+    assert judge.stats.batched == 2
+
+
+def test_grade_batch_with_the_openai_client(judge_server) -> None:
+    requests = [
+        JudgeRequest("fuzzy_match", answer, "blue", "color?")
+        for answer in ["blue", "red", "blue"]
+    ] + [JudgeRequest("ua_match", "there is no blue one", "no blue", "buy blue")]
+    judge = LLMJudge()
+    assert judge.grade_batch(requests) == [1.0, 0.0, 1.0, 1.0]
+    assert judge_server["requests"] == 3
+    assert judge.stats.batched == 3
@@ -0,0 +1,135 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import llms.providers.openai_utils as openai_utils
+from browser_env import create_stop_action
+from evaluation_harness import EvalPlan, evaluator_router
+from evaluation_harness.helper_functions import PseudoPage
+from evaluation_harness.rescore import (
+    TaskArtifacts,
+    load_artifacts,
+    rescore_dir,
+    save_artifacts,
+    task_artifacts,
+)
+
+
+class FakePage(object):
+    def goto(self, url: str) -> None:
+        pass
+
+    def wait_for_load_state(self, state: str, timeout: float) -> None:
+        pass
+
+    def evaluate(self, expression: str) -> str:
+        return "Cart"
+
+
+def _write_config(path: Path, **eval_config) -> str:
+    path.write_text(
+        json.dumps({"task_id": int(path.stem), "intent": "", "eval": eval_config})
+    )
+    return str(path)
+
+
+def _run(result_dir: Path, config_file: str, answer: str, final_url: str) -> None:
+    """What run.py saves for an evaluated task"""
+    plan = EvalPlan.from_file(config_file)
+    trajectory = [create_stop_action(answer)]
+    evaluator = evaluator_router(plan)
+    score = evaluator(trajectory, plan, PseudoPage(FakePage(), final_url))
+    save_artifacts(
+        result_dir, task_artifacts(plan, trajectory, final_url, evaluator, score)
+    )
+    with open(result_dir / "results.jsonl", "a") as f:
+        f.write(json.dumps({"task_id": plan.config["task_id"], "score": score}) + "\n")
+
+
+def test_rescore_changed_configs(tmp_path) -> None:
+    configs = tmp_path / "configs"
+    configs.mkdir()
+    string_config = _write_config(
+        configs / "0.json",
+        eval_types=["string_match", "url_match"],
+        reference_answers={"exact_match": "42"},
+        reference_url="http://s/cart",
+    )
+    html_target = {
+        "url": "http://s/cart",
+        "locator": "document.title",
+        "required_contents": {"exact_match": "cart"},
+    }
+    html_config = _write_config(
+        configs / "1.json", eval_types=["program_html"], program_html=[html_target]
+    )
+    _run(tmp_path, string_config, "42.0", "http://s/cart")
+    _run(tmp_path, html_config, "", "http://s/")
+    (artifacts,) = [a for a in load_artifacts(tmp_path) if a.task_id == 1]
+    assert artifacts.program_html == [
+        {
+            "url": "http://s/cart",
+            "locator": "document.title",
+            "prep_actions": None,
+            "selected": "Cart",
+        }
+    ]
+
+    # fix the reference answer, and the expected title
+    _write_config(
+        configs / "0.json",
+        eval_types=["string_match", "url_match"],
+        reference_answers={"exact_match": "42.0"},
+        reference_url="http://s/cart",
+    )
+    html_target["required_contents"] = {"exact_match": "shopping cart"}
+    _write_config(
+        configs / "1.json", eval_types=["program_html"], program_html=[html_target]
+    )
+    for workers in [1, 2]:
+        results = {r.task_id: r for r in rescore_dir(tmp_path, workers=workers)}
+        assert (results[0].previous, results[0].score) == (0.0, 1.0)
+        assert (results[1].previous, results[1].score) == (1.0, 0.0)
+
+    # the saved selection says nothing about another locator
+    html_target["locator"] = "document.body.id"
+    _write_config(
+        configs / "1.json", eval_types=["program_html"], program_html=[html_target]
+    )
+    results = {r.task_id: r for r in rescore_dir(tmp_path, workers=1)}
+    assert results[1].score is None and results[1].error is None
+
+
+@pytest.mark.parametrize("batch_fails", [False, True])
+def test_rescore_changed_fuzzy_reference(
+    tmp_path, judge_server, monkeypatch, batch_fails
+) -> None:
+    if batch_fails:
+
+        async def agenerate(*args, **kwargs) -> list[str]:
+            raise RuntimeError("the batch failed")
+
+        monkeypatch.setattr(
+            openai_utils, "agenerate_from_openai_chat_completion", agenerate
+        )
+    config_file = _write_config(
+        tmp_path / "2.json",
+        eval_types=["string_match"],
+        reference_answers={"fuzzy_match": ["red"]},
+    )
+    save_artifacts(tmp_path, TaskArtifacts(2, config_file, "Blue sky", "http://s/"))
+    with open(tmp_path / "results.jsonl", "w") as f:
+        f.write(json.dumps({"task_id": 2, "score": 0.0}) + "\n")
+
+    # the reference answer was wrong
+    _write_config(
+        tmp_path / "2.json",
+        eval_types=["string_match"],
+        reference_answers={"fuzzy_match": ["blue"]},
+    )
+    (result,) = rescore_dir(tmp_path, workers=2)
+    assert (result.previous, result.score, result.error) == (0.0, 1.0, None)
+    assert judge_server["requests"] == 1
+    judgement = json.loads((tmp_path / "llm_judge.jsonl").read_text())
+    assert judgement["response"] == "correct"
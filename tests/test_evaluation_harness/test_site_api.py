@@ -0,0 +1,136 @@
+import http.server
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import pytest
+
+from browser_env import create_stop_action
+from evaluation_harness import EvalPlan, HTMLContentExactEvaluator
+from evaluation_harness import helper_functions
+from evaluation_harness.helper_functions import PseudoPage
+from evaluation_harness.site_api import ShoppingClient
+
+REVIEWS = {
+    "A1": [{"nickname": "old"}, {"nickname": "alice", "ratings": []}],
+    "B2": [],
+}
+
+
+@pytest.fixture
+def shopping_api(local_http_server) -> tuple[ShoppingClient, dict[str, int]]:
+    """A client of a stand-in for the Magento admin REST API, counting the
+    token requests. The first token it issues is revoked after one request."""
+    counts = {"token": 0, "get": 0}
+    valid: set[str] = set()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: object) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            length = int(self.headers["Content-Length"])
+            credentials = json.loads(self.rfile.read(length))
+            if credentials != {"username": "admin", "password": "pw"}:
+                self._send(401, {"message": "invalid credentials"})
+                return
+            counts["token"] += 1
+            token = f"token-{counts['token']}"
+            valid.add(token)
+            self._send(200, token)
+
+        def do_GET(self) -> None:
+            token = self.headers["Authorization"].removeprefix("Bearer ")
+            if token not in valid:
+                self._send(401, {"message": "unauthorized"})
+                return
+            counts["get"] += 1
+            if token == "token-1":
+                valid.discard(token)
+            url = urlparse(self.path)
+            parts = url.path.split("/")
+            if url.path.endswith("/reviews"):
+                self._send(200, REVIEWS[parts[-2]])
+            else:
+                self._send(404, {})
+
+    server = local_http_server(Handler)
+    return ShoppingClient(server.url, "admin", "pw"), counts
+
+
+def test_token_is_reused_and_refreshed(shopping_api) -> None:
+    client, counts = shopping_api
+    assert client.get("/rest/V1/products/A1/reviews").status_code == 200
+    assert counts["token"] == 1
+    # the first token is revoked now, so the client fetches a new one
+    assert client.get("/rest/V1/products/B2/reviews").status_code == 200
+    assert counts["token"] == 2
+    assert client.get("/rest/V1/products/B2/reviews").status_code == 200
+    assert counts["token"] == 2
+
+
+def test_concurrent_401s_refresh_the_token_once(shopping_api) -> None:
+    client, counts = shopping_api
+    client.token()
+    # token-1 is revoked after its first request, the other threads get a 401
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(
+            pool.map(lambda _: client.get("/rest/V1/products/B2/reviews"), range(8))
+        )
+    assert all(r.status_code == 200 for r in responses)
+    assert counts["token"] == 2
+
+
+def test_reviews_snapshot(shopping_api) -> None:
+    client, counts = shopping_api
+    with client.snapshot():
+        client.prefetch_reviews(["A1", "B2", "A1"])
+        assert counts["get"] == 2
+        assert client.reviews("A1")[-1] == {"nickname": "alice", "ratings": []}
+        assert client.reviews("B2") == []
+        assert counts["get"] == 2
+    # outside of a snapshot the reviews are fetched again
+    client.reviews("A1")
+    assert counts["get"] == 3
+
+
+def test_program_html_review_targets_share_a_fetch(
+    shopping_api, monkeypatch
+) -> None:
+    client, counts = shopping_api
+    monkeypatch.setattr(helper_functions, "get_shopping_client", lambda: client)
+    plan = EvalPlan.compile(
+        {
+            "task_id": 0,
+            "intent": "",
+            "eval": {
+                "eval_types": ["program_html"],
+                "program_html": [
+                    {
+                        "url": "last",
+                        "locator": f"func:{helper}('A1')",
+                        "required_contents": {"exact_match": content},
+                    }
+                    for helper, content in [
+                        ("shopping_get_sku_latest_review_author", "alice"),
+                        ("shopping_get_sku_latest_review_title", "great"),
+                    ]
+                ],
+            },
+        }
+    )
+    evaluator = HTMLContentExactEvaluator()
+    page = PseudoPage(None, client.base_url)
+    REVIEWS["A1"][-1]["title"] = "Great"
+    try:
+        assert evaluator([create_stop_action("")], plan, page) == 1.0
+    finally:
+        del REVIEWS["A1"][-1]["title"]
+    assert evaluator.selections == ["alice", "Great"]
+    assert counts["get"] == 1
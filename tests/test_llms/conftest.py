@@ -0,0 +1,19 @@
+from typing import Any
+
+import pytest
+
+from scripts.mock_llm_server import MockLLM
+
+
+@pytest.fixture
+def chat_server(mock_llm: MockLLM) -> list[dict[str, Any]]:
+    """Answers every request, streamed or not, with its seed. Returns the
+    requests."""
+    requests: list[dict[str, Any]] = []
+
+    def respond(request: dict[str, Any]) -> str:
+        requests.append(request)
+        return f"seed {request.get('seed')}"
+
+    mock_llm.responder = respond
+    return requests
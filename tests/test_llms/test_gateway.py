@@ -0,0 +1,20 @@
+import time
+
+from llms.providers.gateway import RateLimiter
+
+
+def test_unlimited_acquire_does_not_write_the_state(tmp_path) -> None:
+    state_path = tmp_path / "openai.json"
+    limiter = RateLimiter(state_path)
+    for _ in range(100):
+        limiter.acquire(1000)
+    assert not state_path.exists()
+    assert (limiter.stats.requests, limiter.stats.waits) == (100, 0)
+
+    # the back-offs of the other workers still apply
+    RateLimiter(state_path).back_off(0.2)
+    start = time.time()
+    limiter.acquire(1000)
+    assert time.time() - start >= 0.2
+    assert limiter.stats.waits == 1
+
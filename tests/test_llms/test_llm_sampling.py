@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from llms import call_llm, call_llm_streaming
+from llms.lm_config import LMConfig
+from llms.response_cache import ResponseCache, set_response_cache
+
+MESSAGES = [{"role": "user", "content": "click the blue button"}]
+
+
+def _lm_config() -> LMConfig:
+    return LMConfig(
+        provider="openai",
+        model="gpt-4o",
+        mode="chat",
+        gen_config={
+            "temperature": 1.0,
+            "top_p": 0.9,
+            "context_length": 0,
+            "max_tokens": 16,
+        },
+    )
+
+
+def test_concurrent_samples_get_their_own_seed(
+    tmp_path, chat_server, monkeypatch
+) -> None:
+    monkeypatch.setenv("VWA_OPENAI_SEED", "7")
+    set_response_cache(ResponseCache(tmp_path))
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            responses = list(
+                executor.map(
+                    lambda i: call_llm(_lm_config(), MESSAGES, i), range(3)
+                )
+            )
+        assert responses == ["seed 7", "seed 8", "seed 9"]
+        assert sorted(r["seed"] for r in chat_server) == [7, 8, 9]
+
+        # the next run replays each sample from its own entry
+        cache = ResponseCache(tmp_path, mode="replay")
+        set_response_cache(cache)
+        assert call_llm(_lm_config(), MESSAGES, 2) == "seed 9"
+        assert call_llm(_lm_config(), MESSAGES) == "seed 7"
+        assert cache.stats.hits == 2
+    finally:
+        set_response_cache(None)
+
+
+def test_streamed_samples_get_their_own_seed(chat_server, monkeypatch) -> None:
+    monkeypatch.delenv("VWA_OPENAI_SEED", raising=False)
+    monkeypatch.delenv("OPENAI_SEED", raising=False)
+    response = call_llm_streaming(
+        _lm_config(), MESSAGES, lambda chunk: False, 3
+    )
+    assert response == "seed 3"
+    assert chat_server[-1]["seed"] == 3 and chat_server[-1]["stream"]
@@ -0,0 +1,92 @@
+import argparse
+
+import pytest
+
+from llms.lm_config import LMConfig, construct_llm_config
+from llms.response_cache import ResponseCache, ResponseCacheMiss, cache_key
+
+PROMPT = [{"role": "user", "content": "click the blue button"}]
+
+
+def _lm_config(**gen_config) -> LMConfig:
+    return LMConfig(
+        provider="openai",
+        model="gpt-4o",
+        mode="chat",
+        gen_config={"temperature": 1.0, "max_tokens": 16, **gen_config},
+    )
+
+
+class Provider(object):
+    """Numbers its responses"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, lm_config: LMConfig, prompt) -> str:
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+def test_repeated_prompts_replay_in_order(tmp_path) -> None:
+    provider = Provider()
+    cache = ResponseCache(tmp_path, mode="record")
+    # e.g. retries after parsing failures
+    assert [cache.call(_lm_config(), PROMPT, provider) for _ in range(3)] == [
+        "response 1",
+        "response 2",
+        "response 3",
+    ]
+
+    cache = ResponseCache(tmp_path, mode="replay")
+    assert [cache.call(_lm_config(), PROMPT, provider) for _ in range(3)] == [
+        "response 1",
+        "response 2",
+        "response 3",
+    ]
+    assert provider.calls == 3 and cache.stats.hits == 3
+    # the run asks more than what was recorded
+    with pytest.raises(ResponseCacheMiss):
+        cache.call(_lm_config(), PROMPT, provider)
+    assert provider.calls == 3
+
+
+def test_read_through_fills_the_misses(tmp_path) -> None:
+    provider = Provider()
+    ResponseCache(tmp_path).call(_lm_config(), PROMPT, provider)
+    cache = ResponseCache(tmp_path)
+    assert cache.call(_lm_config(), PROMPT, provider) == "response 1"
+    assert cache.call(_lm_config(), PROMPT, provider) == "response 2"
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stored) == (1, 1, 1)
+
+
+def test_cache_key() -> None:
+    key = cache_key(_lm_config(), PROMPT, seed=0)
+    assert cache_key(_lm_config(), PROMPT, seed=1) != key
+    assert cache_key(_lm_config(), PROMPT) != key
+    # streamed responses are cut after the action
+    assert cache_key(_lm_config(stream_actions=True), PROMPT, seed=0) != key
+    # the retry loop does not change the responses
+    assert cache_key(_lm_config(max_retry=3), PROMPT, seed=0) == key
+
+    args = argparse.Namespace(
+        provider="openai",
+        model="gpt-4o",
+        mode="chat",
+        temperature=1.0,
+        top_p=0.9,
+        context_length=0,
+        max_tokens=384,
+        stop_token=None,
+        max_obs_length=0,
+        obs_truncation="tokens",
+        obs_compression=False,
+        max_retry=1,
+        speculative_samples=1,
+        stream_actions=False,
+    )
+    plain = construct_llm_config(args)
+    streamed = construct_llm_config(
+        argparse.Namespace(**{**vars(args), "stream_actions": True})
+    )
+    assert cache_key(plain, PROMPT) != cache_key(streamed, PROMPT)
@@ -0,0 +1,63 @@
+import pytest
+
+from llms.tokenizers import ObservationTruncator, Tokenizer
+
+OBSERVATIONS = [
+    "[1] RootWebArea 'One Stop Market'\n\t[2] link 'Home'",
+    "[1] RootWebArea  'Café – 東京'\n\t[2] StaticText '  $ 12.99 '",
+    "\n".join(f"\t[{i}] link 'Garden Hose {i}'" for i in range(40)),
+]
+
+
+class SpaceTokenizer(object):
+    """A tokenizer whose decoding normalizes the spaces, as sentencepiece
+    ones may"""
+
+    def encode(self, text: str) -> list[int]:
+        return [len(word) for word in text.split()]
+
+    def decode(self, ids: list[int]) -> str:
+        return " ".join("x" * n for n in ids)
+
+
+@pytest.fixture(
+    params=[
+        ("openai", "gpt-4"),
+        ("huggingface", "hf-internal-testing/llama-tokenizer"),
+    ]
+)
+def tokenizer(request) -> tuple[str, Tokenizer]:
+    provider, model = request.param
+    try:
+        return provider, Tokenizer(provider, model)
+    except (ImportError, OSError, ConnectionError) as e:
+        pytest.skip(f"{model} tokenizer not available: {e!r}")
+
+
+def test_text_under_budget_is_returned_as_is() -> None:
+    truncator = ObservationTruncator(SpaceTokenizer(), "openai")
+    text = "a  b\n c"
+    # on the fast path
+    assert truncator(text, 100) == text
+    # on the tokenizing path, under budget by tokens but not by bytes
+    assert truncator(text, 3) == text
+    assert truncator.stats.fast_path == 1 and truncator.last_dropped_tokens == 0
+
+
+@pytest.mark.parametrize("mode", ["tokens", "lines"])
+def test_fast_and_tokenizing_paths_agree(tokenizer, mode) -> None:
+    provider, tok = tokenizer
+    for text in OBSERVATIONS:
+        n_tokens = len(tok.encode(text))
+        for max_length in [n_tokens // 2, n_tokens, n_tokens + 1, 10 * n_tokens]:
+            truncator = ObservationTruncator(tok, provider, mode=mode)
+            truncated = truncator(text, max_length)
+            if max_length >= n_tokens:
+                assert truncated == text
+                assert truncator.last_dropped_tokens == 0
+            else:
+                expected = tok.decode(tok.encode(text)[:max_length])
+                if mode == "lines" and "\n" in expected:
+                    expected = expected[: expected.rindex("\n")]
+                assert truncated == expected
+                assert truncator.last_dropped_tokens > 0